@@ -7,9 +7,9 @@ from sqlalchemy import pool
 
 from alembic import context
 
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
-from database import Base, DATABASE_URL
+from backend.database import Base, DATABASE_URL
 
 
 config = context.config
@@ -38,7 +38,8 @@ def run_migrations_offline() -> None:
 
 def run_migrations_online() -> None:
     configuration = config.get_section(config.config_ini_section)
-    configuration['sqlalchemy.url'] = DATABASE_URL
+    # An explicit sqlalchemy.url (e.g. set by backend.query_plans) wins over DATABASE_URL
+    configuration['sqlalchemy.url'] = config.get_main_option("sqlalchemy.url") or DATABASE_URL
 
     connectable = engine_from_config(
         configuration,
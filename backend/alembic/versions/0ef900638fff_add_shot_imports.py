@@ -0,0 +1,51 @@
+"""Add shot_imports for resumable shot list imports
+
+Revision ID: 0ef900638fff
+Revises: cf501ebe1322
+Create Date: 2026-10-16 22:05:31.127604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0ef900638fff'
+down_revision: Union[str, None] = 'cf501ebe1322'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('shot_imports',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(), nullable=False),
+    sa.Column('file_format', sa.String(), nullable=False),
+    sa.Column('spool_path', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('bytes_total', sa.BigInteger(), nullable=False),
+    sa.Column('bytes_processed', sa.BigInteger(), nullable=False),
+    sa.Column('records_committed', sa.Integer(), nullable=False),
+    sa.Column('shots_created', sa.Integer(), nullable=False),
+    sa.Column('shots_updated', sa.Integer(), nullable=False),
+    sa.Column('assets_created', sa.Integer(), nullable=False),
+    sa.Column('assets_updated', sa.Integer(), nullable=False),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_shot_imports_id'), 'shot_imports', ['id'], unique=False)
+    op.create_index(op.f('ix_shot_imports_project_id'), 'shot_imports', ['project_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_shot_imports_project_id'), table_name='shot_imports')
+    op.drop_index(op.f('ix_shot_imports_id'), table_name='shot_imports')
+    op.drop_table('shot_imports')
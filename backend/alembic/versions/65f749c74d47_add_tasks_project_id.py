@@ -0,0 +1,70 @@
+"""Denormalize project_id onto tasks
+
+Revision ID: 65f749c74d47
+Revises: 0ef900638fff
+Create Date: 2026-10-16 22:18:40.512937
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '65f749c74d47'
+down_revision: Union[str, None] = '0ef900638fff'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BACKFILL_BATCH_SIZE = 5000
+
+# A task's project is its shot's project, or its asset's when it has no shot
+BACKFILL = sa.text(
+    "UPDATE tasks SET project_id = COALESCE("
+    "(SELECT shots.project_id FROM shots WHERE shots.id = tasks.shot_id), "
+    "(SELECT assets.project_id FROM assets WHERE assets.id = tasks.asset_id)) "
+    "WHERE tasks.id >= :low AND tasks.id < :high AND tasks.project_id IS NULL"
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable and unconstrained first: adding the column is a catalog-only change
+    op.add_column('tasks', sa.Column('project_id', sa.Integer(), nullable=True))
+
+    bind = op.get_bind()
+    with op.get_context().autocommit_block():
+        # Backfill in id ranges, one short transaction each, so row locks are never held for long
+        low, high = bind.execute(sa.text("SELECT MIN(id), MAX(id) FROM tasks")).one()
+        if low is not None:
+            for start in range(low, high + 1, BACKFILL_BATCH_SIZE):
+                bind.execute(BACKFILL, {"low": start, "high": start + BACKFILL_BATCH_SIZE})
+
+    if bind.dialect.name == 'postgresql':
+        # Add the constraints NOT VALID and validate them separately: VALIDATE only takes a
+        # SHARE UPDATE EXCLUSIVE lock, and SET NOT NULL skips its full-table scan when a
+        # validated CHECK already proves it.
+        op.execute("ALTER TABLE tasks ADD CONSTRAINT tasks_project_id_fkey FOREIGN KEY (project_id) REFERENCES projects (id) NOT VALID")
+        op.execute("ALTER TABLE tasks VALIDATE CONSTRAINT tasks_project_id_fkey")
+        op.execute("ALTER TABLE tasks ADD CONSTRAINT tasks_project_id_not_null CHECK (project_id IS NOT NULL) NOT VALID")
+        op.execute("ALTER TABLE tasks VALIDATE CONSTRAINT tasks_project_id_not_null")
+        op.alter_column('tasks', 'project_id', existing_type=sa.Integer(), nullable=False)
+        op.drop_constraint('tasks_project_id_not_null', 'tasks', type_='check')
+    else:
+        with op.batch_alter_table('tasks') as batch_op:
+            batch_op.alter_column('project_id', existing_type=sa.Integer(), nullable=False)
+            batch_op.create_foreign_key('tasks_project_id_fkey', 'projects', ['project_id'], ['id'])
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tasks_project_id_status_assigned_to_id', 'tasks', ['project_id', 'status', 'assigned_to_id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tasks_project_id_status_assigned_to_id', table_name='tasks', postgresql_concurrently=True)
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.drop_column('project_id')
@@ -0,0 +1,52 @@
+"""Add the jobs table and thumbnail/proxy paths on files
+
+Revision ID: 7d100025eb05
+Revises: 989011eb7eb6
+Create Date: 2026-10-17 21:40:12.508117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d100025eb05'
+down_revision: Union[str, None] = '989011eb7eb6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('queue', sa.String(), nullable=False),
+    sa.Column('task', sa.String(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('priority', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_after', sa.DateTime(), nullable=False),
+    sa.Column('locked_by', sa.String(), nullable=True),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_jobs_queue_status_priority_id', 'jobs', ['queue', 'status', 'priority', 'id'], unique=False)
+    op.create_index('ix_jobs_status_locked_at', 'jobs', ['status', 'locked_at'], unique=False)
+    op.add_column('files', sa.Column('thumbnail_path', sa.String(), nullable=True))
+    op.add_column('files', sa.Column('proxy_path', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('files', 'proxy_path')
+    op.drop_column('files', 'thumbnail_path')
+    op.drop_index('ix_jobs_status_locked_at', table_name='jobs')
+    op.drop_index('ix_jobs_queue_status_priority_id', table_name='jobs')
+    op.drop_table('jobs')
@@ -0,0 +1,34 @@
+"""Add replica_heartbeat for read replica lag checks
+
+Revision ID: 87ac63b91efc
+Revises: 7d100025eb05
+Create Date: 2026-10-18 10:12:37.604519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '87ac63b91efc'
+down_revision: Union[str, None] = '7d100025eb05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    heartbeat = op.create_table('replica_heartbeat',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('beat_ms', sa.BigInteger(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # replicas.py only ever updates this row
+    op.bulk_insert(heartbeat, [{'id': 1, 'beat_ms': 0}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('replica_heartbeat')
@@ -0,0 +1,57 @@
+"""Add file_uploads for resumable uploads, and download tracking on files
+
+Revision ID: 989011eb7eb6
+Revises: ea6ba3d595b6
+Create Date: 2026-10-17 18:27:09.416530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '989011eb7eb6'
+down_revision: Union[str, None] = 'ea6ba3d595b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('file_uploads',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('storage_location_id', sa.Integer(), nullable=False),
+    sa.Column('shot_id', sa.Integer(), nullable=True),
+    sa.Column('asset_id', sa.Integer(), nullable=True),
+    sa.Column('filename', sa.String(), nullable=False),
+    sa.Column('relative_path', sa.String(), nullable=False),
+    sa.Column('part_path', sa.String(), nullable=True),
+    sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+    sa.Column('bytes_received', sa.BigInteger(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('file_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['asset_id'], ['assets.id'], ),
+    sa.ForeignKeyConstraint(['file_id'], ['files.id'], ),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.ForeignKeyConstraint(['shot_id'], ['shots.id'], ),
+    sa.ForeignKeyConstraint(['storage_location_id'], ['storage_locations.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_file_uploads_id'), 'file_uploads', ['id'], unique=False)
+    op.create_index(op.f('ix_file_uploads_project_id'), 'file_uploads', ['project_id'], unique=False)
+    op.add_column('files', sa.Column('download_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('files', sa.Column('last_downloaded_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('files', 'last_downloaded_at')
+    op.drop_column('files', 'download_count')
+    op.drop_index(op.f('ix_file_uploads_project_id'), table_name='file_uploads')
+    op.drop_index(op.f('ix_file_uploads_id'), table_name='file_uploads')
+    op.drop_table('file_uploads')
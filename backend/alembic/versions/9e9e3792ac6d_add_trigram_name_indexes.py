@@ -0,0 +1,48 @@
+"""Add pg_trgm indexes on searchable names
+
+Revision ID: 9e9e3792ac6d
+Revises: b3e71c0a9d25
+Create Date: 2026-10-17 14:18:52.604113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e9e3792ac6d'
+down_revision: Union[str, None] = 'b3e71c0a9d25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, column)
+INDEXES = [
+    ('ix_shots_name_trgm', 'shots', 'name'),
+    ('ix_assets_name_trgm', 'assets', 'name'),
+    ('ix_tasks_name_trgm', 'tasks', 'name'),
+    ('ix_project_members_display_name_trgm', 'project_members', 'display_name'),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Search on other backends uses the in-process index in search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        for name, table, column in INDEXES:
+            op.create_index(name, table, [column], unique=False, postgresql_using='gin',
+                            postgresql_ops={column: 'gin_trgm_ops'}, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
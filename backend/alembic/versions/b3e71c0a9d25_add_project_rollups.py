@@ -0,0 +1,50 @@
+"""Add project_rollups for the progress stats endpoint
+
+Revision ID: b3e71c0a9d25
+Revises: f954c83ada92
+Create Date: 2026-10-17 10:42:37.519306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e71c0a9d25'
+down_revision: Union[str, None] = 'f954c83ada92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('project_rollups',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('department', sa.String(), server_default='', nullable=False),
+    sa.Column('assignee_id', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('count', sa.BigInteger(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+    sa.PrimaryKeyConstraint('project_id', 'entity', 'status', 'department', 'assignee_id')
+    )
+    # Same counts as `python -m backend.rollups` would rebuild
+    for table, entity in (('shots', 'shots'), ('assets', 'assets')):
+        op.execute(
+            f"INSERT INTO project_rollups (project_id, entity, status, department, assignee_id, count) "
+            f"SELECT project_id, '{entity}', COALESCE(status, ''), '', 0, COUNT(*) FROM {table} "
+            f"GROUP BY project_id, COALESCE(status, '')"
+        )
+    op.execute(
+        "INSERT INTO project_rollups (project_id, entity, status, department, assignee_id, count) "
+        "SELECT t.project_id, 'tasks', COALESCE(t.status, ''), COALESCE(NULLIF(m.department, ''), 'Unassigned'), COALESCE(t.assigned_to_id, 0), COUNT(*) "
+        "FROM tasks t LEFT OUTER JOIN project_members m ON m.id = t.assigned_to_id "
+        "GROUP BY t.project_id, COALESCE(t.status, ''), COALESCE(NULLIF(m.department, ''), 'Unassigned'), COALESCE(t.assigned_to_id, 0)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('project_rollups')
@@ -0,0 +1,48 @@
+"""Add foreign-key and composite indexes for hot queries
+
+Revision ID: cea503d0bd82
+Revises: 5de2bd590cd7
+Create Date: 2026-10-16 21:02:14.318406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'cea503d0bd82'
+down_revision: Union[str, None] = '5de2bd590cd7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns)
+INDEXES = [
+    ('ix_projects_organization_id', 'projects', ['organization_id']),
+    ('ix_project_members_project_id_account_id', 'project_members', ['project_id', 'account_id']),
+    ('ix_project_members_account_id', 'project_members', ['account_id']),
+    ('ix_shots_project_id_name', 'shots', ['project_id', 'name']),
+    ('ix_assets_project_id_name', 'assets', ['project_id', 'name']),
+    ('ix_tasks_shot_id', 'tasks', ['shot_id']),
+    ('ix_tasks_asset_id', 'tasks', ['asset_id']),
+    ('ix_tasks_assigned_to_id', 'tasks', ['assigned_to_id']),
+    ('ix_task_dependencies_dependency_on_task_id', 'task_dependencies', ['dependency_on_task_id']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # On PostgreSQL build the indexes CONCURRENTLY so existing tables stay writable.
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
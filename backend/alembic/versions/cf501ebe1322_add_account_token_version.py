@@ -0,0 +1,29 @@
+"""Add accounts.token_version for access token revocation
+
+Revision ID: cf501ebe1322
+Revises: cea503d0bd82
+Create Date: 2026-10-16 21:34:52.604117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'cf501ebe1322'
+down_revision: Union[str, None] = 'cea503d0bd82'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('accounts', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('accounts') as batch_op:
+        batch_op.drop_column('token_version')
@@ -0,0 +1,44 @@
+"""Add size/mtime/fingerprint columns and a path key to files for the storage scanner
+
+Revision ID: ea6ba3d595b6
+Revises: 9e9e3792ac6d
+Create Date: 2026-10-17 16:02:41.339871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ea6ba3d595b6'
+down_revision: Union[str, None] = '9e9e3792ac6d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('files', sa.Column('size_bytes', sa.BigInteger(), nullable=True))
+    op.add_column('files', sa.Column('mtime_ns', sa.BigInteger(), nullable=True))
+    op.add_column('files', sa.Column('fingerprint', sa.String(), nullable=True))
+    op.add_column('files', sa.Column('scanned_at', sa.DateTime(), nullable=True))
+    op.add_column('files', sa.Column('missing_at', sa.DateTime(), nullable=True))
+    if op.get_bind().dialect.name == 'postgresql':
+        # The scanner merges a code-point-ordered directory walk with the stored paths.
+        # SQLite already compares bytewise.
+        op.alter_column('files', 'relative_path', type_=sa.String(collation='C'), existing_nullable=False)
+    op.create_index('ux_files_storage_location_id_relative_path', 'files', ['storage_location_id', 'relative_path'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_files_storage_location_id_relative_path', table_name='files')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column('files', 'relative_path', type_=sa.String(), existing_nullable=False)
+    op.drop_column('files', 'missing_at')
+    op.drop_column('files', 'scanned_at')
+    op.drop_column('files', 'fingerprint')
+    op.drop_column('files', 'mtime_ns')
+    op.drop_column('files', 'size_bytes')
@@ -1,31 +1,49 @@
 import os
+import threading
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List
+from typing import Optional, List, Dict
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Path
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached
 from pydantic import BaseModel
 
 # 相対インポート
 from . import database
+from .cache import TTLCache
+from .passwords import hasher
 
 SECRET_KEY = os.getenv("SECRET_KEY", "a_very_secret_key_that_should_be_in_env_file")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# (account_id, project_id) -> 認可済みプロジェクトのスナップショット
+# 許可された結果のみキャッシュする (拒否はキャッシュしないので、メンバー追加は即座に反映される)
+AUTHZ_CACHE_TTL_SECONDS = float(os.getenv("AUTHZ_CACHE_TTL_SECONDS", "60"))
+AUTHZ_CACHE_MAX_ENTRIES = int(os.getenv("AUTHZ_CACHE_MAX_ENTRIES", "10000"))
+authorization_cache = TTLCache(maxsize=AUTHZ_CACHE_MAX_ENTRIES, ttl=AUTHZ_CACHE_TTL_SECONDS)
+
+# 検証済みトークン -> クレーム (同じトークンの再検証でHMACとJSONデコードを省く)
+VERIFIED_TOKEN_CACHE_SECONDS = float(os.getenv("VERIFIED_TOKEN_CACHE_SECONDS", "60"))
+VERIFIED_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("VERIFIED_TOKEN_CACHE_MAX_ENTRIES", "10000"))
+verified_token_cache = TTLCache(maxsize=VERIFIED_TOKEN_CACHE_MAX_ENTRIES, ttl=VERIFIED_TOKEN_CACHE_SECONDS)
+
+# token_version の一覧を読み直す間隔。失効はこの秒数以内に全ワーカーへ反映される
+TOKEN_VERSION_REFRESH_SECONDS = float(os.getenv("TOKEN_VERSION_REFRESH_SECONDS", "30"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 class TokenData(BaseModel):
     account_name: Optional[str] = None
 
+# bcrypt はプロセスプール (passwords.hasher) で実行する。ログインは async 版を直接使う
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return hasher.verify_and_update(plain_password, hashed_password)[0]
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return hasher.hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -33,21 +51,114 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire_time})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def account_claims(account: database.Account) -> dict:
+    """APIが必要とするアカウント情報をトークンに載せ、リクエスト毎のアカウント検索を不要にする。"""
+    return {
+        "sub": account.account_name,
+        "aid": account.id,
+        "org": account.organization_id,
+        "typ": account.account_type,
+        "name": account.display_name,
+        "ver": account.token_version or 0,
+    }
+
+class TokenVersionList:
+    """
+    accounts.token_version のインメモリ写し。失効 (バージョン番号の更新) が一度でもあった
+    アカウントだけを保持するので小さい。TOKEN_VERSION_REFRESH_SECONDS 毎に読み直す。
+    """
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._versions: Dict[int, int] = {}
+        self._loaded_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def current(self, db: Session, account_id: int) -> int:
+        if time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self.refresh(db)
+        return self._versions.get(account_id, 0)
+
+    def refresh(self, db: Session) -> None:
+        # 他のスレッドが読み直し中なら、古い一覧のまま進める
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            rows = db.query(database.Account.id, database.Account.token_version).filter(database.Account.token_version > 0).all()
+            self._versions = {account_id: version for account_id, version in rows}
+            self._loaded_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def set(self, account_id: int, version: int) -> None:
+        self._versions[account_id] = version
+
+token_versions = TokenVersionList(TOKEN_VERSION_REFRESH_SECONDS)
+
+def _decode_token(token: str) -> Optional[dict]:
+    claims = verified_token_cache.get(token)
+    if claims is not None:
+        return claims
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    # 有効期限を超えてキャッシュしない
+    remaining = claims.get("exp", 0) - time.time()
+    if remaining > 0:
+        verified_token_cache.set(token, claims, ttl=min(VERIFIED_TOKEN_CACHE_SECONDS, remaining))
+    return claims
+
+def _account_from_claims(claims: dict) -> database.Account:
+    # セッションに属さないAccount。DBから読んだものと同じ属性をendpointに提供する
+    account = database.Account(
+        id=claims["aid"], account_name=claims["sub"], display_name=claims["name"],
+        account_type=claims["typ"], organization_id=claims["org"], token_version=claims["ver"],
+    )
+    make_transient_to_detached(account)
+    return account
+
+def revoke_account_tokens(db: Session, account_id: int) -> int:
+    """アカウントの発行済みトークンを全て失効させる (token_versionを進める)。新しいバージョンを返す。"""
+    account = db.query(database.Account).filter(database.Account.id == account_id).one()
+    account.token_version = (account.token_version or 0) + 1
+    db.commit()
+    token_versions.set(account_id, account.token_version)
+    invalidate_authorization(account_id=account_id)
+    return account.token_version
+
 def get_current_account(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> database.Account:
+    """
+    トークンのクレームからアカウントを復元する。通常はDBを参照しない。
+    トークンのバージョンがインメモリの一覧と一致しない場合のみDBで確認する。
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        account_name: Optional[str] = payload.get("sub")
-        if account_name is None:
-            raise credentials_exception
-        token_data = TokenData(account_name=account_name)
-    except JWTError:
+    payload = _decode_token(token)
+    if payload is None:
+        raise credentials_exception
+    account_name: Optional[str] = payload.get("sub")
+    if account_name is None:
         raise credentials_exception
-        
+    token_data = TokenData(account_name=account_name)
+
+    if "aid" in payload:
+        known_version = token_versions.current(db, payload["aid"])
+        if payload.get("ver", 0) == known_version:
+            return _account_from_claims(payload)
+        if payload.get("ver", 0) < known_version:
+            # バージョンは増える一方なので、古いトークンは失効済み
+            raise credentials_exception
+        # トークンの方が新しい = 一覧が古い。DBで確認する
+        account = db.query(database.Account).filter(database.Account.id == payload["aid"]).first()
+        if account is None or (account.token_version or 0) != payload.get("ver", 0):
+            raise credentials_exception
+        token_versions.set(account.id, account.token_version or 0)
+        return account
+
+    # クレームを持たない旧形式のトークン
     account = db.query(database.Account).filter(database.Account.account_name == token_data.account_name).first()
     if account is None:
         raise credentials_exception
@@ -66,6 +177,21 @@ def require_role(required_roles: List[str]):
         return current_account
     return role_checker
 
+def invalidate_authorization(account_id: Optional[int] = None, project_id: Optional[int] = None) -> int:
+    """
+    認可キャッシュを破棄する。メンバーの追加・ロール変更・アカウント種別の変更時に呼ぶこと。
+    引数を両方省略すると全件を破棄する。
+    """
+    return authorization_cache.invalidate(
+        lambda key: (account_id is None or key[0] == account_id) and (project_id is None or key[1] == project_id)
+    )
+
+def _detached_copy(project: database.Project) -> database.Project:
+    # セッションに属さないコピーを保持し、ヒット時は merge(load=False) でSQLを発行せずに再アタッチする
+    copy = database.Project(id=project.id, name=project.name, status=project.status, organization_id=project.organization_id)
+    make_transient_to_detached(copy)
+    return copy
+
 def get_project_from_path(
     project_id: int = Path(..., title="The ID of the project to access"),
     current_account: database.Account = Depends(get_current_active_account),
@@ -74,12 +200,18 @@ def get_project_from_path(
     """
     URLパスからproject_idを取得し、アクセス権を検証し、
     成功した場合にプロジェクトオブジェクトを返す、複合的な依存関係。
+    認可済みの (account_id, project_id) は authorization_cache に保持され、再検証ではDBを参照しない。
     """
+    cached = authorization_cache.get((current_account.id, project_id))
+    if cached is not None:
+        return db.merge(cached, load=False)
+
     project = db.query(database.Project).filter(database.Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail=f"Project with id {project_id} not found.")
 
     if current_account.account_type == 'admin':
+        authorization_cache.set((current_account.id, project_id), _detached_copy(project))
         return project
 
     membership = db.query(database.ProjectMember).filter(
@@ -92,5 +224,36 @@ def get_project_from_path(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You are not a member of this project.",
         )
-        
+
+    authorization_cache.set((current_account.id, project_id), _detached_copy(project))
     return project
+
+def authorize_project_stream(token: Optional[str], project_id: int) -> None:
+    """
+    イベントストリーム (SSE) やチャンクアップロードなど、長時間続くリクエスト用の認可。
+    EventSource はヘッダーを付けられないため、SSE ではトークンをクエリパラメータでも受け付ける。
+    ストリームの間DB接続を保持しないよう、専用のセッションで検証してすぐに閉じる。
+    """
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    db = database.SessionLocal()
+    try:
+        account = get_current_account(token=token, db=db)
+        get_project_from_path(project_id=project_id, current_account=account, db=db)
+    finally:
+        db.close()
+
+# --- Async variants (DB_ASYNC_MODE) ---
+# 同じ検証ロジックを AsyncSession.run_sync 経由で実行する。キャッシュにヒットすればDBへは行かない。
+if database.DB_ASYNC_MODE:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    async def get_current_account_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_db)) -> database.Account:
+        return await db.run_sync(lambda session: get_current_account(token=token, db=session))
+
+    async def get_project_from_path_async(
+        project_id: int = Path(..., title="The ID of the project to access"),
+        current_account: database.Account = Depends(get_current_account_async),
+        db: AsyncSession = Depends(database.get_async_db)
+    ) -> database.Project:
+        return await db.run_sync(lambda session: get_project_from_path(project_id=project_id, current_account=current_account, db=session))
@@ -0,0 +1,144 @@
+"""Row versions and tombstones for delta sync.
+
+Every write to a project's shots, assets, tasks or members takes the next
+value of that project's counter (``project_versions.version``) as its
+``change_seq``. Deletes leave a ``tombstones`` row with that sequence. A client
+that remembers the last sequence it saw asks for everything after it.
+
+The counter is bumped with ``UPDATE ... SET version = version + 1``. That
+row lock is held until commit, so writers to one project commit in sequence
+order, and a reader can never see sequence n+1 while n is still uncommitted.
+
+ORM writes are stamped automatically by a ``before_flush`` hook. Core
+``insert()``/``update()`` statements bypass the ORM, so they must add
+``stamp(db, project_id, entity)`` to their values themselves.
+
+Committed changes are also pushed to subscribers through events.py.
+"""
+import datetime
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import case, event, insert, select, update
+from sqlalchemy.orm import Session, joinedload
+
+from . import events
+from .response_cache import response_cache
+from .database import Asset, ProjectMember, ProjectVersion, Shot, Task, Tombstone
+
+# Model -> entity name used in tombstones and in the /changes payload
+TRACKED = {Shot: "shots", Asset: "assets", Task: "tasks", ProjectMember: "members"}
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def next_version(db: Session, project_id: int) -> int:
+    """Bump and return the project's change counter. Locks its row until the transaction ends."""
+    conn = db.connection()
+    version = conn.execute(
+        update(ProjectVersion).where(ProjectVersion.project_id == project_id)
+        .values(version=ProjectVersion.version + 1).returning(ProjectVersion.version)
+    ).scalar()
+    if version is None:
+        # Projects created before delta sync existed, or inserted outside the API
+        conn.execute(insert(ProjectVersion).values(project_id=project_id, version=1))
+        version = 1
+    return version
+
+
+def current_version(db: Session, project_id: int) -> int:
+    return db.execute(select(ProjectVersion.version).where(ProjectVersion.project_id == project_id)).scalar() or 0
+
+
+def stamp(db: Session, project_id: int, *entities: str) -> Dict[str, object]:
+    """Columns to add to a Core insert/update of one project's ``entities`` rows."""
+    seq = next_version(db, project_id)
+    for entity in entities:
+        events.record(db, project_id, entity, "bulk", None, seq)
+    return {"change_seq": seq, "updated_at": _utcnow()}
+
+
+def stamp_projects(db: Session, model, project_ids: Iterable[int]) -> Tuple[Dict[str, object], Dict[int, int]]:
+    """Values for one Core ``update()`` of ``model`` rows spanning several projects.
+
+    Each project gets its own sequence number, picked per row with a CASE on project_id.
+    Pass the RETURNING rows to ``record_rows`` so subscribers learn which ids changed.
+    """
+    seqs = {project_id: next_version(db, project_id) for project_id in sorted(project_ids)}
+    return {"change_seq": case(seqs, value=model.project_id), "updated_at": _utcnow()}, seqs
+
+
+def record_rows(db: Session, entity: str, op: str, rows) -> None:
+    for row in rows:
+        events.record(db, row.project_id, entity, op, row.id, row.change_seq)
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_changes(session: Session, flush_context, instances) -> None:
+    written = defaultdict(list)
+    deleted = defaultdict(list)
+    for obj in session.new:
+        if type(obj) in TRACKED:
+            written[obj.project_id].append(obj)
+    for obj in session.dirty:
+        if type(obj) in TRACKED and session.is_modified(obj, include_collections=False):
+            written[obj.project_id].append(obj)
+    for obj in session.deleted:
+        if type(obj) in TRACKED:
+            deleted[obj.project_id].append(obj)
+
+    now = _utcnow()
+    # 1回の flush につきプロジェクト毎に1つのシーケンス番号を使う
+    for project_id in sorted(set(written) | set(deleted)):
+        seq = next_version(session, project_id)
+        for obj in written.get(project_id, ()):
+            obj.change_seq, obj.updated_at = seq, now
+        for obj in deleted.get(project_id, ()):
+            obj.change_seq = seq  # not written (the row is deleted), but reported in its event
+            session.add(Tombstone(project_id=project_id, entity=TRACKED[type(obj)], entity_id=obj.id, change_seq=seq, deleted_at=now))
+
+
+@event.listens_for(Session, "after_flush")
+def _record_events(session: Session, flush_context) -> None:
+    # new/dirty/deleted still hold the pre-flush state here, and new rows now have their ids
+    for objects, op in ((session.new, "created"), (session.dirty, "updated"), (session.deleted, "deleted")):
+        for obj in objects:
+            if type(obj) not in TRACKED:
+                continue
+            if op == "updated" and not session.is_modified(obj, include_collections=False):
+                continue
+            events.record(session, obj.project_id, TRACKED[type(obj)], op, obj.id, obj.change_seq)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_events(session: Session) -> None:
+    # Cached bodies are keyed by version and can't go stale; this just frees them early
+    for project_id in session.info.get("pending_events", {}):
+        response_cache.invalidate_project(project_id)
+    events.publish_pending(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_events(session: Session) -> None:
+    events.discard_pending(session)
+
+
+def changes_since(db: Session, project_id: int, since: int) -> Dict[str, List]:
+    """Rows of the project written after ``since``, and ids deleted after it, up to the current version."""
+    version = current_version(db, project_id)
+    window = lambda model: (model.project_id == project_id, model.change_seq > since, model.change_seq <= version)
+    deleted = db.execute(
+        select(Tombstone.entity, Tombstone.entity_id).where(*window(Tombstone)).order_by(Tombstone.change_seq)
+    ).all()
+    return {
+        "cursor": max(version, since),
+        "shots": db.query(Shot).filter(*window(Shot)).order_by(Shot.change_seq).all(),
+        "assets": db.query(Asset).filter(*window(Asset)).order_by(Asset.change_seq).all(),
+        "members": db.query(ProjectMember).options(joinedload(ProjectMember.account))
+            .filter(*window(ProjectMember)).order_by(ProjectMember.change_seq).all(),
+        "tasks": db.query(Task).options(joinedload(Task.assigned_to).joinedload(ProjectMember.account))
+            .filter(*window(Task)).order_by(Task.change_seq).all(),
+        "deleted": [{"entity": entity, "id": entity_id} for entity, entity_id in deleted],
+    }
@@ -1,13 +1,13 @@
 import os
 import datetime
-from sqlalchemy import create_engine, Column, String, Integer, ForeignKey, Table, Date
+from sqlalchemy import create_engine, make_url, Column, String, Integer, BigInteger, ForeignKey, Table, Date, DateTime, Index, JSON
 from sqlalchemy.orm import sessionmaker, relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
 from dotenv import load_dotenv
+from fastapi import Request
 
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from .pool_metrics import instrumented_pool_class
+from . import replicas
 
 load_dotenv()
 
@@ -19,17 +19,72 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not found. Please ensure .env file exists in project root.")
 
-engine = create_engine(DATABASE_URL)
+# --- Connection pool ---
+# Size the pool per worker process: every uvicorn worker gets its own pool.
+# Checkout latency, in-use/overflow counts and timeouts are published by pool_metrics.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+
+def pool_options(url: str, name: str, async_engine: bool = False) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # In-memory SQLite lives in a single connection; keep SQLAlchemy's default pool
+        return {}
+    return {
+        "poolclass": instrumented_pool_class(name, async_engine=async_engine),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL, "primary"))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+# --- Read replicas (optional) ---
+# DATABASE_REPLICA_URLS: comma-separated. Endpoints marked @replicas.replica_reads read from a
+# healthy replica unless the client wrote recently (see replicas.py). Each replica gets its own pool.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+replica_engines = [create_engine(url, **pool_options(url, f"replica{i}")) for i, url in enumerate(DATABASE_REPLICA_URLS)]
+ReplicaSessionLocals = [sessionmaker(autocommit=False, autoflush=False, bind=e) for e in replica_engines]
+replica_set = replicas.ReplicaSet(engine, replica_engines)
+
+# --- Async engine (optional) ---
+# DB_ASYNC_MODE=1 serves the hot endpoints as `async def` on an AsyncSession, so a
+# request waiting on the database no longer holds a threadpool thread.
+# ASYNC_DATABASE_URL defaults to DATABASE_URL with the matching async driver
+# (asyncpg for PostgreSQL, aiosqlite for SQLite).
+DB_ASYNC_MODE = os.getenv("DB_ASYNC_MODE", "0").lower() in ("1", "true", "yes")
+
+def _async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgresql" and parsed.get_driver_name() != "psycopg":
+        return parsed.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+    if backend == "sqlite":
+        return parsed.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_database_url(DATABASE_URL)
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC_MODE:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, "primary_async", async_engine=True))
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False)
+    # Same replicas and order as replica_engines, which the health checks run on
+    AsyncReplicaSessionLocals = [
+        async_sessionmaker(bind=create_async_engine(_async_database_url(url), **pool_options(_async_database_url(url), f"replica{i}_async", async_engine=True)), autoflush=False)
+        for i, url in enumerate(DATABASE_REPLICA_URLS)
+    ]
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+Base = declarative_base()
 
 # --- Association Table for Task Dependencies ---
 task_dependency = Table(
@@ -37,9 +92,13 @@ task_dependency = Table(
     Base.metadata,
     Column("dependent_task_id", Integer, ForeignKey("tasks.id"), primary_key=True),
     Column("dependency_on_task_id", Integer, ForeignKey("tasks.id"), primary_key=True),
+    # The PK covers lookups by dependent_task_id; this covers the reverse direction.
+    Index("ix_task_dependencies_dependency_on_task_id", "dependency_on_task_id"),
 )
 
 # --- Core Models ---
+# Name search (search.py) uses pg_trgm GIN indexes on shots/assets/tasks.name and project_members.display_name.
+# They exist only on PostgreSQL and are created by migration 9e9e3792ac6d, not declared here.
 
 class Organization(Base):
     __tablename__ = "organizations"
@@ -57,6 +116,8 @@ class Account(Base):
     display_name = Column(String, nullable=False)
     hashed_password = Column(String, nullable=False)
     account_type = Column(String, nullable=False, default="artist") # e.g., admin, manager, artist, client
+    # Bumped to revoke every access token issued to this account (see auth.revoke_account_tokens)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False)
     organization = relationship("Organization", back_populates="accounts")
@@ -71,7 +132,7 @@ class Project(Base):
     name = Column(String, index=True, nullable=False)
     status = Column(String, default="active")
 
-    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False, index=True)
     organization = relationship("Organization", back_populates="projects")
 
     shots = relationship("Shot", back_populates="project", cascade="all, delete-orphan")
@@ -83,6 +144,11 @@ class Project(Base):
 
 class ProjectMember(Base):
     __tablename__ = "project_members"
+    # Membership check in auth.get_project_from_path
+    __table_args__ = (
+        Index("ix_project_members_project_id_account_id", "project_id", "account_id"),
+        Index("ix_project_members_project_id_change_seq", "project_id", "change_seq"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     department = Column(String, nullable=True) # e.g., "CG", "Production"
     role = Column(String, nullable=False) # e.g., "Director", "Lead Animator"
@@ -92,25 +158,42 @@ class ProjectMember(Base):
     project = relationship("Project", back_populates="members")
 
     # The actual person/account assigned to this role (can be null)
-    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=True, index=True)
     account = relationship("Account", back_populates="project_memberships")
 
+    # Delta sync (see changes.py): stamped with the project's next change sequence on every write
+    updated_at = Column(DateTime, nullable=True)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+
     # Tasks assigned to this project member/role
     tasks_assigned = relationship("Task", back_populates="assigned_to")
 
 class Shot(Base):
     __tablename__ = "shots"
+    # Per-project listing, sorted by name (also serves name-prefix filters)
+    __table_args__ = (
+        Index("ix_shots_project_id_name", "project_id", "name"),
+        Index("ix_shots_project_id_change_seq", "project_id", "change_seq"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, nullable=False)
     status = Column(String, default="pending")
 
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
     project = relationship("Project", back_populates="shots")
+
+    # Delta sync (see changes.py)
+    updated_at = Column(DateTime, nullable=True)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
     tasks = relationship("Task", back_populates="shot")
     files = relationship("File", back_populates="shot")
 
 class Asset(Base):
     __tablename__ = "assets"
+    __table_args__ = (
+        Index("ix_assets_project_id_name", "project_id", "name"),
+        Index("ix_assets_project_id_change_seq", "project_id", "change_seq"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, nullable=False)
     asset_type = Column(String, nullable=False)
@@ -118,11 +201,20 @@ class Asset(Base):
 
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
     project = relationship("Project", back_populates="assets")
+
+    # Delta sync (see changes.py)
+    updated_at = Column(DateTime, nullable=True)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
     tasks = relationship("Task", back_populates="asset")
     files = relationship("File", back_populates="asset")
 
 class Task(Base):
     __tablename__ = "tasks"
+    # Per-project task listing (optionally filtered by status / assignee) is one range scan
+    __table_args__ = (
+        Index("ix_tasks_project_id_status_assigned_to_id", "project_id", "status", "assigned_to_id"),
+        Index("ix_tasks_project_id_change_seq", "project_id", "change_seq"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     status = Column(String, default="todo")
@@ -130,11 +222,17 @@ class Task(Base):
     end_date = Column(Date, nullable=True)
     
     # A task is now assigned to a ProjectMember (role), not a User/Account
-    assigned_to_id = Column(Integer, ForeignKey("project_members.id"), nullable=True)
+    assigned_to_id = Column(Integer, ForeignKey("project_members.id"), nullable=True, index=True)
     assigned_to = relationship("ProjectMember", back_populates="tasks_assigned")
 
-    shot_id = Column(Integer, ForeignKey("shots.id"), nullable=True)
-    asset_id = Column(Integer, ForeignKey("assets.id"), nullable=True)
+    shot_id = Column(Integer, ForeignKey("shots.id"), nullable=True, index=True)
+    asset_id = Column(Integer, ForeignKey("assets.id"), nullable=True, index=True)
+    # Denormalized from the parent Shot/Asset; must be kept in sync when a task is created or moved
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+
+    # Delta sync (see changes.py)
+    updated_at = Column(DateTime, nullable=True)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
 
     shot = relationship("Shot", back_populates="tasks")
     asset = relationship("Asset", back_populates="tasks")
@@ -161,6 +259,11 @@ class StorageLocation(Base):
 
 class File(Base):
     __tablename__ = "files"
+    # Upsert key of the storage scanner, and its keyset walk of one location's paths in order
+    # (on PostgreSQL relative_path uses the "C" collation so that order matches Python's)
+    __table_args__ = (
+        Index("ux_files_storage_location_id_relative_path", "storage_location_id", "relative_path", unique=True),
+    )
     id = Column(Integer, primary_key=True, index=True)
     file_id = Column(String, unique=True, nullable=False)
     original_filename = Column(String, nullable=False)
@@ -181,9 +284,133 @@ class File(Base):
     shot = relationship("Shot", back_populates="files")
     asset = relationship("Asset", back_populates="files")
 
-def get_db():
-    db = SessionLocal()
+    # Filled in by storage_scan.py. A rescan re-fingerprints only files whose size or mtime changed.
+    size_bytes = Column(BigInteger, nullable=True)
+    mtime_ns = Column(BigInteger, nullable=True)
+    fingerprint = Column(String, nullable=True)
+    scanned_at = Column(DateTime, nullable=True)
+    missing_at = Column(DateTime, nullable=True) # set when a scan no longer finds the file
+    # Full downloads through GET /files/{id}/content (range requests past byte 0 are not counted)
+    download_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_downloaded_at = Column(DateTime, nullable=True)
+    # Renditions written by the thumbnails job (see thumbnails.py)
+    thumbnail_path = Column(String, nullable=True)
+    proxy_path = Column(String, nullable=True)
+
+# --- Shot list imports ---
+class ShotImport(Base):
+    """Progress and resume point of one CSV/EDL shot-list import (see shot_import.py)."""
+    __tablename__ = "shot_imports"
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    file_format = Column(String, nullable=False) # csv, edl
+    spool_path = Column(String, nullable=True) # uploaded file; removed once the import completes
+    status = Column(String, nullable=False, default="pending") # pending, running, completed, failed
+    bytes_total = Column(BigInteger, nullable=False, default=0)
+    bytes_processed = Column(BigInteger, nullable=False, default=0)
+    # Records already committed; a resumed import skips this many
+    records_committed = Column(Integer, nullable=False, default=0)
+    shots_created = Column(Integer, nullable=False, default=0)
+    shots_updated = Column(Integer, nullable=False, default=0)
+    assets_created = Column(Integer, nullable=False, default=0)
+    assets_updated = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    updated_at = Column(DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc),
+                        onupdate=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+# --- Resumable uploads ---
+class FileUpload(Base):
+    """One chunked upload into a storage location (see uploads.py). Becomes a File row when complete."""
+    __tablename__ = "file_uploads"
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False, index=True)
+    storage_location_id = Column(Integer, ForeignKey("storage_locations.id"), nullable=False)
+    shot_id = Column(Integer, ForeignKey("shots.id"), nullable=True)
+    asset_id = Column(Integer, ForeignKey("assets.id"), nullable=True)
+    filename = Column(String, nullable=False)
+    relative_path = Column(String, nullable=False) # destination, relative to the location's base_path
+    part_path = Column(String, nullable=True) # bytes received so far; moved into place on completion
+    size_bytes = Column(BigInteger, nullable=False)
+    # Bytes received and verified; the offset the next chunk must start at
+    bytes_received = Column(BigInteger, nullable=False, default=0)
+    status = Column(String, nullable=False, default="pending") # pending, receiving, completed, aborted
+    file_id = Column(Integer, ForeignKey("files.id"), nullable=True)
+    created_at = Column(DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    updated_at = Column(DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc),
+                        onupdate=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+# --- Background jobs ---
+class Job(Base):
+    """A unit of background work, claimed and run by `python -m backend.jobs` (see jobs.py)."""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # Claim: next queued job of a queue by priority; and the lease check on running jobs
+        Index("ix_jobs_queue_status_priority_id", "queue", "status", "priority", "id"),
+        Index("ix_jobs_status_locked_at", "status", "locked_at"),
+    )
+    id = Column(Integer, primary_key=True)
+    queue = Column(String, nullable=False, default="default")
+    task = Column(String, nullable=False) # name registered with jobs.task
+    payload = Column(JSON, nullable=False, default=dict)
+    priority = Column(Integer, nullable=False, default=0) # higher runs first
+    status = Column(String, nullable=False, default="queued") # queued, running, succeeded, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    finished_at = Column(DateTime, nullable=True)
+
+# --- Read replica lag ---
+class ReplicaHeartbeat(Base):
+    """One row (id 1). Stamped on the primary and read back from each replica to measure lag (see replicas.py)."""
+    __tablename__ = "replica_heartbeat"
+    id = Column(Integer, primary_key=True)
+    beat_ms = Column(BigInteger, nullable=False, default=0, server_default="0") # epoch milliseconds
+
+# --- Delta sync ---
+class ProjectVersion(Base):
+    """Per-project change counter. Every write to the project's shots, assets, members or tasks bumps it."""
+    __tablename__ = "project_versions"
+    project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+class Tombstone(Base):
+    """A deleted shot/asset/task/member, kept so delta-sync clients can drop it."""
+    __tablename__ = "tombstones"
+    __table_args__ = (Index("ix_tombstones_project_id_change_seq", "project_id", "change_seq"),)
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    entity = Column(String, nullable=False) # shots, assets, tasks, members
+    entity_id = Column(Integer, nullable=False)
+    change_seq = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime, nullable=False)
+
+# --- Progress rollups ---
+class ProjectRollup(Base):
+    """Row counts per project, entity, status, department and assignee, kept current by rollups.py."""
+    __tablename__ = "project_rollups"
+    project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
+    entity = Column(String, primary_key=True) # shots, assets, tasks
+    status = Column(String, primary_key=True) # '' when the row has no status
+    # Tasks only: the assignee's department, and the assignee (0 = unassigned); '' and 0 for shots and assets
+    department = Column(String, primary_key=True, default="", server_default="")
+    assignee_id = Column(Integer, primary_key=True, default=0, server_default="0")
+    count = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+def get_db(request: Request):
+    replica = replica_set.choose(request)
+    db = SessionLocal() if replica is None else ReplicaSessionLocals[replica]()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db(request: Request):
+    replica = replica_set.choose(request)
+    async with (AsyncSessionLocal() if replica is None else AsyncReplicaSessionLocals[replica]()) as db:
+        yield db
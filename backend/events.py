@@ -0,0 +1,253 @@
+"""Per-project push of shot/asset/task/member changes over Server-Sent Events.
+
+Writes are collected on the session as they flush (see changes.py). After
+commit, each project touched by the transaction gets one message:
+
+    {"project_id": 1, "cursor": 42,
+     "changes": [{"entity": "shots", "op": "updated", "id": 7}, {"entity": "tasks", "op": "bulk", "id": null}]}
+
+``cursor`` is the project's change sequence (the ``since`` of
+GET /projects/{id}/changes), so a client can fetch the rows or resume after
+a reconnect. Core bulk writes only report ``op: "bulk"`` for their entity.
+
+Fan-out goes through a broker picked by EVENT_BROKER:
+
+* ``memory`` (default): in-process, for a single worker.
+* ``postgres``: LISTEN/NOTIFY on the primary database, so every worker
+  receives every other worker's events. Needs psycopg2.
+
+Subscribers drain their queue in windows of EVENTS_COALESCE_SECONDS and send
+the merged result as one frame. A bulk edit of thousands of rows therefore
+reaches the browser as a single event.
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, func
+from sqlalchemy import select as sql_select
+from sqlalchemy.pool import NullPool
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+EVENT_BROKER = os.getenv("EVENT_BROKER", "memory").lower()
+EVENTS_COALESCE_SECONDS = float(os.getenv("EVENTS_COALESCE_SECONDS", "0.25"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+# Above this many ids an entity collapses to a single "bulk" change
+MAX_IDS_PER_FRAME = int(os.getenv("EVENTS_MAX_IDS_PER_FRAME", "200"))
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+NOTIFY_CHANNEL = "motk_events"
+NOTIFY_MAX_BYTES = 7900  # PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+
+
+def merge(messages: List[dict], max_ids: int = MAX_IDS_PER_FRAME) -> dict:
+    """Coalesce messages of one project: the last op per row wins, large entities become "bulk"."""
+    latest: Dict[tuple, str] = {}
+    for message in messages:
+        for change in message["changes"]:
+            key = (change["entity"], change["id"])
+            # created → updated is still "created" for a client that never saw the row
+            if not (latest.get(key) == "created" and change["op"] == "updated"):
+                latest[key] = change["op"]
+    per_entity = defaultdict(int)
+    for entity, row_id in latest:
+        per_entity[entity] += 1
+    changes = []
+    collapsed = set()
+    for (entity, row_id), op in latest.items():
+        if row_id is None or per_entity[entity] > max_ids:
+            if entity not in collapsed:
+                collapsed.add(entity)
+                changes.append({"entity": entity, "op": "bulk", "id": None})
+        else:
+            changes.append({"entity": entity, "op": op, "id": row_id})
+    return {
+        "project_id": messages[-1]["project_id"],
+        "cursor": max(m["cursor"] for m in messages),
+        "changes": changes,
+    }
+
+
+class Subscription:
+    def __init__(self, project_id: int):
+        self.project_id = project_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, message: dict) -> None:
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A stalled client: tell it to resync from its cursor instead of buffering forever
+            self.overflowed = True
+
+
+class InProcessBroker:
+    """Delivers messages to subscribers of this process only."""
+
+    def __init__(self):
+        self._subscribers: Dict[int, set] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, project_id: int) -> Subscription:
+        subscription = Subscription(project_id)
+        with self._lock:
+            self._subscribers[project_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.project_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.project_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, message: dict) -> None:
+        self._deliver(message)
+
+    def _deliver(self, message: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(message["project_id"], ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # Event loop already closed (worker shutting down)
+                pass
+
+
+class PostgresBroker(InProcessBroker):
+    """Publishes with pg_notify; one listener thread per worker delivers to local subscribers."""
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        # LISTEN holds its connection for the life of the worker; keep it out of the request pool
+        self._listen_engine = create_engine(engine.url, poolclass=NullPool)
+        self._listener: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def publish(self, message: dict) -> None:
+        payload = json.dumps(message, separators=(",", ":"))
+        if len(payload.encode()) > NOTIFY_MAX_BYTES:
+            payload = json.dumps(merge([message], max_ids=0), separators=(",", ":"))
+        # Delivered back to this worker too, through the listener
+        with self.engine.connect() as conn:
+            conn.execute(sql_select(func.pg_notify(NOTIFY_CHANNEL, payload)))
+            conn.commit()
+
+    def subscribe(self, project_id: int) -> Subscription:
+        with self._start_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="motk-event-listener", daemon=True)
+                self._listener.start()
+        return super().subscribe(project_id)
+
+    def _listen(self) -> None:
+        while True:
+            raw = None
+            try:
+                raw = self._listen_engine.raw_connection()
+                conn = raw.driver_connection
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                while True:
+                    if select.select([conn], [], [], EVENTS_HEARTBEAT_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._deliver(json.loads(notify.payload))
+            except Exception:
+                logger.exception("Event listener lost its connection; reconnecting")
+                time.sleep(1)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.invalidate()
+                    except Exception:
+                        pass
+
+
+def _make_broker():
+    if EVENT_BROKER == "postgres":
+        return PostgresBroker(database.engine)
+    if EVENT_BROKER != "memory":
+        raise ValueError(f"Unknown EVENT_BROKER '{EVENT_BROKER}' (expected memory or postgres)")
+    return InProcessBroker()
+
+
+broker = _make_broker()
+
+
+# --- Collecting changes on the session ---
+def record(session, project_id: int, entity: str, op: str, row_id: Optional[int], cursor: int) -> None:
+    """Queue a change; it is published when the session commits and dropped on rollback."""
+    pending = session.info.setdefault("pending_events", {})
+    message = pending.setdefault(project_id, {"project_id": project_id, "cursor": cursor, "changes": []})
+    message["cursor"] = max(message["cursor"], cursor)
+    if len(message["changes"]) <= MAX_IDS_PER_FRAME * 4:
+        message["changes"].append({"entity": entity, "op": op, "id": row_id})
+    elif message["changes"][-1] != {"entity": entity, "op": "bulk", "id": None}:
+        # Bound the per-transaction buffer; merge() collapses the entity anyway
+        message["changes"].append({"entity": entity, "op": "bulk", "id": None})
+
+
+def publish_pending(session) -> None:
+    for message in session.info.pop("pending_events", {}).values():
+        try:
+            broker.publish(merge([message]))
+        except Exception:
+            # The data is committed; clients catch up from their cursor on the next event
+            logger.exception("Failed to publish change event for project %s", message["project_id"])
+
+
+def discard_pending(session) -> None:
+    session.info.pop("pending_events", None)
+
+
+# --- SSE stream ---
+def _frame(message: dict) -> str:
+    return f"id: {message['cursor']}\nevent: changes\ndata: {json.dumps(message, separators=(',', ':'))}\n\n"
+
+
+async def stream(project_id: int, request):
+    subscription = broker.subscribe(project_id)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                first = await asyncio.wait_for(subscription.queue.get(), timeout=EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            batch = [first]
+            await asyncio.sleep(EVENTS_COALESCE_SECONDS)
+            while not subscription.queue.empty():
+                batch.append(subscription.queue.get_nowait())
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield f"event: resync\ndata: {json.dumps({'project_id': project_id})}\n\n"
+                continue
+            yield _frame(merge(batch))
+    finally:
+        broker.unsubscribe(subscription)
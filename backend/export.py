@@ -0,0 +1,88 @@
+"""Streaming NDJSON / CSV export of a project's shots, assets and tasks.
+
+Rows are read with Core selects on a server-side cursor (``stream_results`` +
+``yield_per``), so no ORM objects or Pydantic models are built. Each batch of
+EXPORT_BATCH_SIZE rows is encoded and sent before the next one is fetched,
+which keeps peak memory constant regardless of project size.
+"""
+import csv
+import datetime
+import io
+import json
+import os
+from typing import Iterator
+
+from sqlalchemy import select
+
+from . import database
+from .database import Account, Asset, ProjectMember, Shot, Task
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _shots(project_id: int):
+    return select(Shot.id, Shot.name, Shot.status).where(Shot.project_id == project_id).order_by(Shot.id)
+
+
+def _assets(project_id: int):
+    return select(Asset.id, Asset.name, Asset.asset_type, Asset.status).where(Asset.project_id == project_id).order_by(Asset.id)
+
+
+def _tasks(project_id: int):
+    # 担当者 (ProjectMember → Account) は joinedload ではなく外部結合の列として取り出す
+    return (
+        select(
+            Task.id, Task.name, Task.status, Task.start_date, Task.end_date, Task.shot_id, Task.asset_id,
+            Task.assigned_to_id,
+            ProjectMember.display_name.label("assigned_to_display_name"),
+            ProjectMember.department.label("assigned_to_department"),
+            Account.account_name.label("assigned_to_account_name"),
+        )
+        .outerjoin(ProjectMember, Task.assigned_to_id == ProjectMember.id)
+        .outerjoin(Account, ProjectMember.account_id == Account.id)
+        .where(Task.project_id == project_id)
+        .order_by(Task.id)
+    )
+
+
+ENTITIES = {"shots": _shots, "assets": _assets, "tasks": _tasks}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value
+
+
+def stream_export(entity: str, project_id: int, fmt: str) -> Iterator[bytes]:
+    """Yield the export one encoded batch at a time.
+
+    Uses its own connection: the generator keeps running after the request's
+    session has been closed.
+    """
+    stmt = ENTITIES[entity](project_id)
+    with database.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(stmt)
+        columns = list(result.keys())
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for batch in result.partitions():
+                writer.writerows([_csv_value(v) for v in row] for row in batch)
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0); buffer.truncate()
+            if buffer.tell():
+                # 0行の場合はヘッダーだけを返す
+                yield buffer.getvalue().encode("utf-8")
+        else:
+            for batch in result.partitions():
+                yield "".join(
+                    json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False) + "\n" for row in batch
+                ).encode("utf-8")
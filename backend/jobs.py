@@ -0,0 +1,309 @@
+"""Durable background jobs stored in the ``jobs`` table, run by a process pool.
+
+A request enqueues a job in its own transaction, so the job exists exactly
+when the write it belongs to was committed. The request then returns; the
+work runs in
+
+    python -m backend.jobs [--queue thumbnails=2 --queue default=4] [--workers N]
+
+Claiming is one statement:
+
+    UPDATE jobs SET status = 'running', ... WHERE id IN (
+        SELECT id FROM jobs WHERE queue = ? AND status = 'queued' AND run_after <= now
+        ORDER BY priority DESC, id LIMIT n FOR UPDATE SKIP LOCKED) RETURNING ...
+
+On PostgreSQL, SKIP LOCKED lets many runners claim side by side without
+waiting on each other's rows. SQLite has no row locks and drops the FOR
+UPDATE clause, but it runs the whole UPDATE under its database write lock,
+so two runners still never claim the same job.
+
+Each runner keeps at most ``limit`` jobs of a queue running at once (the
+``--queue name=limit`` option). Failed jobs are retried with exponential
+backoff (JOB_RETRY_BASE_SECONDS doubled per attempt, capped at
+JOB_RETRY_MAX_SECONDS, with jitter) until ``max_attempts``.
+
+A claim is a lease: the runner renews ``locked_at`` of its running jobs on
+every poll. A job whose lease is more than JOB_LEASE_SECONDS old belongs to a
+dead runner and is requeued. Keep the lease well above the longest task
+timeout (FFMPEG_TIMEOUT_SECONDS for thumbnails), so that a runner that can't
+renew for a while, e.g. during a database outage, doesn't lose jobs that are
+still running. Outcomes are only recorded by the runner that holds the job:
+if its lease was lost and the job requeued, the late result is dropped.
+Tasks must still be safe to run twice.
+
+Tasks are plain functions registered with ``@task("name", queue=...)`` in
+one of TASK_MODULES. They run in the pool's processes and take the job's
+JSON payload.
+"""
+import argparse
+import datetime
+import importlib
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import database
+from .database import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "7200"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "3600"))
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+# name=limit pairs: how many jobs of each queue one runner runs at once
+JOB_QUEUES = os.getenv("JOB_QUEUES", "default=2,thumbnails=2")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "0")) or os.cpu_count() or 1
+# Modules whose @task functions the runner loads
+TASK_MODULES = ["backend.thumbnails"]
+MAINTENANCE_SECONDS = 60
+
+TASKS: Dict[str, Callable[[dict], Any]] = {}
+TASK_QUEUES: Dict[str, str] = {}
+
+
+def task(name: str, queue: str = "default"):
+    """Register ``fn(payload)`` as the task ``name``; ``enqueue`` puts it on ``queue`` unless told otherwise."""
+    def register(fn):
+        TASKS[name] = fn
+        TASK_QUEUES[name] = queue
+        return fn
+    return register
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def enqueue(db: Session, name: str, payloads: List[dict], queue: Optional[str] = None, priority: int = 0,
+            delay_seconds: float = 0, max_attempts: int = 5) -> None:
+    """Add one job per payload in the caller's transaction. The caller commits."""
+    if not payloads:
+        return
+    queue = queue or TASK_QUEUES.get(name, "default")
+    now = _utcnow()
+    run_after = now + datetime.timedelta(seconds=delay_seconds)
+    db.execute(insert(Job), [
+        {"queue": queue, "task": name, "payload": payload, "priority": priority, "status": "queued", "attempts": 0,
+         "max_attempts": max_attempts, "run_after": run_after, "created_at": now}
+        for payload in payloads
+    ])
+
+
+# --- Claiming and outcomes (runner process) ---
+def claim(db: Session, queue: str, limit: int, worker_id: str) -> List[tuple]:
+    """Mark up to ``limit`` due jobs of ``queue`` running for ``worker_id``; returns (id, task, payload) and commits."""
+    now = _utcnow()
+    due = (select(Job.id).where(Job.queue == queue, Job.status == "queued", Job.run_after <= now)
+           .order_by(Job.priority.desc(), Job.id).limit(limit).with_for_update(skip_locked=True))
+    rows = db.execute(
+        update(Job).where(Job.id.in_(due.scalar_subquery()))
+        .values(status="running", locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1)
+        .returning(Job.id, Job.task, Job.payload)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return rows
+
+
+def retry_delay(attempts: int) -> float:
+    delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def renew(db: Session, job_ids: List[int], worker_id: str) -> int:
+    """Extend the lease of ``worker_id``'s running jobs; returns how many are still held."""
+    if not job_ids:
+        return 0
+    held = db.execute(
+        update(Job).where(Job.id.in_(job_ids), Job.status == "running", Job.locked_by == worker_id).values(locked_at=_utcnow())
+    ).rowcount
+    db.commit()
+    return held
+
+
+def finish(db: Session, job_id: int, worker_id: str, error: Optional[str] = None) -> bool:
+    """Record a job's outcome: succeeded, or failed and either rescheduled or given up.
+
+    Only while ``worker_id`` still holds the job; returns False (and changes nothing) if its lease was lost.
+    """
+    now = _utcnow()
+    held = (Job.id == job_id, Job.status == "running", Job.locked_by == worker_id)
+    if error is None:
+        result = db.execute(update(Job).where(*held).values(status="succeeded", finished_at=now, locked_by=None, last_error=None))
+        db.commit()
+        return result.rowcount == 1
+    job = db.execute(select(Job.attempts, Job.max_attempts).where(*held)).first()
+    if job is None:
+        db.commit()
+        return False
+    values = {"locked_by": None, "locked_at": None, "last_error": error[-4000:]}
+    if job.attempts >= job.max_attempts:
+        values.update(status="failed", finished_at=now)
+    else:
+        values.update(status="queued", run_after=now + datetime.timedelta(seconds=retry_delay(job.attempts)))
+    result = db.execute(update(Job).where(*held).values(**values))
+    db.commit()
+    return result.rowcount == 1
+
+
+def requeue_expired(db: Session) -> int:
+    """Requeue jobs whose runner stopped renewing their lease (crashed or killed) and prune old finished jobs."""
+    now = _utcnow()
+    expired = db.execute(
+        update(Job).where(Job.status == "running", Job.locked_at < now - datetime.timedelta(seconds=JOB_LEASE_SECONDS))
+        .values(status="queued", locked_by=None, locked_at=None, run_after=now, last_error="lease expired")
+    ).rowcount
+    db.execute(delete(Job).where(Job.status == "succeeded", Job.finished_at < now - datetime.timedelta(days=JOB_RETENTION_DAYS)))
+    db.commit()
+    return expired
+
+
+def stats(db: Session) -> Dict[str, Dict[str, int]]:
+    """Job counts per queue and status."""
+    counts: Dict[str, Dict[str, int]] = {}
+    for queue, status, n in db.execute(select(Job.queue, Job.status, func.count()).group_by(Job.queue, Job.status)):
+        counts.setdefault(queue, {})[status] = n
+    return counts
+
+
+# --- Worker processes ---
+def _load_tasks() -> None:
+    for module in TASK_MODULES:
+        importlib.import_module(module)
+
+
+def _init_worker() -> None:
+    # A forked child must not reuse the parent's pooled connections
+    database.engine.dispose(close=False)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _load_tasks()
+
+
+def run_task(name: str, payload: dict) -> None:
+    fn = TASKS.get(name)
+    if fn is None:
+        raise LookupError(f"Unknown task '{name}'.")
+    fn(payload)
+
+
+# --- Runner ---
+def parse_queues(specs: List[str]) -> Dict[str, int]:
+    queues = {}
+    for spec in specs:
+        for item in spec.split(","):
+            name, _, limit = item.strip().partition("=")
+            if name:
+                queues[name] = int(limit or 1)
+    return queues
+
+
+def _database_error(db: Session, what: str) -> None:
+    """Log a failed runner step and reset the session; the step is retried on the next poll."""
+    logger.exception("Could not %s; retrying on the next poll", what)
+    try:
+        db.rollback()
+    except Exception:
+        logger.exception("Rollback failed")
+
+
+def run(queues: Dict[str, int], workers: int, poll_seconds: float = JOB_POLL_SECONDS) -> None:
+    """Claim and run jobs until SIGTERM/SIGINT, then let the running ones finish.
+
+    Database errors (an outage, a failover) never stop the runner. Each step that fails is
+    retried on the next poll, and running jobs keep running. Outcomes that couldn't be recorded
+    are kept until they are.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    running: Dict[Any, tuple] = {}  # future -> (job id, queue)
+    unrecorded: Dict[int, Optional[str]] = {}  # job id -> error (None for success), for finished jobs
+    next_maintenance = 0.0
+    with database.SessionLocal() as db, ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        while not stopping or running or unrecorded:
+            if not stopping and time.monotonic() >= next_maintenance:
+                try:
+                    expired = requeue_expired(db)
+                    if expired:
+                        logger.warning("Requeued %d jobs whose lease expired", expired)
+                    next_maintenance = time.monotonic() + MAINTENANCE_SECONDS
+                except Exception:
+                    _database_error(db, "requeue expired jobs")
+            if not stopping:
+                busy = {}
+                for job_id, queue in running.values():
+                    busy[queue] = busy.get(queue, 0) + 1
+                for queue, limit in queues.items():
+                    free = min(limit - busy.get(queue, 0), workers - len(running))
+                    if free <= 0:
+                        continue
+                    try:
+                        claimed = claim(db, queue, free, worker_id)
+                    except Exception:
+                        _database_error(db, f"claim jobs from queue '{queue}'")
+                        break
+                    for job_id, name, payload in claimed:
+                        running[pool.submit(run_task, name, payload)] = (job_id, queue)
+            for job_id, error in list(unrecorded.items()):
+                try:
+                    if not finish(db, job_id, worker_id, error):
+                        logger.warning("Job %d finished after its lease was lost; result dropped", job_id)
+                except Exception:
+                    _database_error(db, f"record the outcome of job {job_id}")
+                    break
+                del unrecorded[job_id]
+            if not running:
+                time.sleep(poll_seconds)
+                continue
+            job_ids = [job_id for job_id, _ in running.values()]
+            try:
+                held = renew(db, job_ids, worker_id)
+                if held < len(job_ids):
+                    logger.warning("Lost the lease on %d running jobs; their results will be dropped", len(job_ids) - held)
+            except Exception:
+                # The lease has room for this; keep the jobs running
+                _database_error(db, "renew job leases")
+            done, _ = wait(list(running), timeout=poll_seconds, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id, _ = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    logger.warning("Job %d failed: %r", job_id, error)
+                # Recorded at the top of the next iteration, and kept there until that succeeds
+                unrecorded[job_id] = None if error is None else f"{type(error).__name__}: {error}"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queue", action="append", default=[], metavar="NAME=LIMIT",
+                        help=f"queue to work and how many of its jobs to run at once; repeatable (default: {JOB_QUEUES})")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help=f"worker processes (default: {JOB_WORKERS})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    _load_tasks()
+    queues = parse_queues(args.queue or [JOB_QUEUES])
+    logger.info("Working queues %s with %d processes", ", ".join(f"{q}={n}" for q, n in queues.items()), args.workers)
+    run(queues, args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
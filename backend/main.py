@@ -1,13 +1,22 @@
 import datetime
+import os
 from datetime import timedelta
-from fastapi import FastAPI, Depends, HTTPException, status
+from urllib.parse import quote
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Header, UploadFile, File, BackgroundTasks, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session, joinedload
-from typing import List, Optional
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from sqlalchemy import insert, delete, update
+from sqlalchemy.orm import Session, joinedload, noload
+from typing import Dict, List, Optional
 
 # --- データベースモデルのインポート ---
 from .database import (
     get_db,
+    get_async_db,
+    SessionLocal,
+    DB_ASYNC_MODE,
+    replica_set,
     Organization as DBOrganization,
     Project as DBProject,
     Account as DBAccount,
@@ -15,10 +24,35 @@ from .database import (
     Shot as DBShot,
     Asset as DBAsset,
     Task as DBTask,
+    task_dependency,
+    ShotImport as DBShotImport,
+    File as DBFile,
+    FileUpload as DBFileUpload,
+    StorageLocation as DBStorageLocation,
+    ProjectVersion as DBProjectVersion,
 )
 
+if DB_ASYNC_MODE:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
 # --- 認証モジュールをインポート ---
 from . import auth
+from . import pool_metrics
+from . import shot_import
+from . import export
+from . import task_graph
+from . import changes
+from . import events
+from . import passwords
+from . import rollups
+from . import search
+from . import uploads
+from . import jobs
+from . import request_metrics
+from . import replicas
+from . import thumbnails
+from .response_cache import response_cache, dumps
+from .pagination import paginate, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 from pydantic import BaseModel
 
@@ -26,6 +60,11 @@ app = FastAPI(
     title="MOTK Production Management System API",
     description="API with Delete Capabilities."
 )
+# エンドポイントを cProfile でサンプリングできるようにする (request_metrics.py)。ルート定義より前に設定すること
+app.router.route_class = request_metrics.InstrumentedRoute
+
+@app.on_event("shutdown")
+def shutdown_password_hasher(): passwords.hasher.shutdown()
 
 # --- CORS設定 ---
 from fastapi.middleware.cors import CORSMiddleware
@@ -35,7 +74,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # SPA はこのヘッダーを保存して以降のリクエストで送り返す (read-your-writes, replicas.py)
+    expose_headers=[replicas.STICKY_HEADER],
 )
+# ルート別レイテンシ・SQL 件数・N+1 検出。最後に追加したミドルウェアが最も外側になる
+# 書き込んだクライアントの読み取りを一定時間プライマリに固定する (replicas.py)
+app.add_middleware(replicas.ReplicaRoutingMiddleware, replica_set=replica_set)
+app.add_middleware(request_metrics.RequestMetricsMiddleware)
 
 # --- Pydantic Schemas ---
 # (Pydanticモデルの定義は変更なし...省略)
@@ -85,11 +130,24 @@ class Asset(AssetBase):
     class Config: from_attributes = True
 class TaskBase(BaseModel): name: str; status: str = "todo"; start_date: Optional[datetime.date] = None; end_date: Optional[datetime.date] = None
 class TaskCreate(TaskBase): assigned_to_id: int; shot_id: Optional[int] = None; asset_id: Optional[int] = None
+class TaskUpdate(BaseModel):
+    name: Optional[str] = None
+    status: Optional[str] = None
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+class TaskDependencyCreate(BaseModel): depends_on_id: int
+# 一括更新: ids か filter のどちらか一方で対象を指定し、changes の項目を全ての対象に設定する
+class ShotBulkFilter(BaseModel): project_id: int; status: Optional[List[str]] = None; name_prefix: Optional[str] = None
+class ShotBulkUpdate(BaseModel): ids: Optional[List[int]] = None; filter: Optional[ShotBulkFilter] = None; changes: ShotUpdate
+class TaskBulkFilter(BaseModel): project_id: int; status: Optional[List[str]] = None; assigned_to_id: Optional[List[int]] = None; name_prefix: Optional[str] = None
+class TaskBulkChanges(TaskUpdate): assigned_to_id: Optional[int] = None
+class TaskBulkUpdate(BaseModel): ids: Optional[List[int]] = None; filter: Optional[TaskBulkFilter] = None; changes: TaskBulkChanges
 class Task(TaskBase):
     id: int
     assigned_to_id: int
     shot_id: Optional[int]
     asset_id: Optional[int]
+    project_id: int
     assigned_to: ProjectMember
     class Config: from_attributes = True
 class ProjectDetails(ProjectBase):
@@ -100,16 +158,103 @@ class ProjectDetails(ProjectBase):
     shots: List[Shot] = []
     assets: List[Asset] = []
     class Config: from_attributes = True
+class ShotPage(BaseModel): rows: List[Shot]; next_cursor: Optional[str] = None; total: Optional[int] = None
+class AssetPage(BaseModel): rows: List[Asset]; next_cursor: Optional[str] = None; total: Optional[int] = None
+class TaskPage(BaseModel): rows: List[Task]; next_cursor: Optional[str] = None; total: Optional[int] = None
+class TaskScheduleEntry(BaseModel):
+    task_id: int
+    duration_days: int
+    earliest_start: datetime.date
+    earliest_finish: datetime.date
+    latest_start: datetime.date
+    latest_finish: datetime.date
+    slack_days: int
+    critical: bool
+class ProjectSchedule(BaseModel):
+    project_start: datetime.date
+    project_finish: datetime.date
+    topological_order: List[int]
+    critical_path: List[int]
+    tasks: List[TaskScheduleEntry]
+class DeletedEntity(BaseModel): entity: str; id: int
+class ProjectChanges(BaseModel):
+    cursor: int
+    shots: List[Shot] = []
+    assets: List[Asset] = []
+    members: List[ProjectMember] = []
+    tasks: List[Task] = []
+    deleted: List[DeletedEntity] = []
+class EntityStats(BaseModel): total: int = 0; by_status: Dict[str, int] = {}
+class TaskStats(EntityStats): by_department: Dict[str, int] = {}; by_assignee: Dict[int, int] = {}
+class ProjectStats(BaseModel): project_id: int; shots: EntityStats; assets: EntityStats; tasks: TaskStats
+class SearchHit(BaseModel): entity: str; id: int; project_id: int; name: str; score: float
+class SearchResults(BaseModel): rows: List[SearchHit]; next_offset: Optional[int] = None
+class ShotImportStatus(BaseModel):
+    id: int
+    project_id: int
+    filename: str
+    file_format: str
+    status: str
+    bytes_total: int
+    bytes_processed: int
+    records_committed: int
+    shots_created: int
+    shots_updated: int
+    assets_created: int
+    assets_updated: int
+    error: Optional[str] = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+    class Config: from_attributes = True
+
+class FileUploadCreate(BaseModel):
+    filename: str
+    size_bytes: int
+    storage_location_id: Optional[int] = None
+    shot_id: Optional[int] = None
+    asset_id: Optional[int] = None
+class FileUploadStatus(BaseModel):
+    id: int
+    project_id: int
+    storage_location_id: int
+    shot_id: Optional[int] = None
+    asset_id: Optional[int] = None
+    filename: str
+    relative_path: str
+    size_bytes: int
+    bytes_received: int
+    status: str
+    file_id: Optional[int] = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+    class Config: from_attributes = True
 
 # --- API Endpoints ---
 # (Root, Authentication, Organization, Account, Projectのエンドポイントは変更なし)
 @app.get("/", tags=["Root"])
 def read_root(): return {"message": "MOTK Backend is running with robust access control!"}
+# ログインは async。bcrypt はプロセスプールで実行し、待つ間リクエスト用スレッドもDB接続も占有しない
+def _find_login_account(account_name: str) -> Optional[DBAccount]:
+    with SessionLocal() as db: return db.query(DBAccount).filter(DBAccount.account_name == account_name).first()
+def _store_rehashed_password(account_id: int, old_hash: str, new_hash: str) -> None:
+    # 同時ログインで二重に更新しないよう、古いハッシュのままの場合のみ書き換える
+    with SessionLocal() as db: db.execute(update(DBAccount).where(DBAccount.id == account_id, DBAccount.hashed_password == old_hash).values(hashed_password=new_hash)); db.commit()
 @app.post("/token", response_model=Token, tags=["Authentication"])
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    account = db.query(DBAccount).filter(DBAccount.account_name == form_data.username).first()
-    if not account or not auth.verify_password(form_data.password, account.hashed_password): raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password", headers={"WWW-Authenticate": "Bearer"})
-    access_token = auth.create_access_token(data={"sub": account.account_name}); return {"access_token": access_token, "token_type": "bearer"}
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    client_ip = request.client.host if request.client else None
+    retry_after = passwords.login_throttle.retry_after(form_data.username, client_ip)
+    if retry_after is not None: raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many failed login attempts. Try again later.", headers={"Retry-After": str(retry_after)})
+    account = await run_in_threadpool(_find_login_account, form_data.username)
+    verified, new_hash = False, None
+    if account:
+        try: verified, new_hash = await passwords.hasher.verify_and_update_async(form_data.password, account.hashed_password)
+        except passwords.HasherBusy: raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Login is busy. Try again shortly.", headers={"Retry-After": "1"})
+    if not verified:
+        passwords.login_throttle.record_failure(form_data.username, client_ip)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password", headers={"WWW-Authenticate": "Bearer"})
+    passwords.login_throttle.record_success(form_data.username)
+    if new_hash: await run_in_threadpool(_store_rehashed_password, account.id, account.hashed_password, new_hash)
+    access_token = auth.create_access_token(data=auth.account_claims(account)); return {"access_token": access_token, "token_type": "bearer"}
 @app.post("/organizations/", response_model=Organization, tags=["Organizations"])
 def create_organization(org: OrganizationCreate, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.require_role(["admin"]))):
     db_org = DBOrganization(name=org.name); db.add(db_org); db.commit(); db.refresh(db_org); return db_org
@@ -121,23 +266,130 @@ def read_accounts_me(current_account: DBAccount = Depends(auth.get_current_activ
 def create_account(account: AccountCreate, db: Session = Depends(get_db)):
     if not db.query(DBOrganization).filter(DBOrganization.id == account.organization_id).first(): raise HTTPException(status_code=404, detail="Organization not found")
     if db.query(DBAccount).filter(DBAccount.account_name == account.account_name).first(): raise HTTPException(status_code=400, detail="Account name already exists")
-    hashed_password = auth.get_password_hash(account.password); db_account = DBAccount(**account.model_dump(exclude={"password"}), hashed_password=hashed_password); db.add(db_account); db.commit(); db.refresh(db_account); return db_account
+    try: hashed_password = auth.get_password_hash(account.password)
+    except passwords.HasherBusy: raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Password hashing is busy. Try again shortly.", headers={"Retry-After": "1"})
+    db_account = DBAccount(**account.model_dump(exclude={"password"}), hashed_password=hashed_password); db.add(db_account); db.commit(); db.refresh(db_account); return db_account
 @app.get("/accounts/", response_model=List[AccountResponse], tags=["Accounts"])
+@replicas.replica_reads
 def get_accounts(db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)): return db.query(DBAccount).all()
+@app.post("/accounts/{account_id}/revoke-tokens", status_code=status.HTTP_204_NO_CONTENT, tags=["Accounts"])
+def revoke_account_tokens(account_id: int, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
+    # 本人または管理者のみ。発行済みの全アクセストークンを無効にする
+    if current_account.id != account_id and current_account.account_type != 'admin': raise HTTPException(status_code=403, detail="Operation not permitted.")
+    if not db.query(DBAccount).filter(DBAccount.id == account_id).first(): raise HTTPException(status_code=404, detail="Account not found")
+    auth.revoke_account_tokens(db, account_id)
+    return
 @app.post("/projects/", response_model=ProjectDetails, tags=["Projects"])
 def create_project(project: ProjectCreate, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.require_role(["admin", "manager"]))):
     if not db.query(DBOrganization).filter(DBOrganization.id == project.organization_id).first(): raise HTTPException(status_code=404, detail="Organization not found")
-    db_project = DBProject(name=project.name, organization_id=project.organization_id); db.add(db_project); db.commit(); db.refresh(db_project); return db_project
+    db_project = DBProject(name=project.name, organization_id=project.organization_id); db.add(db_project); db.flush()
+    db.add(DBProjectVersion(project_id=db_project.id, version=0)); db.commit(); db.refresh(db_project); return db_project
 @app.get("/projects/", response_model=List[ProjectList], tags=["Projects"])
+@replicas.replica_reads
 def get_projects(db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
     if current_account.account_type in ['admin', 'manager']: return db.query(DBProject).filter(DBProject.organization_id == current_account.organization_id).all()
     return db.query(DBProject).join(DBProjectMember).filter(DBProjectMember.account_id == current_account.id).all()
-@app.get("/projects/{project_id}", response_model=ProjectDetails, tags=["Projects"])
-def get_project_details(project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
-    return db.query(DBProject).filter(DBProject.id == project.id).options(joinedload(DBProject.members).joinedload(DBProjectMember.account), joinedload(DBProject.shots), joinedload(DBProject.assets)).one()
+# --- Conditional GET (ETag) ---
+# ETag はプロジェクトの変更カウンター (project_versions) から作る。
+# 304 の判定では認可チェックとカウンターの1行だけを読み、エンティティのテーブルには触れない。
+# カウンターはペイロードより先に読むこと (逆だと古い内容に新しいETagが付き得る)。
+# 本文は (project_id, 表現, バージョン) をキーにシリアライズ済みのJSONバイト列としてキャッシュする (response_cache.py)。
+def _etag(project_id: int, version: int, variant: str) -> str:
+    return f'"{project_id}-{version}-{variant}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header: return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def _versioned_response(etag: str, body: Optional[bytes] = None) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if body is None: return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _load_project_details(db: Session, project_id: int, summary: bool) -> DBProject:
+    # summary=true はメンバーのみを返す (ショット/アセットはページングAPIから取得する)
+    children = [noload(DBProject.shots), noload(DBProject.assets)] if summary else [joinedload(DBProject.shots), joinedload(DBProject.assets)]
+    return db.query(DBProject).filter(DBProject.id == project_id).options(joinedload(DBProject.members).joinedload(DBProjectMember.account), *children).one()
+def _project_details_json(db: Session, project_id: int, summary: bool) -> bytes:
+    return dumps(ProjectDetails.model_validate(_load_project_details(db, project_id, summary)).model_dump())
+if DB_ASYNC_MODE:
+    @app.get("/projects/{project_id}", response_model=ProjectDetails, tags=["Projects"])
+    @replicas.replica_reads
+    async def get_project_details(request: Request, summary: bool = False, project: DBProject = Depends(auth.get_project_from_path_async), db: AsyncSession = Depends(get_async_db)):
+        variant = "summary" if summary else "details"
+        version = await db.run_sync(lambda session: changes.current_version(session, project.id))
+        etag = _etag(project.id, version, variant)
+        if _etag_matches(request, etag): return _versioned_response(etag)
+        # run_sync内でシリアライズまで行い、イベントループ上で遅延ロードが起きないようにする
+        body = await response_cache.get_or_create_async((project.id, variant, version), lambda: db.run_sync(lambda session: _project_details_json(session, project.id, summary)))
+        return _versioned_response(etag, body)
+else:
+    @app.get("/projects/{project_id}", response_model=ProjectDetails, tags=["Projects"])
+    @replicas.replica_reads
+    def get_project_details(request: Request, summary: bool = False, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+        variant = "summary" if summary else "details"
+        version = changes.current_version(db, project.id)
+        etag = _etag(project.id, version, variant)
+        if _etag_matches(request, etag): return _versioned_response(etag)
+        body = response_cache.get_or_create((project.id, variant, version), lambda: _project_details_json(db, project.id, summary))
+        return _versioned_response(etag, body)
 @app.post("/projects/{project_id}/members", response_model=ProjectMember, tags=["Project Members"])
 def create_project_member(member_data: ProjectMemberCreate, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
-    db_member = DBProjectMember(**member_data.model_dump(), project_id=project.id); db.add(db_member); db.commit(); db.refresh(db_member); return db_member
+    db_member = DBProjectMember(**member_data.model_dump(), project_id=project.id); db.add(db_member); db.commit(); db.refresh(db_member)
+    if db_member.account_id is not None: auth.invalidate_authorization(account_id=db_member.account_id, project_id=project.id)
+    return db_member
+
+# --- Paginated list endpoints (ag-Grid infinite row model) ---
+def _page(query, model, sortable, sort, order, cursor, limit, with_total, options=()):
+    total = query.count() if with_total else None
+    rows, next_cursor = paginate(query.options(*options), model, sortable, sort, order, cursor, limit)
+    return {"rows": rows, "next_cursor": next_cursor, "total": total}
+
+SHOT_SORTS = {"id": DBShot.id, "name": DBShot.name, "status": DBShot.status}
+ASSET_SORTS = {"id": DBAsset.id, "name": DBAsset.name, "asset_type": DBAsset.asset_type, "status": DBAsset.status}
+TASK_SORTS = {"id": DBTask.id, "name": DBTask.name, "status": DBTask.status, "start_date": DBTask.start_date, "end_date": DBTask.end_date, "assigned_to_id": DBTask.assigned_to_id}
+
+@app.get("/projects/{project_id}/shots", response_model=ShotPage, tags=["Shots & Assets"])
+def list_shots(
+    status: Optional[List[str]] = Query(None), name_prefix: Optional[str] = None,
+    sort: str = "name", order: str = "asc", cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), with_total: bool = False,
+    project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db),
+):
+    query = db.query(DBShot).filter(DBShot.project_id == project.id)
+    if status: query = query.filter(DBShot.status.in_(status))
+    if name_prefix: query = query.filter(DBShot.name.startswith(name_prefix, autoescape=True))
+    return _page(query, DBShot, SHOT_SORTS, sort, order, cursor, limit, with_total)
+
+@app.get("/projects/{project_id}/assets", response_model=AssetPage, tags=["Shots & Assets"])
+def list_assets(
+    status: Optional[List[str]] = Query(None), asset_type: Optional[List[str]] = Query(None), name_prefix: Optional[str] = None,
+    sort: str = "name", order: str = "asc", cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), with_total: bool = False,
+    project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db),
+):
+    query = db.query(DBAsset).filter(DBAsset.project_id == project.id)
+    if status: query = query.filter(DBAsset.status.in_(status))
+    if asset_type: query = query.filter(DBAsset.asset_type.in_(asset_type))
+    if name_prefix: query = query.filter(DBAsset.name.startswith(name_prefix, autoescape=True))
+    return _page(query, DBAsset, ASSET_SORTS, sort, order, cursor, limit, with_total)
+
+@app.get("/projects/{project_id}/tasks", response_model=TaskPage, tags=["Tasks"])
+def list_tasks(
+    status: Optional[List[str]] = Query(None), assigned_to_id: Optional[List[int]] = Query(None), name_prefix: Optional[str] = None,
+    sort: str = "name", order: str = "asc", cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), with_total: bool = False,
+    project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db),
+):
+    query = db.query(DBTask).filter(DBTask.project_id == project.id)
+    if status: query = query.filter(DBTask.status.in_(status))
+    if assigned_to_id: query = query.filter(DBTask.assigned_to_id.in_(assigned_to_id))
+    if name_prefix: query = query.filter(DBTask.name.startswith(name_prefix, autoescape=True))
+    options = [joinedload(DBTask.assigned_to).joinedload(DBProjectMember.account)]
+    return _page(query, DBTask, TASK_SORTS, sort, order, cursor, limit, with_total, options)
+
 @app.post("/projects/{project_id}/shots", response_model=Shot, tags=["Shots & Assets"])
 def create_shot(shot_data: ShotCreate, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
     db_shot = DBShot(**shot_data.model_dump(), project_id=project.id); db.add(db_shot); db.commit(); db.refresh(db_shot); return db_shot
@@ -145,8 +397,7 @@ def create_shot(shot_data: ShotCreate, project: DBProject = Depends(auth.get_pro
 def create_asset(asset_data: AssetCreate, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
     db_asset = DBAsset(**asset_data.model_dump(), project_id=project.id); db.add(db_asset); db.commit(); db.refresh(db_asset); return db_asset
 
-@app.put("/shots/{shot_id}", response_model=Shot, tags=["Shots & Assets"])
-def update_shot(shot_id: int, shot_update: ShotUpdate, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
+def _update_shot(db: Session, shot_id: int, shot_update: ShotUpdate, current_account: DBAccount) -> DBShot:
     db_shot = db.query(DBShot).filter(DBShot.id == shot_id).first()
     if not db_shot: raise HTTPException(status_code=404, detail="Shot not found")
     try:
@@ -158,6 +409,14 @@ def update_shot(shot_id: int, shot_update: ShotUpdate, db: Session = Depends(get
         setattr(db_shot, key, value)
     db.add(db_shot); db.commit(); db.refresh(db_shot)
     return db_shot
+if DB_ASYNC_MODE:
+    @app.put("/shots/{shot_id}", response_model=Shot, tags=["Shots & Assets"])
+    async def update_shot(shot_id: int, shot_update: ShotUpdate, db: AsyncSession = Depends(get_async_db), current_account: DBAccount = Depends(auth.get_current_account_async)):
+        return await db.run_sync(lambda session: Shot.model_validate(_update_shot(session, shot_id, shot_update, current_account)))
+else:
+    @app.put("/shots/{shot_id}", response_model=Shot, tags=["Shots & Assets"])
+    def update_shot(shot_id: int, shot_update: ShotUpdate, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
+        return _update_shot(db, shot_id, shot_update, current_account)
 
 # --- ★★★ 削除APIの追加 ★★★ ---
 @app.delete("/shots/{shot_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Shots & Assets"])
@@ -172,6 +431,9 @@ def delete_shot(shot_id: int, db: Session = Depends(get_db), current_account: DB
     except HTTPException:
         raise HTTPException(status_code=403, detail="You are not authorized to delete shots in this project.")
 
+    # ショットのタスクも削除する (残すと shot_id が NULL の孤立タスクになり、スケジュールにも残り続ける)
+    for db_task in db_shot.tasks:
+        db.delete(db_task)
     db.delete(db_shot)
     db.commit()
     return
@@ -195,11 +457,435 @@ def create_task(task: TaskCreate, db: Session = Depends(get_db), current_account
         parent_project_id = asset.project_id
     else: raise HTTPException(status_code=400, detail="Task must be linked to a Shot or an Asset.")
     if member.project_id != parent_project_id: raise HTTPException(status_code=400, detail="Cannot assign a task to a member from a different project.")
-    db_task = DBTask(**task.model_dump()); db.add(db_task); db.commit(); db.refresh(db_task)
+    db_task = DBTask(**task.model_dump(), project_id=parent_project_id); db.add(db_task); db.commit(); db.refresh(db_task)
+    task_graph.apply(db_task.project_id, db_task.change_seq, lambda graph: graph.add_task(db_task.id, db_task.start_date, db_task.end_date))
+    return db_task
+def _load_project_tasks(db: Session, project_id: int) -> List[DBTask]:
+    # tasks.project_id (非正規化) により、shots/assets を経由しない単一のインデックス範囲スキャンで取得できる
+    return db.query(DBTask).filter(DBTask.project_id == project_id).options(joinedload(DBTask.assigned_to).joinedload(DBProjectMember.account)).all()
+def _project_tasks_json(db: Session, project_id: int) -> bytes:
+    return dumps([Task.model_validate(task).model_dump() for task in _load_project_tasks(db, project_id)])
+if DB_ASYNC_MODE:
+    @app.get("/tasks/project/{project_id}", response_model=List[Task], tags=["Tasks"])
+    @replicas.replica_reads
+    async def get_tasks_for_project(request: Request, project: DBProject = Depends(auth.get_project_from_path_async), db: AsyncSession = Depends(get_async_db)):
+        version = await db.run_sync(lambda session: changes.current_version(session, project.id))
+        etag = _etag(project.id, version, "tasks")
+        if _etag_matches(request, etag): return _versioned_response(etag)
+        body = await response_cache.get_or_create_async((project.id, "tasks", version), lambda: db.run_sync(lambda session: _project_tasks_json(session, project.id)))
+        return _versioned_response(etag, body)
+else:
+    @app.get("/tasks/project/{project_id}", response_model=List[Task], tags=["Tasks"])
+    @replicas.replica_reads
+    def get_tasks_for_project(request: Request, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+        version = changes.current_version(db, project.id)
+        etag = _etag(project.id, version, "tasks")
+        if _etag_matches(request, etag): return _versioned_response(etag)
+        body = response_cache.get_or_create((project.id, "tasks", version), lambda: _project_tasks_json(db, project.id))
+        return _versioned_response(etag, body)
+
+# --- Bulk update endpoints ---
+# 対象の所属プロジェクト毎に1回だけ認可し、1トランザクション・1文の UPDATE ... WHERE id IN (...) RETURNING で更新する。
+# PATCH /tasks/{task_id} より先に登録すること ("bulk" が task_id として解釈されないように)
+def _bulk_update_targets(db: Session, model, body, filter_conditions) -> tuple:
+    """(対象のプロジェクトID集合, WHERE条件)。ids の場合は存在しないIDがあれば 404。"""
+    if (body.ids is None) == (body.filter is None): raise HTTPException(status_code=400, detail="Specify either ids or filter.")
+    if body.ids is not None:
+        if not body.ids: raise HTTPException(status_code=400, detail="At least one id is required.")
+        if len(body.ids) > MAX_BULK_ITEMS: raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} rows can be updated at once.")
+        ids = set(body.ids)
+        projects = dict(db.query(model.id, model.project_id).filter(model.id.in_(ids)).all())
+        missing = sorted(ids - projects.keys())
+        if missing: raise HTTPException(status_code=404, detail={"message": "Some ids were not found.", "ids": missing[:100]})
+        return set(projects.values()), [model.id.in_(ids)]
+    conditions = [model.project_id == body.filter.project_id, *filter_conditions(body.filter)]
+    matched = db.query(model.id).filter(*conditions).count()
+    if matched > MAX_BULK_ITEMS: raise HTTPException(status_code=413, detail=f"The filter matches {matched} rows; at most {MAX_BULK_ITEMS} can be updated at once.")
+    return ({body.filter.project_id} if matched else set()), conditions
+
+def _authorize_projects(db: Session, project_ids, current_account: DBAccount, detail: str) -> None:
+    for project_id in project_ids:
+        try: auth.get_project_from_path(project_id=project_id, current_account=current_account, db=db)
+        except HTTPException: raise HTTPException(status_code=403, detail=detail)
+
+def _bulk_update(db: Session, model, entity: str, project_ids, conditions, values: dict) -> list:
+    stamp, _ = changes.stamp_projects(db, model, project_ids)
+    rollups.untrack_matching(db, model, conditions)
+    rows = db.execute(update(model).where(*conditions).values(**values, **stamp).returning(*model.__table__.columns)
+                      .execution_options(synchronize_session=False)).all()
+    changes.record_rows(db, entity, "updated", rows)
+    rollups.track_rows(db, entity, rows)
+    return rows
+
+def _shot_filter_conditions(f: ShotBulkFilter) -> list:
+    conditions = []
+    if f.status: conditions.append(DBShot.status.in_(f.status))
+    if f.name_prefix: conditions.append(DBShot.name.startswith(f.name_prefix, autoescape=True))
+    return conditions
+
+def _task_filter_conditions(f: TaskBulkFilter) -> list:
+    conditions = []
+    if f.status: conditions.append(DBTask.status.in_(f.status))
+    if f.assigned_to_id: conditions.append(DBTask.assigned_to_id.in_(f.assigned_to_id))
+    if f.name_prefix: conditions.append(DBTask.name.startswith(f.name_prefix, autoescape=True))
+    return conditions
+
+@app.patch("/shots/bulk", response_model=List[Shot], tags=["Shots & Assets"])
+def update_shots_bulk(body: ShotBulkUpdate, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
+    values = body.changes.model_dump(exclude_unset=True)
+    if not values: raise HTTPException(status_code=400, detail="No fields to change.")
+    project_ids, conditions = _bulk_update_targets(db, DBShot, body, _shot_filter_conditions)
+    if not project_ids: return []
+    _authorize_projects(db, project_ids, current_account, "You are not authorized to edit shots in this project.")
+    rows = _bulk_update(db, DBShot, "shots", project_ids, conditions, values); db.commit()
+    return rows
+
+@app.patch("/tasks/bulk", response_model=List[Task], tags=["Tasks"])
+def update_tasks_bulk(body: TaskBulkUpdate, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
+    values = body.changes.model_dump(exclude_unset=True)
+    if not values: raise HTTPException(status_code=400, detail="No fields to change.")
+    project_ids, conditions = _bulk_update_targets(db, DBTask, body, _task_filter_conditions)
+    if not project_ids: return []
+    _authorize_projects(db, project_ids, current_account, "You are not authorized to modify tasks in this project.")
+    if "assigned_to_id" in values:
+        member = db.query(DBProjectMember.project_id).filter(DBProjectMember.id == values["assigned_to_id"]).first()
+        if not member: raise HTTPException(status_code=404, detail="Assigned ProjectMember not found")
+        if project_ids != {member.project_id}: raise HTTPException(status_code=400, detail="Cannot assign a task to a member from a different project.")
+    rows = _bulk_update(db, DBTask, "tasks", project_ids, conditions, values)
+    assignees = {m.id: ProjectMember.model_validate(m) for m in db.query(DBProjectMember).options(joinedload(DBProjectMember.account)).filter(DBProjectMember.id.in_({row.assigned_to_id for row in rows}))}
+    db.commit()
+    # 日付の変更はスケジュールに影響するので、キャッシュ済みの依存グラフを破棄する (ステータスのみなら不要)
+    if values.keys() & {"start_date", "end_date"}:
+        for project_id in project_ids: task_graph.invalidate_graph(project_id)
+    return [Task.model_validate({**row._mapping, "assigned_to": assignees[row.assigned_to_id]}) for row in rows]
+
+# --- Task dependencies & schedule (critical path) ---
+# 依存グラフはプロジェクトのバージョンと共にキャッシュし、日付や依存関係の変更はキャッシュ上のグラフに差分で反映する
+# (他のワーカーの書き込みや削除はバージョンが進むので、次の読み込みで再構築される)
+def _get_task_for_update(db: Session, task_id: int, current_account: DBAccount) -> DBTask:
+    db_task = db.query(DBTask).filter(DBTask.id == task_id).first()
+    if not db_task: raise HTTPException(status_code=404, detail="Task not found")
+    try: auth.get_project_from_path(project_id=db_task.project_id, current_account=current_account, db=db)
+    except HTTPException: raise HTTPException(status_code=403, detail="You are not authorized to modify tasks in this project.")
     return db_task
-@app.get("/tasks/project/{project_id}", response_model=List[Task], tags=["Tasks"])
-def get_tasks_for_project(project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
-    tasks_in_shots = db.query(DBTask).join(DBShot).filter(DBShot.project_id == project.id)
-    tasks_in_assets = db.query(DBTask).join(DBAsset).filter(DBAsset.project_id == project.id)
-    all_tasks_query = tasks_in_shots.union(tasks_in_assets)
-    return db.query(DBTask).from_statement(all_tasks_query).options(joinedload(DBTask.assigned_to).joinedload(DBProjectMember.account)).all()
+
+def _project_graph(db: Session, project_id: int) -> task_graph.TaskGraph:
+    try: return task_graph.get_graph(db, project_id)
+    except task_graph.CycleError as e: raise HTTPException(status_code=409, detail=str(e))
+
+@app.patch("/tasks/{task_id}", response_model=Task, tags=["Tasks"])
+def update_task(task_id: int, task_update: TaskUpdate, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
+    db_task = _get_task_for_update(db, task_id, current_account)
+    for key, value in task_update.model_dump(exclude_unset=True).items(): setattr(db_task, key, value)
+    db.commit(); db.refresh(db_task)
+    task_graph.apply(db_task.project_id, db_task.change_seq, lambda graph: graph.update_task(db_task.id, db_task.start_date, db_task.end_date))
+    return db_task
+
+@app.post("/tasks/{task_id}/dependencies", status_code=status.HTTP_204_NO_CONTENT, tags=["Tasks"])
+def add_task_dependency(task_id: int, dependency: TaskDependencyCreate, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
+    db_task = _get_task_for_update(db, task_id, current_account)
+    depends_on = db.query(DBTask.id, DBTask.project_id).filter(DBTask.id == dependency.depends_on_id).first()
+    if not depends_on: raise HTTPException(status_code=404, detail="Dependency task not found")
+    if depends_on.project_id != db_task.project_id: raise HTTPException(status_code=400, detail="Tasks can only depend on tasks in the same project.")
+    exists = db.query(task_dependency).filter(task_dependency.c.dependent_task_id == task_id, task_dependency.c.dependency_on_task_id == depends_on.id).first()
+    if exists: return
+    # バージョン行のロックで同じプロジェクトへの依存関係の書き込みを直列化し、循環チェックは DB 上の辺に対して行う
+    version = changes.next_version(db, db_task.project_id)
+    if task_graph.creates_cycle(db, task_id, depends_on.id):
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"Task {task_id} cannot depend on task {depends_on.id}: that would create a cycle.")
+    db.execute(insert(task_dependency).values(dependent_task_id=task_id, dependency_on_task_id=depends_on.id)); db.commit()
+    task_graph.apply(db_task.project_id, version, lambda graph: graph.add_dependency(task_id, depends_on.id))
+    return
+
+@app.delete("/tasks/{task_id}/dependencies/{depends_on_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Tasks"])
+def remove_task_dependency(task_id: int, depends_on_id: int, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
+    db_task = _get_task_for_update(db, task_id, current_account)
+    version = changes.next_version(db, db_task.project_id)
+    result = db.execute(delete(task_dependency).where(task_dependency.c.dependent_task_id == task_id, task_dependency.c.dependency_on_task_id == depends_on_id))
+    if result.rowcount == 0:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Dependency not found")
+    db.commit()
+    task_graph.apply(db_task.project_id, version, lambda graph: graph.remove_dependency(task_id, depends_on_id))
+    return
+
+@app.get("/projects/{project_id}/schedule", response_model=ProjectSchedule, tags=["Tasks"])
+def get_project_schedule(project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    return _project_graph(db, project.id).schedule()
+
+# --- Bulk create endpoints ---
+# リスト全体を検証してから、1トランザクション・複数行 INSERT ... RETURNING で登録する。
+# 1件でもエラーがあれば何も登録せず、422 で各要素のエラー ({"index", "detail"}) を返す。
+MAX_BULK_ITEMS = 5000
+
+def _check_bulk_size(items: list):
+    if not items: raise HTTPException(status_code=400, detail="At least one item is required.")
+    if len(items) > MAX_BULK_ITEMS: raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items can be created at once.")
+
+def _bulk_insert(db: Session, model, rows: List[dict]):
+    # insertmanyvalues により複数行の INSERT ... RETURNING にまとめて実行される
+    return db.execute(insert(model).returning(*model.__table__.columns), rows).all()
+
+@app.post("/projects/{project_id}/shots/bulk", response_model=List[Shot], tags=["Shots & Assets"])
+def create_shots_bulk(shots: List[ShotCreate], project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    _check_bulk_size(shots)
+    stamp = changes.stamp(db, project.id, "shots")
+    created = _bulk_insert(db, DBShot, [{**shot.model_dump(), "project_id": project.id, **stamp} for shot in shots])
+    rollups.track_rows(db, "shots", created); db.commit()
+    return created
+
+@app.post("/projects/{project_id}/assets/bulk", response_model=List[Asset], tags=["Shots & Assets"])
+def create_assets_bulk(assets: List[AssetCreate], project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    _check_bulk_size(assets)
+    stamp = changes.stamp(db, project.id, "assets")
+    created = _bulk_insert(db, DBAsset, [{**asset.model_dump(), "project_id": project.id, **stamp} for asset in assets])
+    rollups.track_rows(db, "assets", created); db.commit()
+    return created
+
+@app.post("/projects/{project_id}/members/bulk", response_model=List[ProjectMember], tags=["Project Members"])
+def create_project_members_bulk(members: List[ProjectMemberCreate], project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    _check_bulk_size(members)
+    account_ids = {m.account_id for m in members if m.account_id is not None}
+    accounts = {a.id: AccountResponse.model_validate(a) for a in db.query(DBAccount).filter(DBAccount.id.in_(account_ids))} if account_ids else {}
+    errors = [{"index": i, "detail": "Account not found"} for i, m in enumerate(members) if m.account_id is not None and m.account_id not in accounts]
+    if errors: raise HTTPException(status_code=422, detail=errors)
+    stamp = changes.stamp(db, project.id, "members")
+    created = _bulk_insert(db, DBProjectMember, [{**m.model_dump(), "project_id": project.id, **stamp} for m in members]); db.commit()
+    for account_id in account_ids: auth.invalidate_authorization(account_id=account_id, project_id=project.id)
+    return [ProjectMember.model_validate({**row._mapping, "account": accounts.get(row.account_id)}) for row in created]
+
+@app.post("/tasks/bulk", response_model=List[Task], tags=["Tasks"])
+def create_tasks_bulk(tasks: List[TaskCreate], db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account)):
+    _check_bulk_size(tasks)
+    # 所有関係の確認は要素毎ではなく、集合単位のクエリでまとめて行う
+    member_ids = {t.assigned_to_id for t in tasks}
+    shot_ids = {t.shot_id for t in tasks if t.shot_id}
+    asset_ids = {t.asset_id for t in tasks if t.asset_id and not t.shot_id}
+    members = {m.id: m for m in db.query(DBProjectMember).options(joinedload(DBProjectMember.account)).filter(DBProjectMember.id.in_(member_ids))}
+    shot_projects = dict(db.query(DBShot.id, DBShot.project_id).filter(DBShot.id.in_(shot_ids)).all()) if shot_ids else {}
+    asset_projects = dict(db.query(DBAsset.id, DBAsset.project_id).filter(DBAsset.id.in_(asset_ids)).all()) if asset_ids else {}
+    authorized = {}
+    for project_id in {m.project_id for m in members.values()}:
+        try: auth.get_project_from_path(project_id=project_id, current_account=current_account, db=db); authorized[project_id] = True
+        except HTTPException: authorized[project_id] = False
+
+    errors = []
+    for i, task in enumerate(tasks):
+        member = members.get(task.assigned_to_id)
+        if not member: errors.append({"index": i, "detail": "Assigned ProjectMember not found"}); continue
+        if not authorized[member.project_id]: errors.append({"index": i, "detail": "You are not authorized to add tasks to this project."}); continue
+        if task.shot_id: parent_project_id = shot_projects.get(task.shot_id); missing = "Shot not found"
+        elif task.asset_id: parent_project_id = asset_projects.get(task.asset_id); missing = "Asset not found"
+        else: errors.append({"index": i, "detail": "Task must be linked to a Shot or an Asset."}); continue
+        if parent_project_id is None: errors.append({"index": i, "detail": missing}); continue
+        if member.project_id != parent_project_id: errors.append({"index": i, "detail": "Cannot assign a task to a member from a different project."})
+    if errors: raise HTTPException(status_code=422, detail=errors)
+
+    assignees = {member_id: ProjectMember.model_validate(member) for member_id, member in members.items()}
+    stamps = {project_id: changes.stamp(db, project_id, "tasks") for project_id in sorted({m.project_id for m in members.values()})}
+    created = _bulk_insert(db, DBTask, [{**task.model_dump(), "project_id": members[task.assigned_to_id].project_id, **stamps[members[task.assigned_to_id].project_id]} for task in tasks])
+    rollups.track_rows(db, "tasks", created); db.commit()
+    for project_id in {row.project_id for row in created}: task_graph.invalidate_graph(project_id)
+    return [Task.model_validate({**row._mapping, "assigned_to": assignees[row.assigned_to_id]}) for row in created]
+
+# --- Progress stats ---
+# 作成・更新・削除と同じトランザクションで更新される集計表 (rollups.py) を読むだけなので、行数に依存しない
+@app.get("/projects/{project_id}/stats", response_model=ProjectStats, tags=["Projects"])
+def get_project_stats(project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    return rollups.project_stats(db, project.id)
+
+# --- Search ---
+# 名前の部分一致・あいまい一致。呼び出し元がアクセスできるプロジェクト (project_id 指定時はそのプロジェクトのみ) を対象にする
+def _searchable_project_ids(db: Session, current_account: DBAccount) -> List[int]:
+    if current_account.account_type == 'admin': return [pid for pid, in db.query(DBProject.id).filter(DBProject.organization_id == current_account.organization_id)]
+    return [pid for pid, in db.query(DBProjectMember.project_id).filter(DBProjectMember.account_id == current_account.id).distinct()]
+@app.get("/search", response_model=SearchResults, tags=["Search"])
+def search_names(
+    q: str = Query(..., min_length=1, max_length=200), entity: Optional[List[str]] = Query(None), project_id: Optional[int] = None,
+    offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_active_account),
+):
+    unknown = sorted(set(entity or ()) - search.ENTITIES.keys())
+    if unknown: raise HTTPException(status_code=400, detail=f"Unknown entity '{unknown[0]}'. Use any of: {', '.join(search.ENTITIES)}.")
+    if project_id is not None: project_ids = [auth.get_project_from_path(project_id=project_id, current_account=current_account, db=db).id]
+    else: project_ids = _searchable_project_ids(db, current_account)
+    rows, next_offset = search.search(db, project_ids, q, entity, offset, limit)
+    return {"rows": rows, "next_offset": next_offset}
+
+# --- Delta sync ---
+# クライアントは前回の cursor を since に渡し、それ以降に変更・削除された行だけを受け取る (初回は since=0)
+@app.get("/projects/{project_id}/changes", response_model=ProjectChanges, tags=["Projects"])
+def get_project_changes(since: int = Query(0, ge=0), project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    return changes.changes_since(db, project.id, since)
+
+# --- Real-time push (Server-Sent Events) ---
+# 変更はコミット後にプロジェクト毎のブローカーへ送られ、まとめて1フレームで配信される (events.py)
+@app.get("/projects/{project_id}/events", tags=["Projects"])
+async def stream_project_events(project_id: int, request: Request, access_token: Optional[str] = Query(None), token: Optional[str] = Depends(auth.oauth2_scheme_optional)):
+    await run_in_threadpool(auth.authorize_project_stream, token or access_token, project_id)
+    return StreamingResponse(events.stream(project_id, request), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- Shot list import (CSV / EDL) ---
+# アップロードはスプールに書き出してすぐ 202 を返し、取り込みはバックグラウンドでチャンク毎にコミットする。
+# 進捗は GET で確認し、失敗した場合は resume で最後にコミットしたチャンクの続きから再開できる。
+# ワーカーが落ちて running のまま IMPORT_STALE_SECONDS 更新が止まった取り込みも resume できる。
+def _get_import(db: Session, project_id: int, import_id: int) -> DBShotImport:
+    job = db.query(DBShotImport).filter(DBShotImport.id == import_id, DBShotImport.project_id == project_id).first()
+    if not job: raise HTTPException(status_code=404, detail="Import not found")
+    return job
+
+@app.post("/projects/{project_id}/imports", response_model=ShotImportStatus, status_code=status.HTTP_202_ACCEPTED, tags=["Shots & Assets"])
+def create_shot_import(background_tasks: BackgroundTasks, file: UploadFile = File(...), project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    try: job = shot_import.create_import(db, project.id, file.filename, file.file)
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    background_tasks.add_task(shot_import.run_import, job.id)
+    return job
+
+@app.get("/projects/{project_id}/imports/{import_id}", response_model=ShotImportStatus, tags=["Shots & Assets"])
+def get_shot_import(import_id: int, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    return _get_import(db, project.id, import_id)
+
+@app.post("/projects/{project_id}/imports/{import_id}/resume", response_model=ShotImportStatus, status_code=status.HTTP_202_ACCEPTED, tags=["Shots & Assets"])
+def resume_shot_import(import_id: int, background_tasks: BackgroundTasks, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    job = _get_import(db, project.id, import_id)
+    if not shot_import.claim_for_resume(db, job): raise HTTPException(status_code=409, detail=f"Import is {job.status} and cannot be resumed.")
+    db.refresh(job)
+    background_tasks.add_task(shot_import.run_import, job.id)
+    return job
+
+# --- Resumable uploads / downloads ---
+# チャンクは Upload-Offset の位置から書き込み、Upload-Checksum (sha256) で検証する。中断したら HEAD で位置を確認して再開する
+def _get_upload(db: Session, project_id: int, upload_id: int) -> DBFileUpload:
+    upload = db.query(DBFileUpload).filter(DBFileUpload.id == upload_id, DBFileUpload.project_id == project_id).first()
+    if not upload: raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+@app.post("/projects/{project_id}/uploads", response_model=FileUploadStatus, status_code=status.HTTP_201_CREATED, tags=["Files"])
+def create_file_upload(body: FileUploadCreate, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    try: upload = uploads.create_upload(db, project, body.filename, body.size_bytes, body.storage_location_id, body.shot_id, body.asset_id)
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    except FileExistsError as e: raise HTTPException(status_code=409, detail=str(e))
+    return upload
+
+@app.get("/projects/{project_id}/uploads/{upload_id}", response_model=FileUploadStatus, tags=["Files"])
+def get_file_upload(upload_id: int, response: Response, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    upload = _get_upload(db, project.id, upload_id)
+    response.headers["Upload-Offset"] = str(upload.bytes_received); response.headers["Cache-Control"] = "no-store"
+    return upload
+
+@app.head("/projects/{project_id}/uploads/{upload_id}", tags=["Files"])
+def get_file_upload_offset(upload_id: int, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    upload = _get_upload(db, project.id, upload_id)
+    return Response(headers={"Upload-Offset": str(upload.bytes_received), "Upload-Length": str(upload.size_bytes), "Cache-Control": "no-store"})
+
+# アップロード中はDB接続を保持しない (認可・状態の更新はそれぞれ専用の短いセッションで行う)
+@app.patch("/projects/{project_id}/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Files"])
+async def upload_file_chunk(project_id: int, upload_id: int, request: Request, upload_offset: int = Header(..., alias="Upload-Offset", ge=0),
+                            upload_checksum: str = Header(..., alias="Upload-Checksum"), token: str = Depends(auth.oauth2_scheme)):
+    await run_in_threadpool(auth.authorize_project_stream, token, project_id)
+    try: checksum = uploads.parse_checksum(upload_checksum)
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    try: new_offset = await uploads.receive_chunk(project_id, upload_id, upload_offset, checksum, request.stream())
+    except uploads.OffsetMismatch as e: raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except uploads.ChecksumMismatch as e: raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    except FileExistsError as e: raise HTTPException(status_code=409, detail=str(e))
+    if new_offset is None: raise HTTPException(status_code=404, detail="Upload not found")
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers={"Upload-Offset": str(new_offset)})
+
+@app.delete("/projects/{project_id}/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Files"])
+def abort_file_upload(upload_id: int, project: DBProject = Depends(auth.get_project_from_path), db: Session = Depends(get_db)):
+    try: uploads.abort_upload(db, _get_upload(db, project.id, upload_id))
+    except ValueError as e: raise HTTPException(status_code=409, detail=str(e))
+    return
+
+def _file_for_download(token: str, file_id: int, range_header: Optional[str], rendition: Optional[str] = None) -> dict:
+    with SessionLocal() as db:
+        account = auth.get_current_account(token=token, db=db)
+        db_file = db.query(DBFile).filter(DBFile.id == file_id).first()
+        if not db_file: raise HTTPException(status_code=404, detail="File not found")
+        try: auth.get_project_from_path(project_id=db_file.project_id, current_account=account, db=db)
+        except HTTPException: raise HTTPException(status_code=403, detail="You are not authorized to access files in this project.")
+        location = db.query(DBStorageLocation).filter(DBStorageLocation.id == db_file.storage_location_id).one()
+        relative_path = db_file.relative_path if rendition is None else getattr(db_file, f"{rendition}_path")
+        if relative_path is None: raise HTTPException(status_code=404, detail=f"No {rendition} has been generated for this file")
+        path = os.path.join(location.base_path or "", relative_path)
+        if db_file.missing_at is not None or not os.path.isfile(path): raise HTTPException(status_code=404, detail="File is missing from storage")
+        if rendition is None and uploads.is_full_download(range_header): uploads.record_download(db, db_file.id)
+        filename = db_file.original_filename if rendition is None else f"{os.path.splitext(db_file.original_filename)[0]}_{rendition}{os.path.splitext(relative_path)[1]}"
+        return {"path": path, "filename": filename, "location_id": location.id, "relative_path": relative_path}
+
+async def _send_file(request: Request, token: str, file_id: int, rendition: Optional[str] = None, inline: bool = False) -> Response:
+    target = await run_in_threadpool(_file_for_download, token, file_id, request.headers.get("range"), rendition)
+    disposition = "inline" if inline else "attachment"
+    if uploads.FILE_ACCEL_REDIRECT_PREFIX:
+        location = uploads.FILE_ACCEL_REDIRECT_PREFIX + quote(f"{target['location_id']}/{target['relative_path']}")
+        return Response(headers={"X-Accel-Redirect": location, "Content-Disposition": f"{disposition}; filename*=UTF-8''{quote(target['filename'])}"})
+    return FileResponse(target["path"], filename=target["filename"], content_disposition_type=disposition)
+
+# Range リクエストは FileResponse が処理する。FILE_ACCEL_REDIRECT_PREFIX を設定すると転送を nginx に任せる (sendfile)
+@app.get("/files/{file_id}/content", tags=["Files"])
+async def download_file(file_id: int, request: Request, token: str = Depends(auth.oauth2_scheme)):
+    return await _send_file(request, token, file_id)
+
+# サムネイル・プロキシはジョブキュー (thumbnails.py) が生成する。未生成なら 404
+@app.get("/files/{file_id}/thumbnail", tags=["Files"])
+async def get_file_thumbnail(file_id: int, request: Request, token: str = Depends(auth.oauth2_scheme)):
+    return await _send_file(request, token, file_id, "thumbnail", inline=True)
+
+@app.get("/files/{file_id}/proxy", tags=["Files"])
+async def get_file_proxy(file_id: int, request: Request, token: str = Depends(auth.oauth2_scheme)):
+    return await _send_file(request, token, file_id, "proxy", inline=True)
+
+@app.post("/files/{file_id}/thumbnail", status_code=status.HTTP_202_ACCEPTED, tags=["Files"])
+def regenerate_file_thumbnail(file_id: int, db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.get_current_account)):
+    db_file = db.query(DBFile).filter(DBFile.id == file_id).first()
+    if not db_file: raise HTTPException(status_code=404, detail="File not found")
+    auth.get_project_from_path(project_id=db_file.project_id, current_account=current_account, db=db)
+    if not thumbnails.enqueue_for(db, [db_file]): raise HTTPException(status_code=400, detail="Thumbnails are only made for images and videos.")
+    db.commit()
+    return {"queued": True}
+
+# --- Streaming export (NDJSON / CSV) ---
+@app.get("/projects/{project_id}/export/{entity}", tags=["Shots & Assets"])
+def export_project(entity: str, format: str = Query("ndjson"), project: DBProject = Depends(auth.get_project_from_path)):
+    if entity not in export.ENTITIES: raise HTTPException(status_code=404, detail=f"Unknown export '{entity}'. Use one of: {', '.join(export.ENTITIES)}.")
+    if format not in export.FORMATS: raise HTTPException(status_code=400, detail=f"Unknown format '{format}'. Use one of: {', '.join(export.FORMATS)}.")
+    filename = f"project{project.id}_{entity}.{format}"
+    return StreamingResponse(export.stream_export(entity, project.id, format), media_type=export.FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# --- Internal metrics ---
+@app.get("/internal/metrics", tags=["Internal"])
+def get_internal_metrics(current_account: DBAccount = Depends(auth.require_role(["admin"]))):
+    # ワーカープロセス毎の値 (プールサイズの調整用)
+    return {
+        "pools": pool_metrics.snapshot(),
+        "caches": {
+            "authorization": auth.authorization_cache.stats(),
+            "verified_tokens": auth.verified_token_cache.stats(),
+            "responses": response_cache.stats(),
+        },
+        "search_indexes": search.stats(),
+        "events": {"broker": events.EVENT_BROKER, "subscribers": events.broker.subscriber_count()},
+        "password_hashing": passwords.hasher.stats(),
+        "login_throttle": passwords.login_throttle.stats(),
+        "requests": {"routes": request_metrics.summary(), "n_plus_one": request_metrics.findings()},
+        "read_replicas": replica_set.stats(),
+    }
+
+# Prometheus 形式。値はワーカープロセス毎。METRICS_TOKEN を設定すると Bearer トークンが必要になる
+@app.get("/metrics", tags=["Internal"], include_in_schema=False)
+def get_prometheus_metrics(authorization: Optional[str] = Header(None)):
+    # トークン未設定なら無効 (フェイルクローズ)
+    if not request_metrics.enabled(): raise HTTPException(status_code=404, detail="Not Found")
+    if not request_metrics.authorized(authorization):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    return Response(request_metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/internal/jobs", tags=["Internal"])
+def get_job_stats(db: Session = Depends(get_db), current_account: DBAccount = Depends(auth.require_role(["admin"]))):
+    # キュー毎・状態毎の件数 (全ワーカー共通、DB から集計)
+    return jobs.stats(db)
@@ -0,0 +1,102 @@
+import base64
+import datetime
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Date, and_, or_, nulls_first, nulls_last
+from sqlalchemy.orm import Query
+
+# --- Keyset (cursor) pagination ---
+# OFFSETを使わず「最後に返した行のソートキー + id」から次のページを読むため、
+# 何ページ目でもインデックスの範囲スキャン1回で済む。
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    def _plain(value: Any) -> Any:
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        return value
+    raw = json.dumps([_plain(v) for v in values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    if not isinstance(values, list) or len(values) != 2:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    return values
+
+
+def _coerce(column, value: Any) -> Any:
+    if value is not None and isinstance(column.type, Date):
+        try:
+            return datetime.date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    return value
+
+
+def _after(column, id_column, value: Any, last_id: int, descending: bool):
+    """WHERE clause selecting the rows that come after (value, last_id).
+
+    NULLs sort last in ascending order and first in descending order, so a
+    descending walk is the exact reverse of an ascending one.
+    """
+    if column is id_column:
+        return id_column < last_id if descending else id_column > last_id
+    if not descending:
+        if value is None:
+            return and_(column.is_(None), id_column > last_id)
+        return or_(column > value, and_(column == value, id_column > last_id), column.is_(None))
+    if value is None:
+        return or_(and_(column.is_(None), id_column < last_id), column.isnot(None))
+    return or_(column < value, and_(column == value, id_column < last_id))
+
+
+def paginate(
+    query: Query,
+    model,
+    sortable: Dict[str, Any],
+    sort: str,
+    order: str,
+    cursor: Optional[str],
+    limit: int,
+) -> Tuple[List[Any], Optional[str]]:
+    """Apply keyset ordering and the cursor to ``query`` and fetch one page.
+
+    Returns the rows and the cursor for the next page (``None`` on the last page).
+    """
+    if sort not in sortable:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by '{sort}'. Allowed: {sorted(sortable)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'.")
+    descending = order == "desc"
+    column = sortable[sort]
+    id_column = model.id
+
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        query = query.filter(_after(column, id_column, _coerce(column, value), last_id, descending))
+
+    if column is id_column:
+        ordering = [id_column.desc() if descending else id_column.asc()]
+    elif descending:
+        ordering = [nulls_first(column.desc()), id_column.desc()]
+    else:
+        ordering = [nulls_last(column.asc()), id_column.asc()]
+
+    # 1行多く読んで次ページの有無を判定する
+    rows = query.order_by(*ordering).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, column.key), last.id])
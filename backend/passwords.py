@@ -0,0 +1,199 @@
+"""Password hashing off the request threadpool, and login throttling.
+
+bcrypt is deliberately slow (~250ms at cost 12) and holds the GIL for most
+of it. Run in the shared request threadpool, a burst of logins at shift start
+uses up every thread and stalls unrelated endpoints. Hashing and verification
+therefore run in a small process pool of PASSWORD_HASH_WORKERS processes.
+At most PASSWORD_HASH_MAX_PENDING calls may be queued or running. Past that,
+callers get ``HasherBusy`` (mapped to 503 + Retry-After) instead of piling up.
+
+The cost is BCRYPT_ROUNDS. A hash made with another cost still verifies, and
+it is rehashed with the current cost on the next successful login.
+
+Failed logins are counted per account name and per client address over
+LOGIN_THROTTLE_WINDOW_SECONDS. Once either key reaches its limit, login
+attempts for it are rejected with 429 *before* any hashing, so a
+credential-stuffing burst costs almost nothing. The counters live in the
+worker's memory, so each worker enforces its own limit.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from .cache import TTLCache
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
+
+LOGIN_THROTTLE_WINDOW_SECONDS = float(os.getenv("LOGIN_THROTTLE_WINDOW_SECONDS", "300"))
+LOGIN_MAX_FAILURES_PER_ACCOUNT = int(os.getenv("LOGIN_MAX_FAILURES_PER_ACCOUNT", "10"))
+LOGIN_MAX_FAILURES_PER_IP = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "50"))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+
+# min/max を現在のコストに固定し、それ以外のコストのハッシュを needs_update の対象にする
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS, bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class HasherBusy(Exception):
+    """Too many hash/verify calls are already queued."""
+
+
+# --- Run in the worker processes (must be importable top-level functions) ---
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """Bounded process pool for bcrypt, with queue-depth and latency counters."""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.seconds_total = 0.0
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HasherBusy()
+            if self._executor is None:
+                # 最初の利用時に起動する (import だけのプロセスやマイグレーションでは起動しない)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+            executor = self._executor
+        started = time.monotonic()
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(lambda _: self._done(started))
+        return future
+
+    def _done(self, started: float) -> None:
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+            self.seconds_total += time.monotonic() - started
+
+    # 同期版は呼び出し元のスレッドで完了を待つ。ログインのような高頻度の経路では async 版を使うこと
+    def hash(self, password: str) -> str:
+        return self._submit(_hash, password).result()
+
+    def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return self._count_rehash(self._submit(_verify_and_update, password, hashed_password).result())
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(_hash, password))
+
+    async def verify_and_update_async(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return self._count_rehash(await asyncio.wrap_future(self._submit(_verify_and_update, password, hashed_password)))
+
+    def _count_rehash(self, result: Tuple[bool, Optional[str]]) -> Tuple[bool, Optional[str]]:
+        if result[1] is not None:
+            with self._lock:
+                self.rehashed += 1
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "queued": max(0, self.pending - self.workers),
+                "peak_pending": self.peak_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "avg_seconds": self.seconds_total / self.completed if self.completed else 0.0,
+            }
+
+
+hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+
+class LoginThrottle:
+    """Fixed-window counters of failed logins per account name and per client address."""
+
+    def __init__(self, window_seconds: float, max_per_account: int, max_per_ip: int, max_keys: int):
+        self.window_seconds = window_seconds
+        self.limits = {"account": max_per_account, "ip": max_per_ip}
+        # key -> (window start, failures). 期限切れで窓がリセットされる
+        self._failures = TTLCache(maxsize=max_keys, ttl=window_seconds)
+        self._lock = threading.Lock()
+        self.blocked = 0
+
+    def _keys(self, account_name: str, ip: Optional[str]):
+        yield ("account", account_name.lower())
+        if ip:
+            yield ("ip", ip)
+
+    def retry_after(self, account_name: str, ip: Optional[str]) -> Optional[int]:
+        """Seconds until a blocked key's window ends, or None if the attempt may proceed."""
+        now = time.monotonic()
+        wait = 0.0
+        for key in self._keys(account_name, ip):
+            entry = self._failures.get(key)
+            if entry is not None and entry[1] >= self.limits[key[0]]:
+                wait = max(wait, entry[0] + self.window_seconds - now)
+        if wait <= 0:
+            return None
+        with self._lock:
+            self.blocked += 1
+        return max(1, math.ceil(wait))
+
+    def record_failure(self, account_name: str, ip: Optional[str]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key in self._keys(account_name, ip):
+                started, count = self._failures.get(key) or (now, 0)
+                self._failures.set(key, (started, count + 1), ttl=max(0.0, started + self.window_seconds - now))
+
+    def record_success(self, account_name: str) -> None:
+        # アドレス側の失敗数は残す (他人のアカウントへの試行も数えるため)
+        self._failures.pop(("account", account_name.lower()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_seconds": self.window_seconds,
+            "max_failures_per_account": self.limits["account"],
+            "max_failures_per_ip": self.limits["ip"],
+            "tracked_keys": len(self._failures),
+            "blocked": self.blocked,
+        }
+
+
+login_throttle = LoginThrottle(
+    LOGIN_THROTTLE_WINDOW_SECONDS, LOGIN_MAX_FAILURES_PER_ACCOUNT, LOGIN_MAX_FAILURES_PER_IP, LOGIN_THROTTLE_MAX_KEYS,
+)
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Upper bounds (seconds) of the checkout-latency histogram buckets
+CHECKOUT_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+class PoolMetrics:
+    """Checkout latency and timeout counters for one connection pool."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_seconds_total = 0.0
+        self.checkout_seconds_max = 0.0
+        self.bucket_counts: List[int] = [0] * (len(CHECKOUT_BUCKETS) + 1)
+        self.timeouts = 0
+
+    def record_checkout(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_seconds_total += seconds
+            self.checkout_seconds_max = max(self.checkout_seconds_max, seconds)
+            self.bucket_counts[bisect_left(CHECKOUT_BUCKETS, seconds)] += 1
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        pool = self.pool
+        state = {}
+        if pool is not None:
+            state = {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                # QueuePool.overflow() is negative while the pool is still filling up
+                "overflow": max(0, pool.overflow()),
+                "max_overflow": pool._max_overflow,
+                "timeout_seconds": pool.timeout(),
+            }
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(CHECKOUT_BUCKETS + [float("inf")], self.bucket_counts):
+                cumulative += count
+                buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+            return {
+                "name": self.name,
+                "pid": os.getpid(),
+                **state,
+                "checkouts": self.checkouts,
+                "checkout_seconds_total": round(self.checkout_seconds_total, 6),
+                "checkout_seconds_max": round(self.checkout_seconds_max, 6),
+                "checkout_seconds_buckets": buckets,
+                "timeouts": self.timeouts,
+            }
+
+
+# name -> metrics, for every pool created through instrumented_pool_class()
+registry: Dict[str, PoolMetrics] = {}
+
+
+def instrumented_pool_class(name: str, async_engine: bool = False) -> type:
+    """
+    A QueuePool subclass that times how long each checkout waits for a connection.
+
+    The metrics object lives on the class, so it survives ``engine.dispose()``,
+    which rebuilds the pool through ``pool.recreate()``.
+    """
+    metrics = registry.setdefault(name, PoolMetrics(name))
+    base = AsyncAdaptedQueuePool if async_engine else QueuePool
+
+    def __init__(self, *args, **kwargs):
+        base.__init__(self, *args, **kwargs)
+        metrics.pool = self
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = base._do_get(self)
+        except exc.TimeoutError:
+            metrics.record_timeout()
+            raise
+        metrics.record_checkout(time.perf_counter() - started)
+        return connection
+
+    return type(f"Instrumented{base.__name__}", (base,), {"__init__": __init__, "_do_get": _do_get, "metrics": metrics})
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    return {name: metrics.snapshot() for name, metrics in registry.items()}
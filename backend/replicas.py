@@ -0,0 +1,207 @@
+"""Route read-only endpoints to read replicas, with read-your-writes stickiness and lag checks.
+
+Set DATABASE_REPLICA_URLS to a comma-separated list of replica URLs. Endpoints
+decorated with ``@replicas.replica_reads`` then get a session on one of the
+healthy replicas from ``database.get_db`` / ``get_async_db``, round robin.
+Everything else, including the auth checks of other endpoints, stays on the
+primary. The whole request uses one session: a replica request also checks
+the token and project access on the replica.
+
+Read-your-writes: after a client writes (any non-GET/HEAD/OPTIONS request),
+its reads go to the primary for REPLICA_STICKY_SECONDS. The response to the
+write says until when, and the client is expected to send that back.
+``ReplicaRoutingMiddleware`` sets it in two places:
+
+- an ``X-MOTK-Primary-Until`` header, which the client echoes on its
+  following requests. The SPA's axios client does this (frontend/src/api.ts).
+  It works cross-origin without credentials, and every worker sees it.
+- a ``motk_primary_until`` cookie, for same-origin clients and those sending
+  credentials.
+
+The middleware also keeps the Authorization header in a per-process cache.
+That is only a fallback for clients that echo neither: it only helps when
+their read lands on the same worker. A value further in the future than one
+sticky window is ignored, so a client can't pin itself to the primary for
+good.
+
+Lag: each worker process runs a thread that stamps ``replica_heartbeat.beat_ms``
+on the primary every REPLICA_CHECK_SECONDS and reads it back from every
+replica. A replica whose stamp is more than REPLICA_MAX_LAG_SECONDS old, or
+that can't be reached, is out of rotation until a later check finds it caught
+up. Until the first check completes, and whenever no replica is healthy,
+reads go to the primary. The sticky window defaults to the longest lag a
+replica in rotation can have, so a client's own write is always visible to it.
+
+To try it with two local databases, migrate both and point
+DATABASE_REPLICA_URLS at the second. Nothing replicates the heartbeat
+between them, so the replica counts as stale. Set REPLICA_MAX_LAG_SECONDS=0
+to skip the lag check (the replica then only has to answer), or update
+``replica_heartbeat`` on it by hand.
+"""
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "2"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", str(REPLICA_MAX_LAG_SECONDS + 2 * REPLICA_CHECK_SECONDS)))
+STICKY_COOKIE = "motk_primary_until"
+STICKY_HEADER = "X-MOTK-Primary-Until"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def replica_reads(endpoint):
+    """Mark an endpoint as safe to serve from a replica. Put it under the route decorator."""
+    endpoint.replica_reads = True
+    return endpoint
+
+
+class ReplicaSet:
+    """The replicas of one worker process: their health, and which one serves the next read."""
+
+    def __init__(self, primary, engines: List[Any]):
+        self.primary = primary
+        self.engines = engines
+        self.healthy: List[bool] = [False] * len(engines)
+        self.lag_seconds: List[Optional[float]] = [None] * len(engines)
+        self.errors: List[Optional[str]] = [None] * len(engines)
+        self.routed = [0] * len(engines)
+        self.routed_primary = 0
+        self.sticky = 0
+        self.checks = 0
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._checker_pid = None
+        # Authorization header digest -> recent write, for clients that don't keep cookies
+        self.recent_writers = TTLCache(100000, REPLICA_STICKY_SECONDS)
+
+    # --- Health ---
+    def check(self) -> None:
+        """Stamp the heartbeat on the primary and take stale or unreachable replicas out of rotation."""
+        now_ms = int(time.time() * 1000)
+        if REPLICA_MAX_LAG_SECONDS > 0:
+            with self.primary.begin() as conn:
+                conn.execute(text("UPDATE replica_heartbeat SET beat_ms = :now WHERE id = 1 AND beat_ms < :now"), {"now": now_ms})
+        for i, engine in enumerate(self.engines):
+            try:
+                with engine.connect() as conn:
+                    if REPLICA_MAX_LAG_SECONDS > 0:
+                        beat_ms = conn.execute(text("SELECT beat_ms FROM replica_heartbeat WHERE id = 1")).scalar() or 0
+                        lag = max(0.0, (now_ms - beat_ms) / 1000)
+                    else:
+                        conn.execute(text("SELECT 1"))
+                        lag = None
+            except Exception as e:
+                healthy, lag, error = False, None, f"{type(e).__name__}: {e}"
+            else:
+                healthy, error = lag is None or lag <= REPLICA_MAX_LAG_SECONDS, None
+            if healthy != self.healthy[i]:
+                logger.warning("Replica %d %s rotation (lag %s, %s)", i, "back in" if healthy else "out of",
+                               "n/a" if lag is None else f"{lag:.1f}s", error or "reachable")
+            self.healthy[i], self.lag_seconds[i], self.errors[i] = healthy, lag, error
+        self.checks += 1
+
+    def _run_checks(self) -> None:
+        while True:
+            try:
+                self.check()
+            except Exception:
+                # The primary itself is unreachable; keep the last known state and try again
+                logger.exception("Replica check failed")
+            time.sleep(REPLICA_CHECK_SECONDS)
+
+    def _ensure_checker(self) -> None:
+        # One checker per worker process, started on first use (a thread started before a fork doesn't survive it)
+        if self._checker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._checker_pid != os.getpid():
+                self.healthy = [False] * len(self.engines)
+                threading.Thread(target=self._run_checks, name="motk-replica-check", daemon=True).start()
+                self._checker_pid = os.getpid()
+
+    # --- Routing ---
+    def is_sticky(self, request) -> bool:
+        now = time.time()
+        for until in (request.headers.get(STICKY_HEADER), request.cookies.get(STICKY_COOKIE)):
+            try:
+                # Allow a second of clock difference between workers
+                if until and now < float(until) <= now + REPLICA_STICKY_SECONDS + 1:
+                    return True
+            except ValueError:
+                pass
+        authorization = request.headers.get("authorization")
+        return bool(authorization) and self.recent_writers.get(_digest(authorization)) is not None
+
+    def choose(self, request) -> Optional[int]:
+        """Index of the replica to serve this request, or None for the primary."""
+        if not self.engines or request.method not in SAFE_METHODS:
+            return None
+        if not getattr(request.scope.get("endpoint"), "replica_reads", False):
+            return None
+        self._ensure_checker()
+        if self.is_sticky(request):
+            self.sticky += 1
+            return None
+        healthy = [i for i, ok in enumerate(self.healthy) if ok]
+        if not healthy:
+            self.routed_primary += 1
+            return None
+        index = healthy[next(self._next) % len(healthy)]
+        self.routed[index] += 1
+        return index
+
+    def note_write(self, authorization: Optional[str]) -> None:
+        if authorization:
+            self.recent_writers.set(_digest(authorization), True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "replicas": [{"healthy": self.healthy[i], "lag_seconds": self.lag_seconds[i], "error": self.errors[i], "routed": self.routed[i]}
+                         for i in range(len(self.engines))],
+            "routed_primary_no_healthy_replica": self.routed_primary,
+            "routed_primary_sticky": self.sticky,
+            "checks": self.checks,
+            "max_lag_seconds": REPLICA_MAX_LAG_SECONDS,
+            "sticky_seconds": REPLICA_STICKY_SECONDS,
+        }
+
+
+def _digest(authorization: str) -> str:
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+class ReplicaRoutingMiddleware:
+    """Pins a client to the primary for REPLICA_STICKY_SECONDS after each of its writes (header and cookie)."""
+
+    def __init__(self, app, replica_set: ReplicaSet):
+        self.app = app
+        self.replica_set = replica_set
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.replica_set.engines or scope["method"] in SAFE_METHODS:
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                self.replica_set.note_write(authorization)
+                until = f"{time.time() + REPLICA_STICKY_SECONDS:.3f}"
+                cookie = f"{STICKY_COOKIE}={until}; Max-Age={int(REPLICA_STICKY_SECONDS) + 1}; Path=/; HttpOnly; SameSite=Lax"
+                headers = [(STICKY_HEADER.lower().encode(), until.encode()), (b"set-cookie", cookie.encode())]
+                message = {**message, "headers": [*message.get("headers", []), *headers]}
+            await send(message)
+
+        authorization = next((value.decode("latin-1") for name, value in scope.get("headers", []) if name == b"authorization"), None)
+        # Also before the write runs, so a read sent while it is in flight goes to the primary
+        self.replica_set.note_write(authorization)
+        await self.app(scope, receive, send_with_cookie)
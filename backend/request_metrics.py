@@ -0,0 +1,349 @@
+"""Per-route latency, SQL query counts and N+1 detection, exported in Prometheus format.
+
+``RequestMetricsMiddleware`` times every HTTP request. Engine-level SQLAlchemy
+events add each statement the request runs (in any thread the request uses)
+to a per-request tally through a context variable. At the end of the request
+the tally goes into per-route histograms, labelled with the route template
+(``/projects/{project_id}``), not the raw path.
+
+The tally also flags N+1 patterns. If one SQL text runs N_PLUS_ONE_THRESHOLD
+or more times in a single request, typically a lazy relationship loaded per
+row, the route is counted in ``motk_http_n_plus_one_requests_total``. The
+statement is logged once per process and kept in ``findings()`` for
+/internal/metrics. Responses carry a ``Server-Timing`` header with the
+query count and database time, which browser dev tools display.
+
+Slow requests can be profiled. With PROFILE_SAMPLE_RATE > 0, that fraction
+of requests runs the endpoint function under cProfile, one request at a time
+per process. Those that take PROFILE_SLOW_SECONDS or longer are dumped to
+PROFILE_DIR as ``.prof`` files (open with ``python -m pstats`` or snakeviz).
+Response serialization is outside the endpoint, so it is timed and its
+queries are counted, but it is not in the profile.
+
+Values are per worker process, like pool_metrics. GET /metrics serves them
+in the Prometheus text format to ``Authorization: Bearer <METRICS_TOKEN>``.
+Without METRICS_TOKEN the endpoint is off (404); admins can still read the
+same numbers from /internal/metrics.
+"""
+import cProfile
+import contextvars
+import functools
+import hmac
+import inspect
+import logging
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import pool_metrics
+
+logger = logging.getLogger(__name__)
+
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "1"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+MAX_FINDINGS = 200
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+QUERY_COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.n += 1
+
+
+class RouteMetrics:
+    """Everything recorded for one (method, route)."""
+
+    def __init__(self):
+        self.latency: Dict[str, Histogram] = {}  # status code -> histogram
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_seconds = Histogram(LATENCY_BUCKETS)
+        self.n_plus_one = 0
+
+
+class RequestStats:
+    """The running tally of one request. Shared by every thread the request's context is copied to."""
+    __slots__ = ("queries", "db_seconds", "statements", "profile")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements: Counter = Counter()
+        self.profile: Optional[cProfile.Profile] = None
+
+
+current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("motk_request_stats", default=None)
+
+_lock = threading.Lock()
+_routes: Dict[Tuple[str, str], RouteMetrics] = {}
+_findings: Dict[Tuple[str, str, str], int] = {}  # (method, route, statement) -> most repeats seen in one request
+_profiling = threading.Lock()
+
+
+# --- SQL ---
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current.get() is not None:
+        conn.info.setdefault("motk_query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current.get()
+    if stats is None:
+        return
+    started = conn.info.get("motk_query_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    # += on the shared object is not atomic, but a request's threads run its queries one after another
+    stats.queries += 1
+    stats.db_seconds += elapsed
+    stats.statements[statement] += 1
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    started = context.connection.info.get("motk_query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+# --- Recording ---
+def record(method: str, route: str, status_code: int, seconds: float, stats: RequestStats) -> None:
+    repeated = [(statement, n) for statement, n in stats.statements.items() if n >= N_PLUS_ONE_THRESHOLD]
+    with _lock:
+        metrics = _routes.get((method, route))
+        if metrics is None:
+            metrics = _routes[(method, route)] = RouteMetrics()
+        latency = metrics.latency.get(str(status_code))
+        if latency is None:
+            latency = metrics.latency[str(status_code)] = Histogram(LATENCY_BUCKETS)
+        latency.observe(seconds)
+        metrics.queries.observe(stats.queries)
+        metrics.db_seconds.observe(stats.db_seconds)
+        if not repeated:
+            return
+        metrics.n_plus_one += 1
+        new = []
+        for statement, n in repeated:
+            key = (method, route, " ".join(statement.split()))
+            if key not in _findings:
+                if len(_findings) >= MAX_FINDINGS:
+                    continue
+                new.append((key[2], n))
+            _findings[key] = max(n, _findings.get(key, 0))
+    for statement, n in new:
+        logger.warning("Possible N+1 in %s %s: statement ran %d times in one request: %.500s", method, route, n, statement)
+
+
+def findings() -> List[Dict[str, Any]]:
+    """Statements that repeated N_PLUS_ONE_THRESHOLD+ times in one request, worst first."""
+    with _lock:
+        items = sorted(_findings.items(), key=lambda item: -item[1])
+    return [{"method": m, "route": r, "statement": s, "max_repeats": n} for (m, r, s), n in items]
+
+
+def summary() -> List[Dict[str, Any]]:
+    """Per-route request count, mean latency, mean queries and N+1 count, slowest total first (for /internal/metrics)."""
+    rows = []
+    with _lock:
+        for (method, route), metrics in _routes.items():
+            n = metrics.queries.n
+            total = sum(h.total for h in metrics.latency.values())
+            rows.append({"method": method, "route": route, "requests": n, "seconds_total": round(total, 6),
+                         "mean_seconds": round(total / n, 6) if n else 0.0,
+                         "mean_queries": round(metrics.queries.total / n, 2) if n else 0.0,
+                         "mean_db_seconds": round(metrics.db_seconds.total / n, 6) if n else 0.0,
+                         "n_plus_one_requests": metrics.n_plus_one})
+    return sorted(rows, key=lambda row: -row["seconds_total"])
+
+
+# --- Profiling ---
+def _start_profile(stats: RequestStats) -> Optional[cProfile.Profile]:
+    if PROFILE_SAMPLE_RATE <= 0 or stats.profile is not None or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    if not _profiling.acquire(blocking=False):
+        return None
+    stats.profile = cProfile.Profile()
+    return stats.profile
+
+
+def _finish_profile(stats: RequestStats, method: str, route: str, seconds: float) -> None:
+    profile, stats.profile = stats.profile, None
+    _profiling.release()
+    if seconds < PROFILE_SLOW_SECONDS:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}_{os.getpid()}_{method}_{slug}_{int(seconds * 1000)}ms.prof")
+    profile.dump_stats(path)
+    logger.warning("Slow request %s %s took %.3fs; profile written to %s", method, route, seconds, path)
+
+
+def _profiled(endpoint):
+    """Wrap an endpoint so that a sampled request runs it under the request's profiler, in whatever thread it runs."""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            stats = current.get()
+            profile = stats and _start_profile(stats)
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            profile.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.disable()
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            stats = current.get()
+            profile = stats and _start_profile(stats)
+            if profile is None:
+                return endpoint(*args, **kwargs)
+            profile.enable()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                profile.disable()
+    return wrapper
+
+
+class InstrumentedRoute(APIRoute):
+    """Route class that makes endpoints profilable (``app.router.route_class``)."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+# --- Middleware ---
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = current.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                timing = f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries", app;dur={(time.perf_counter() - started) * 1000:.1f}'
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current.reset(token)
+            seconds = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+            record(scope["method"], route, status_code, seconds, stats)
+            if stats.profile is not None:
+                _finish_profile(stats, scope["method"], route, seconds)
+
+
+# --- Prometheus exposition ---
+def enabled() -> bool:
+    return bool(METRICS_TOKEN)
+
+
+def authorized(authorization: Optional[str]) -> bool:
+    """Whether the header carries METRICS_TOKEN. Always False when no token is configured."""
+    if not METRICS_TOKEN:
+        return False
+    return hmac.compare_digest((authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{name}="{_label(str(value))}"' for name, value in labels.items())
+
+
+def _bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _histogram(lines: List[str], name: str, labels: str, histogram: Histogram) -> None:
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + [float("inf")], histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{_bound(bound)}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.total!r}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.n}")
+
+
+def render() -> str:
+    """All request and connection pool metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines: List[str] = []
+    with _lock:
+        routes = sorted(_routes.items())
+        lines += ["# HELP motk_http_request_duration_seconds Request latency by route.",
+                  "# TYPE motk_http_request_duration_seconds histogram"]
+        for (method, route), metrics in routes:
+            for status_code, histogram in sorted(metrics.latency.items()):
+                _histogram(lines, "motk_http_request_duration_seconds", _labels(method=method, route=route, status=status_code), histogram)
+        lines += ["# HELP motk_http_request_queries SQL statements run per request.",
+                  "# TYPE motk_http_request_queries histogram"]
+        for (method, route), metrics in routes:
+            _histogram(lines, "motk_http_request_queries", _labels(method=method, route=route), metrics.queries)
+        lines += ["# HELP motk_http_request_db_seconds Time spent in SQL statements per request.",
+                  "# TYPE motk_http_request_db_seconds histogram"]
+        for (method, route), metrics in routes:
+            _histogram(lines, "motk_http_request_db_seconds", _labels(method=method, route=route), metrics.db_seconds)
+        lines += ["# HELP motk_http_n_plus_one_requests_total Requests that ran one statement N_PLUS_ONE_THRESHOLD or more times.",
+                  "# TYPE motk_http_n_plus_one_requests_total counter"]
+        for (method, route), metrics in routes:
+            lines.append(f"motk_http_n_plus_one_requests_total{{{_labels(method=method, route=route)}}} {metrics.n_plus_one}")
+
+    pools = pool_metrics.snapshot()
+    lines += ["# HELP motk_db_pool_checkout_seconds Time spent waiting for a pooled connection.",
+              "# TYPE motk_db_pool_checkout_seconds histogram"]
+    for name, pool in sorted(pools.items()):
+        labels = _labels(pool=name)
+        for bound, cumulative in pool["checkout_seconds_buckets"].items():
+            lines.append(f'motk_db_pool_checkout_seconds_bucket{{{labels},le="{bound if bound == "+Inf" else repr(float(bound))}"}} {cumulative}')
+        lines.append(f"motk_db_pool_checkout_seconds_sum{{{labels}}} {pool['checkout_seconds_total']!r}")
+        lines.append(f"motk_db_pool_checkout_seconds_count{{{labels}}} {pool['checkouts']}")
+    lines += ["# HELP motk_db_pool_timeouts_total Checkouts that gave up after the pool timeout.",
+              "# TYPE motk_db_pool_timeouts_total counter"]
+    for name, pool in sorted(pools.items()):
+        lines.append(f"motk_db_pool_timeouts_total{{{_labels(pool=name)}}} {pool['timeouts']}")
+    lines += ["# HELP motk_db_pool_checked_out Connections currently checked out.",
+              "# TYPE motk_db_pool_checked_out gauge"]
+    for name, pool in sorted(pools.items()):
+        if "checked_out" in pool:
+            lines.append(f"motk_db_pool_checked_out{{{_labels(pool=name)}}} {pool['checked_out']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,140 @@
+"""Cache of pre-serialized JSON responses for hot project reads.
+
+Keys are ``(project_id, representation, version)``, where ``version`` is the
+project's change counter (see changes.py). A write therefore never serves a
+stale body, even from another worker's cache. Writes also drop the project's
+entries right away (``invalidate_project``), so old versions don't hold
+memory until LRU eviction gets to them.
+
+The cache is bounded by entry count and by total bytes, with LRU eviction.
+Concurrent misses for one key are coalesced: the first request builds the
+body and the others wait for its result instead of running the same query.
+"""
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+try:
+    import orjson
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value)
+except ImportError:  # orjson がない環境では標準の json で代用する (遅い)
+    import json
+
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, default=str, separators=(",", ":")).encode()
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _lookup(self, key: Hashable) -> Tuple[bytes, Future, bool]:
+        """(cached body, future to wait on, whether this caller must build the body)."""
+        with self._lock:
+            body = self._data.get(key)
+            if body is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return body, None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return None, future, False
+            self.misses += 1
+            future = self._inflight[key] = Future()
+            return None, future, True
+
+    def _finish(self, key: Hashable, future: Future, body: bytes = None, error: BaseException = None) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+            if error is None and len(body) <= self.max_bytes:
+                self._store(key, body)
+        if error is None:
+            future.set_result(body)
+        else:
+            future.set_exception(error)
+
+    def _store(self, key: Hashable, body: bytes) -> None:
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.bytes_held -= len(old)
+        self._data[key] = body
+        self.bytes_held += len(body)
+        while len(self._data) > self.max_entries or self.bytes_held > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.bytes_held -= len(evicted)
+            self.evictions += 1
+
+    def get_or_create(self, key: Hashable, produce: Callable[[], bytes]) -> bytes:
+        body, future, owner = self._lookup(key)
+        if body is not None:
+            return body
+        if not owner:
+            return future.result()
+        try:
+            body = produce()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, body)
+        return body
+
+    async def get_or_create_async(self, key: Hashable, produce: Callable[[], Awaitable[bytes]]) -> bytes:
+        body, future, owner = self._lookup(key)
+        if body is not None:
+            return body
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            body = await produce()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, body)
+        return body
+
+    def invalidate_project(self, project_id: int) -> int:
+        with self._lock:
+            keys = [key for key in self._data if key[0] == project_id]
+            for key in keys:
+                self.bytes_held -= len(self._data.pop(key))
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "bytes": self.bytes_held,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "inflight": len(self._inflight),
+            }
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
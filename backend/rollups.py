@@ -0,0 +1,231 @@
+"""Per-project progress counts, kept current in the same transaction as each write.
+
+``project_rollups`` holds one count per (project, entity, status, department,
+assignee). GET /projects/{id}/stats reads one project's rows. Their number
+depends on how many statuses and assignees are in use, not on how many shots or
+tasks the project has.
+
+ORM writes are counted by an ``after_flush`` hook. Core ``insert()``/``update()``
+statements bypass it and must report their rows themselves:
+
+* after an insert: ``track_rows(db, entity, rows)``
+* around an update: ``untrack_matching(db, model, conditions)`` first, then
+  ``track_rows`` with the RETURNING rows
+* anything else: ``apply(db, deltas)`` with deltas built by ``key``
+
+Counts that drifted (a write path that forgot to report, a manual SQL fix) are
+reconciled with
+
+    python -m backend.rollups [--project ID] [--check]
+"""
+import argparse
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import database
+from .database import Asset, ProjectMember, ProjectRollup, ProjectVersion, Shot, Task
+
+ENTITIES = {Shot: "shots", Asset: "assets", Task: "tasks"}
+UNASSIGNED = "Unassigned"
+_UPSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+_KEY_COLUMNS = ("project_id", "entity", "status", "department", "assignee_id")
+# Attributes that decide which count a row belongs to
+_COUNTED_BY = {Shot: ("project_id", "status"), Asset: ("project_id", "status"), Task: ("project_id", "status", "assigned_to_id")}
+
+
+def key(entity: str, project_id: int, status: Optional[str], department: str = "", assignee_id: Optional[int] = 0) -> tuple:
+    return (project_id, entity, status or "", department, assignee_id or 0)
+
+
+def _departments(db, member_ids: Iterable[Optional[int]]) -> Dict[int, str]:
+    ids = {member_id for member_id in member_ids if member_id}
+    if not ids:
+        return {}
+    rows = db.execute(select(ProjectMember.id, ProjectMember.department).where(ProjectMember.id.in_(ids)))
+    return {member_id: department or UNASSIGNED for member_id, department in rows}
+
+
+def _task_key(project_id: int, status: Optional[str], assignee_id: Optional[int], departments: Dict[int, str]) -> tuple:
+    department = departments.get(assignee_id, UNASSIGNED) if assignee_id else UNASSIGNED
+    return key("tasks", project_id, status, department, assignee_id)
+
+
+def apply(db, deltas: Counter) -> None:
+    """Add ``deltas`` (key -> change in count) to the stored counts."""
+    rows = [dict(zip(_KEY_COLUMNS, k), count=n) for k, n in sorted(deltas.items()) if n]
+    if not rows:
+        return
+    table = ProjectRollup.__table__
+    upsert = _UPSERTS.get((db.get_bind() if isinstance(db, Session) else db).dialect.name)
+    if upsert is not None:
+        stmt = upsert(table)
+        db.execute(stmt.on_conflict_do_update(index_elements=list(_KEY_COLUMNS), set_={"count": table.c.count + stmt.excluded["count"]}), rows)
+        return
+    for row in rows:
+        match = [table.c[column] == row[column] for column in _KEY_COLUMNS]
+        if db.execute(table.update().where(*match).values(count=table.c.count + row["count"])).rowcount == 0:
+            db.execute(table.insert().values(**row))
+
+
+def track_rows(db, entity: str, rows, sign: int = 1) -> None:
+    """Count (or with ``sign=-1`` uncount) rows that have project_id, status and, for tasks, assigned_to_id."""
+    deltas = Counter()
+    if entity == "tasks":
+        departments = _departments(db, (row.assigned_to_id for row in rows))
+        for row in rows:
+            deltas[_task_key(row.project_id, row.status, row.assigned_to_id, departments)] += sign
+    else:
+        for row in rows:
+            deltas[key(entity, row.project_id, row.status)] += sign
+    apply(db, deltas)
+
+
+def untrack_matching(db, model, conditions: List) -> None:
+    """Uncount the rows a Core update/delete with ``conditions`` is about to change (one GROUP BY query)."""
+    columns = [model.project_id, model.status] + ([model.assigned_to_id] if model is Task else [])
+    groups = db.execute(select(*columns, func.count()).where(*conditions).group_by(*columns)).all()
+    deltas = Counter()
+    if model is Task:
+        departments = _departments(db, (g.assigned_to_id for g in groups))
+        for project_id, status, assignee_id, n in groups:
+            deltas[_task_key(project_id, status, assignee_id, departments)] -= n
+    else:
+        for project_id, status, n in groups:
+            deltas[key(ENTITIES[model], project_id, status)] -= n
+    apply(db, deltas)
+
+
+def _previous(obj, attribute: str):
+    # flush 前の値。未ロードの属性は履歴を持たないので現在の値を使う (ずれは rebuild で直る)
+    history = inspect(obj).attrs[attribute].history
+    return history.deleted[0] if history.deleted else getattr(obj, attribute)
+
+
+@event.listens_for(Session, "after_flush")
+def _count_changes(session: Session, flush_context) -> None:
+    # new/dirty/deleted and attribute histories still hold the pre-flush state here
+    counted = [(obj, 1, False) for obj in session.new if type(obj) in ENTITIES]
+    counted += [(obj, -1, True) for obj in session.deleted if type(obj) in ENTITIES]
+    for obj in session.dirty:
+        if type(obj) in ENTITIES and any(inspect(obj).attrs[a].history.has_changes() for a in _COUNTED_BY[type(obj)]):
+            counted += [(obj, -1, True), (obj, 1, False)]
+    moved = [obj for obj in session.dirty if type(obj) is ProjectMember and inspect(obj).attrs.department.history.deleted]
+    if not counted and not moved:
+        return
+
+    conn = session.connection()
+    deltas = Counter()
+    # A member who changed department takes their task counts along. The stored rows still describe
+    # the pre-flush tasks; the task deltas below use the new department for both sides.
+    for member in moved:
+        old_department = _previous(member, "department") or UNASSIGNED
+        rows = conn.execute(select(ProjectRollup.status, ProjectRollup.count).where(
+            ProjectRollup.project_id == member.project_id, ProjectRollup.entity == "tasks",
+            ProjectRollup.department == old_department, ProjectRollup.assignee_id == member.id,
+        )).all()
+        for status, n in rows:
+            deltas[key("tasks", member.project_id, status, old_department, member.id)] -= n
+            deltas[key("tasks", member.project_id, status, member.department or UNASSIGNED, member.id)] += n
+
+    value = lambda obj, attribute, previous: _previous(obj, attribute) if previous else getattr(obj, attribute)
+    departments = _departments(conn, (value(obj, "assigned_to_id", previous) for obj, _, previous in counted if type(obj) is Task))
+    for obj, sign, previous in counted:
+        project_id, status = value(obj, "project_id", previous), value(obj, "status", previous)
+        if type(obj) is Task:
+            deltas[_task_key(project_id, status, value(obj, "assigned_to_id", previous), departments)] += sign
+        else:
+            deltas[key(ENTITIES[type(obj)], project_id, status)] += sign
+    apply(conn, deltas)
+
+
+def project_stats(db: Session, project_id: int) -> dict:
+    rows = db.execute(
+        select(ProjectRollup.entity, ProjectRollup.status, ProjectRollup.department, ProjectRollup.assignee_id, ProjectRollup.count)
+        .where(ProjectRollup.project_id == project_id, ProjectRollup.count != 0)
+    ).all()
+    stats = {entity: {"total": 0, "by_status": defaultdict(int)} for entity in ENTITIES.values()}
+    stats["tasks"].update(by_department=defaultdict(int), by_assignee=defaultdict(int))
+    for entity, status, department, assignee_id, n in rows:
+        summary = stats[entity]
+        summary["total"] += n
+        summary["by_status"][status] += n
+        if entity == "tasks":
+            summary["by_department"][department] += n
+            summary["by_assignee"][assignee_id] += n
+    return {"project_id": project_id, **stats}
+
+
+# --- Rebuild ---
+def _expected(db: Session, project_id: Optional[int]) -> Counter:
+    scope = lambda model: [model.project_id == project_id] if project_id is not None else []
+    expected = Counter()
+    for model in (Shot, Asset):
+        for pid, status, n in db.execute(select(model.project_id, model.status, func.count()).where(*scope(model))
+                                         .group_by(model.project_id, model.status)):
+            expected[key(ENTITIES[model], pid, status)] += n
+    tasks = db.execute(
+        select(Task.project_id, Task.status, Task.assigned_to_id, ProjectMember.department, func.count())
+        .outerjoin(ProjectMember, Task.assigned_to_id == ProjectMember.id).where(*scope(Task))
+        .group_by(Task.project_id, Task.status, Task.assigned_to_id, ProjectMember.department)
+    )
+    for pid, status, assignee_id, department, n in tasks:
+        expected[_task_key(pid, status, assignee_id, {assignee_id: department or UNASSIGNED} if assignee_id else {})] += n
+    return expected
+
+
+def rebuild(db: Session, project_id: Optional[int] = None) -> Dict[tuple, tuple]:
+    """Recount from the source tables and rewrite the stored counts. Returns drift as key -> (stored, actual).
+
+    The caller commits (or rolls back to only check).
+    """
+    # Writers hold their project's project_versions row until commit; taking it serializes with them
+    locked = select(ProjectVersion.project_id)
+    if project_id is not None:
+        locked = locked.where(ProjectVersion.project_id == project_id)
+    db.execute(locked.order_by(ProjectVersion.project_id).with_for_update()).all()
+
+    stored_rows = select(*[ProjectRollup.__table__.c[c] for c in _KEY_COLUMNS], ProjectRollup.count)
+    if project_id is not None:
+        stored_rows = stored_rows.where(ProjectRollup.project_id == project_id)
+    stored = Counter({tuple(row[:-1]): row[-1] for row in db.execute(stored_rows) if row[-1]})
+    expected = _expected(db, project_id)
+    drift = {k: (stored[k], expected[k]) for k in set(stored) | set(expected) if stored[k] != expected[k]}
+
+    clear = delete(ProjectRollup)
+    if project_id is not None:
+        clear = clear.where(ProjectRollup.project_id == project_id)
+    db.execute(clear)
+    apply(db, expected)
+    return drift
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--project", type=int, help="only this project (default: all projects)")
+    parser.add_argument("--check", action="store_true", help="report drift without rewriting the counts; exit 1 if any")
+    args = parser.parse_args()
+
+    with database.SessionLocal() as db:
+        drift = rebuild(db, args.project)
+        if args.check:
+            db.rollback()
+        else:
+            db.commit()
+    for (project_id, entity, status, department, assignee_id), (stored, actual) in sorted(drift.items()):
+        print(f"project {project_id} {entity:<6} status={status!r} department={department!r} assignee={assignee_id}: {stored} -> {actual}")
+    scope = f"project {args.project}" if args.project is not None else "all projects"
+    if not drift:
+        print(f"Rollups for {scope} match the source tables.")
+    else:
+        print(f"{len(drift)} rollup counts for {scope} {'have drifted' if args.check else 'were corrected'}.")
+    return 1 if drift and args.check else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Ranked name search across shots, assets, tasks and project members.
+
+A name matches when it contains the query (case-insensitive) or when its
+trigram similarity to the query reaches SEARCH_SIMILARITY_THRESHOLD. Hits are
+ranked exact match, then prefix, then substring, then fuzzy-only; within a
+tier by similarity, then entity and id.
+
+* PostgreSQL: ``pg_trgm`` GIN indexes on the name columns serve both the
+  ILIKE and the ``%`` (similarity) conditions.
+* Other backends (SQLite): a per-project trigram index held in process. It
+  remembers the project version (see changes.py) it was built at and, like a
+  delta-sync client, reads only the rows and tombstones written since.
+  Writes from other workers are therefore picked up on the next search.
+
+Similarity is computed the way ``pg_trgm`` does it, so both backends rank
+the same way.
+"""
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import case, func, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from .cache import TTLCache
+from .database import Asset, ProjectMember, ProjectVersion, Shot, Task, Tombstone
+
+SEARCH_SIMILARITY_THRESHOLD = float(os.getenv("SEARCH_SIMILARITY_THRESHOLD", "0.3"))
+# In-process indexes (non-PostgreSQL): projects kept per worker, and how long an unused one is kept
+SEARCH_INDEX_MAX_PROJECTS = int(os.getenv("SEARCH_INDEX_MAX_PROJECTS", "200"))
+SEARCH_INDEX_IDLE_SECONDS = float(os.getenv("SEARCH_INDEX_IDLE_SECONDS", "3600"))
+
+# Entity name -> (model, name column)
+ENTITIES = {
+    "shots": (Shot, Shot.name),
+    "assets": (Asset, Asset.name),
+    "tasks": (Task, Task.name),
+    "members": (ProjectMember, ProjectMember.display_name),
+}
+
+EXACT, PREFIX, SUBSTRING, FUZZY = range(4)
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+# --- Trigrams (pg_trgm semantics) ---
+def trigrams(text: str) -> FrozenSet[str]:
+    """Lowercased alphanumeric words, each padded with two spaces in front and one behind."""
+    grams = set()
+    for word in _WORD.findall(text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def _tier(name: str, query: str) -> int:
+    name, query = name.lower(), query.lower()
+    if name == query:
+        return EXACT
+    if name.startswith(query):
+        return PREFIX
+    if query in name:
+        return SUBSTRING
+    return FUZZY
+
+
+# --- In-process index ---
+class NameIndex:
+    """Trigram index over one project's searchable names, caught up from its change sequence."""
+
+    def __init__(self, project_id: int):
+        self.project_id = project_id
+        self.version = -1  # nothing loaded yet; rows written before delta sync have change_seq 0
+        self.lock = threading.Lock()
+        self._docs: Dict[Tuple[str, int], Tuple[str, FrozenSet[str]]] = {}
+        self._postings: Dict[str, Set[Tuple[str, int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _remove(self, key: Tuple[str, int]) -> None:
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        for gram in doc[1]:
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(key)
+                if not postings:
+                    del self._postings[gram]
+
+    def _put(self, key: Tuple[str, int], name: str) -> None:
+        self._remove(key)
+        grams = trigrams(name)
+        self._docs[key] = (name, grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def catch_up(self, db: Session, version: int) -> None:
+        """Apply the rows and tombstones written after ``self.version``, up to ``version``. Call with ``lock`` held."""
+        if version == self.version:
+            return
+        # Applied in sequence order: SQLite may reuse the id of a deleted row
+        ops = []
+        for entity, (model, column) in ENTITIES.items():
+            rows = db.execute(select(model.change_seq, model.id, column).where(
+                model.project_id == self.project_id, model.change_seq > self.version, model.change_seq <= version,
+            ))
+            ops.extend((seq, 1, entity, row_id, name) for seq, row_id, name in rows)
+        deleted = db.execute(select(Tombstone.change_seq, Tombstone.entity, Tombstone.entity_id).where(
+            Tombstone.project_id == self.project_id, Tombstone.change_seq > self.version, Tombstone.change_seq <= version,
+        ))
+        ops.extend((seq, 0, entity, entity_id, None) for seq, entity, entity_id in deleted)
+        for _, written, entity, row_id, name in sorted(ops, key=lambda op: op[:2]):
+            if written:
+                self._put((entity, row_id), name)
+            else:
+                self._remove((entity, row_id))
+        self.version = version
+
+    def search(self, query: str, entities: Iterable[str], threshold: float) -> List[tuple]:
+        """(tier, score, entity, id, name) for every matching name. Call with ``lock`` held."""
+        wanted = set(entities)
+        query_grams = trigrams(query)
+        lowered = query.lower()
+        # Substring candidates hold every 3-character window of the query's words
+        windows = {w[i:i + 3] for w in _WORD.findall(lowered) for i in range(len(w) - 2)}
+        if windows:
+            candidates = set.intersection(*(self._postings.get(gram, set()) for gram in windows))
+        else:
+            # Too short for trigrams: check every name
+            candidates = set(self._docs)
+        # Fuzzy candidates share at least one trigram; count them in one pass over the postings
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._postings.get(gram, ()))
+
+        hits = []
+        for key in candidates | set(shared):
+            if key[0] not in wanted:
+                continue
+            name, grams = self._docs[key]
+            n = shared.get(key, 0)
+            score = n / (len(grams) + len(query_grams) - n) if n else 0.0
+            contains = lowered in name.lower()
+            if contains or score >= threshold:
+                hits.append((_tier(name, query) if contains else FUZZY, score, key[0], key[1], name))
+        return hits
+
+
+indexes = TTLCache(maxsize=SEARCH_INDEX_MAX_PROJECTS, ttl=SEARCH_INDEX_IDLE_SECONDS)
+_indexes_lock = threading.Lock()
+
+
+def _project_index(project_id: int) -> NameIndex:
+    index = indexes.get(project_id)
+    if index is None:
+        with _indexes_lock:
+            index = indexes.get(project_id)
+            if index is None:
+                index = NameIndex(project_id)
+                indexes.set(project_id, index)
+    return index
+
+
+def _search_in_process(db: Session, project_ids: List[int], query: str, entities: List[str], threshold: float) -> List[dict]:
+    versions = dict(db.execute(select(ProjectVersion.project_id, ProjectVersion.version).where(ProjectVersion.project_id.in_(project_ids))).all())
+    hits = []
+    for project_id in project_ids:
+        index = _project_index(project_id)
+        with index.lock:
+            index.catch_up(db, versions.get(project_id, 0))
+            hits.extend((tier, -score, entity, row_id, project_id, name) for tier, score, entity, row_id, name in index.search(query, entities, threshold))
+    hits.sort()
+    return [{"entity": entity, "id": row_id, "project_id": project_id, "name": name, "score": -neg_score}
+            for _, neg_score, entity, row_id, project_id, name in hits]
+
+
+# --- PostgreSQL ---
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _search_postgres(db: Session, project_ids: List[int], query: str, entities: List[str], threshold: float,
+                     offset: int, limit: int) -> List[dict]:
+    escaped = _escape_like(query)
+    # Transaction-local; the % operator compares against this threshold
+    db.execute(select(func.set_config("pg_trgm.similarity_threshold", str(threshold), True)))
+    selects = []
+    for entity in entities:
+        model, column = ENTITIES[entity]
+        tier = case(
+            (func.lower(column) == query.lower(), EXACT),
+            (column.ilike(escaped + "%", escape="\\"), PREFIX),
+            (column.ilike("%" + escaped + "%", escape="\\"), SUBSTRING),
+            else_=FUZZY,
+        )
+        selects.append(
+            select(literal(entity).label("entity"), model.id.label("id"), model.project_id.label("project_id"),
+                   column.label("name"), func.similarity(column, query).label("score"), tier.label("tier"))
+            .where(model.project_id.in_(project_ids), or_(column.ilike("%" + escaped + "%", escape="\\"), column.bool_op("%")(query)))
+        )
+    hits = union_all(*selects).subquery()
+    rows = db.execute(
+        select(hits.c.entity, hits.c.id, hits.c.project_id, hits.c.name, hits.c.score)
+        .order_by(hits.c.tier, hits.c.score.desc(), hits.c.entity, hits.c.id).offset(offset).limit(limit)
+    )
+    return [dict(row._mapping) for row in rows]
+
+
+def search(db: Session, project_ids: List[int], query: str, entities: Optional[List[str]] = None,
+           offset: int = 0, limit: int = 50, threshold: float = SEARCH_SIMILARITY_THRESHOLD) -> Tuple[List[dict], Optional[int]]:
+    """One page of hits in ``project_ids``, and the offset of the next page (``None`` on the last page)."""
+    entities = [entity for entity in ENTITIES if entities is None or entity in entities]
+    if not project_ids or not entities:
+        return [], None
+    project_ids = sorted(set(project_ids))
+    # 1件多く読んで次ページの有無を判定する
+    if db.get_bind().dialect.name == "postgresql":
+        hits = _search_postgres(db, project_ids, query, entities, threshold, offset, limit + 1)
+    else:
+        hits = _search_in_process(db, project_ids, query, entities, threshold)[offset:offset + limit + 1]
+    if len(hits) <= limit:
+        return hits, None
+    return hits[:limit], offset + limit
+
+
+def stats() -> dict:
+    return indexes.stats()
@@ -0,0 +1,252 @@
+"""Streaming shot-list import from CSV and EDL files.
+
+The upload is copied to IMPORT_SPOOL_DIR in fixed-size blocks, then parsed
+record by record. Shot and Asset rows are upserted by name in chunks of
+IMPORT_CHUNK_SIZE records. Each chunk commits together with the progress on
+its ShotImport row, so a failed import resumes from the last committed chunk
+and memory stays flat regardless of file size.
+
+A running import keeps ``updated_at`` fresh (every chunk, and while skipping
+already-committed records). One not touched for IMPORT_STALE_SECONDS is taken
+to have lost its worker (deploy, OOM, restart) and can be resumed like a
+failed one. Progress is written with a compare-and-set on
+``records_committed``, so if the old worker was only slow, whichever of the
+two commits second stops without writing anything.
+
+CSV: a header row with ``name`` and optionally ``type`` (shot/asset, default
+shot), ``status`` and ``asset_type``.
+EDL (CMX 3600): one shot per event, named by the ``* LOC:`` marker, the
+``* FROM CLIP NAME:`` comment or the reel name, in that order of preference.
+"""
+import csv
+import datetime
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+from typing import BinaryIO, Dict, Iterator, List
+
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import database
+from . import changes
+from . import rollups
+from .database import ShotImport, Shot, Asset
+
+IMPORT_SPOOL_DIR = os.getenv("IMPORT_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "motk_imports")
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+IMPORT_STALE_SECONDS = float(os.getenv("IMPORT_STALE_SECONDS", "300"))
+COPY_BLOCK_SIZE = 1024 * 1024
+
+FORMATS = {".csv": "csv", ".edl": "edl"}
+
+
+class ImportSuperseded(Exception):
+    """Another worker resumed this import after it went stale; this one must stop."""
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# --- Parsers ---
+def iter_csv_records(stream: io.TextIOBase) -> Iterator[Dict[str, str]]:
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or "name" not in [f.strip().lower() for f in reader.fieldnames]:
+        raise ValueError("CSV must have a header row with a 'name' column.")
+    for row in reader:
+        row = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+        if not row.get("name"):
+            continue
+        entity = (row.get("type") or "shot").lower()
+        if entity not in ("shot", "asset"):
+            raise ValueError(f"Unknown type '{row.get('type')}' for '{row['name']}' (expected shot or asset).")
+        if entity == "asset" and not row.get("asset_type"):
+            raise ValueError(f"Asset '{row['name']}' has no asset_type.")
+        yield {"entity": entity, "name": row["name"], "status": row.get("status") or None, "asset_type": row.get("asset_type") or None}
+
+
+EDL_EVENT = re.compile(r"^(\d{3,})\s+(\S+)\s+\S+\s+\S+")
+EDL_LOC = re.compile(r"^\*\s*LOC:\s*\S+\s+\S+\s+(\S+)")
+EDL_CLIP_NAME = re.compile(r"^\*\s*FROM CLIP NAME:\s*(.+?)\s*$")
+
+
+def iter_edl_records(stream: io.TextIOBase) -> Iterator[Dict[str, str]]:
+    event_number, names = None, {}
+
+    def record():
+        name = names.get("loc") or names.get("clip") or names.get("reel")
+        return {"entity": "shot", "name": name, "status": None, "asset_type": None}
+
+    for line in stream:
+        line = line.strip()
+        event = EDL_EVENT.match(line)
+        if event:
+            # Transitions repeat the event number on a second line; keep it as one event
+            if event.group(1) != event_number:
+                if event_number is not None:
+                    yield record()
+                event_number, names = event.group(1), {"reel": event.group(2)}
+            continue
+        if event_number is None:
+            continue
+        loc, clip = EDL_LOC.match(line), EDL_CLIP_NAME.match(line)
+        if loc:
+            names["loc"] = loc.group(1)
+        elif clip:
+            names.setdefault("clip", clip.group(1))
+    if event_number is not None:
+        yield record()
+
+
+PARSERS = {"csv": iter_csv_records, "edl": iter_edl_records}
+
+
+# --- Spooling ---
+def create_import(db: Session, project_id: int, filename: str, upload: BinaryIO) -> ShotImport:
+    file_format = FORMATS.get(os.path.splitext(filename or "")[1].lower())
+    if file_format is None:
+        raise ValueError("Only .csv and .edl files can be imported.")
+    os.makedirs(IMPORT_SPOOL_DIR, exist_ok=True)
+    fd, spool_path = tempfile.mkstemp(prefix=f"project{project_id}_", suffix=f".{file_format}", dir=IMPORT_SPOOL_DIR)
+    with os.fdopen(fd, "wb") as spool:
+        shutil.copyfileobj(upload, spool, COPY_BLOCK_SIZE)
+    job = ShotImport(project_id=project_id, filename=filename, file_format=file_format, spool_path=spool_path,
+                     status="pending", bytes_total=os.path.getsize(spool_path))
+    db.add(job); db.commit(); db.refresh(job)
+    return job
+
+
+def claim_for_resume(db: Session, job: ShotImport) -> bool:
+    """Move a failed or abandoned (running, stale) import back to pending; False if it is not resumable."""
+    stale = _utcnow() - datetime.timedelta(seconds=IMPORT_STALE_SECONDS)
+    result = db.execute(
+        update(ShotImport).where(
+            ShotImport.id == job.id, ShotImport.spool_path.isnot(None),
+            or_(ShotImport.status == "failed", (ShotImport.status == "running") & (ShotImport.updated_at < stale)),
+        ).values(status="pending", error=None, updated_at=_utcnow())
+        # The caller refreshes ``job``; evaluating the stale cutoff in Python trips over naive SQLite datetimes
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+# --- Upsert ---
+def _upsert(db: Session, model, project_id: int, records: List[Dict[str, str]], stamp: Dict[str, object]):
+    """Insert unknown names, update changed status/asset_type on known ones. Returns (created, updated)."""
+    # 同じ名前が複数回出てきた場合は後の行を優先する
+    by_name = {r["name"]: r for r in records}
+    existing = db.execute(
+        select(model.__table__).where(model.project_id == project_id, model.name.in_(by_name))
+    ).mappings().all()
+    entity = "shots" if model is Shot else "assets"
+    counts = Counter()
+    updates = []
+    for row in existing:
+        record = by_name[row["name"]]
+        values = {key: record[key] for key in ("status", "asset_type") if key in row and record[key] and record[key] != row[key]}
+        if values:
+            updates.append({"id": row["id"], **values, **stamp})
+        if "status" in values:
+            counts[rollups.key(entity, project_id, row["status"])] -= 1
+            counts[rollups.key(entity, project_id, values["status"])] += 1
+    if updates:
+        db.execute(update(model), updates)
+    known = {row["name"] for row in existing}
+    new_rows = []
+    for name, record in by_name.items():
+        if name in known:
+            continue
+        values = {"name": name, "project_id": project_id, **stamp}
+        if record["status"]:
+            values["status"] = record["status"]
+        if model is Asset:
+            values["asset_type"] = record["asset_type"]
+        new_rows.append(values)
+        counts[rollups.key(entity, project_id, values.get("status", model.status.default.arg))] += 1
+    if new_rows:
+        db.execute(insert(model), new_rows)
+    rollups.apply(db, counts)
+    return len(new_rows), len(updates)
+
+
+def _commit_chunk(db: Session, job: ShotImport, chunk: List[Dict[str, str]], position: int, committed: int) -> int:
+    """Upsert one chunk and its progress in one transaction; returns the new ``records_committed``."""
+    # Core の INSERT/UPDATE は before_flush を通らないので、チャンク毎に1つのシーケンス番号を付ける
+    stamp = changes.stamp(db, job.project_id, "shots", "assets")
+    shots_created, shots_updated = _upsert(db, Shot, job.project_id, [r for r in chunk if r["entity"] == "shot"], stamp)
+    assets_created, assets_updated = _upsert(db, Asset, job.project_id, [r for r in chunk if r["entity"] == "asset"], stamp)
+    progress = db.execute(
+        update(ShotImport).where(ShotImport.id == job.id, ShotImport.status == "running", ShotImport.records_committed == committed)
+        .values(records_committed=committed + len(chunk), bytes_processed=position,
+                shots_created=ShotImport.shots_created + shots_created, shots_updated=ShotImport.shots_updated + shots_updated,
+                assets_created=ShotImport.assets_created + assets_created, assets_updated=ShotImport.assets_updated + assets_updated,
+                updated_at=_utcnow())
+    )
+    if progress.rowcount != 1:
+        db.rollback()
+        raise ImportSuperseded()
+    # データと進捗を同じトランザクションでコミットするので、再開位置は常に正確
+    db.commit()
+    return committed + len(chunk)
+
+
+def _touch(db: Session, job: ShotImport) -> None:
+    db.execute(update(ShotImport).where(ShotImport.id == job.id, ShotImport.status == "running").values(updated_at=_utcnow()))
+    db.commit()
+
+
+def run_import(import_id: int) -> None:
+    """Process (or resume) one import. Runs outside the request, with its own session."""
+    db = database.SessionLocal()
+    try:
+        claimed = db.execute(
+            update(ShotImport).where(ShotImport.id == import_id, ShotImport.status == "pending").values(status="running", updated_at=_utcnow())
+        )
+        db.commit()
+        if claimed.rowcount != 1:
+            return
+        job = db.get(ShotImport, import_id)
+        # A snapshot: progress is tracked in ``committed`` and written with compare-and-set, never reloaded from the row
+        db.expunge(job)
+        committed = job.records_committed
+        try:
+            with open(job.spool_path, "rb") as raw:
+                text = io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace", newline="")
+                chunk, touched = [], time.monotonic()
+                for n, record in enumerate(PARSERS[job.file_format](text)):
+                    if n < job.records_committed:
+                        # Skipping a long committed prefix can take a while; don't look abandoned meanwhile
+                        if time.monotonic() - touched > IMPORT_STALE_SECONDS / 3:
+                            _touch(db, job)
+                            touched = time.monotonic()
+                        continue
+                    chunk.append(record)
+                    if len(chunk) >= IMPORT_CHUNK_SIZE:
+                        committed = _commit_chunk(db, job, chunk, raw.tell(), committed)
+                        chunk = []
+                if chunk:
+                    committed = _commit_chunk(db, job, chunk, raw.tell(), committed)
+        except ImportSuperseded:
+            return
+        except Exception as exc:
+            db.rollback()
+            db.execute(update(ShotImport).where(ShotImport.id == import_id, ShotImport.status == "running",
+                                                ShotImport.records_committed == committed)
+                       .values(status="failed", error=str(exc)[:1000], updated_at=_utcnow()))
+            db.commit()
+            return
+        finished = db.execute(
+            update(ShotImport).where(ShotImport.id == import_id, ShotImport.status == "running", ShotImport.records_committed == committed)
+            .values(status="completed", spool_path=None, bytes_processed=job.bytes_total, updated_at=_utcnow())
+        )
+        db.commit()
+        if finished.rowcount == 1:
+            os.remove(job.spool_path)
+    finally:
+        db.close()
@@ -0,0 +1,380 @@
+"""Scan storage locations and keep the File registry in step with what is on disk.
+
+Each active StorageLocation's ``base_path`` is walked and every file is mapped
+to a project, and optionally a shot or asset, by naming rules. The files are
+then fingerprinted by a process pool and upserted into ``files`` in batches of
+STORAGE_SCAN_BATCH_SIZE, one commit per batch.
+
+Rescans are incremental. The walk is in path order, and so are the stored
+rows (read in keyset pages on the unique (location, relative_path) index).
+The two are merged like sorted lists:
+
+* a file whose size and mtime match its row is skipped without being opened
+* new and changed files are fingerprinted and upserted
+* rows whose file is gone get ``missing_at``; they come back if it reappears
+
+A nightly rescan therefore reads one stat per file and opens only what
+changed. Memory stays flat regardless of how many files a location holds.
+
+Naming rules are regular expressions matched against the relative path, in
+order. The first one whose ``project`` group names an existing project (by
+name, or by id if it is all digits) wins. Optional ``shot`` and ``asset``
+groups name a shot or asset of that project. Files no rule maps are counted
+as unmatched and not registered. STORAGE_SCAN_RULES points to a file with one
+rule per line; the default layout is
+
+    <project>/shots/<shot>/...
+    <project>/assets/<asset>/...
+    <project>/...
+
+The top-level ``.uploads``, ``.thumbnails`` and ``.proxies`` directories hold
+upload part files and renditions and are not scanned. With ``--thumbnails``,
+new and changed images and videos also get a thumbnail job (thumbnails.py).
+
+Run it from cron or by hand:
+
+    python -m backend.storage_scan [--location ID] [--workers N] [--full] [--thumbnails]
+"""
+import argparse
+import datetime
+import hashlib
+import os
+import re
+import sys
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Pattern, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import database
+from . import thumbnails
+from .database import Asset, File, Project, Shot, StorageLocation
+
+STORAGE_SCAN_WORKERS = int(os.getenv("STORAGE_SCAN_WORKERS", "0")) or os.cpu_count() or 1
+STORAGE_SCAN_BATCH_SIZE = int(os.getenv("STORAGE_SCAN_BATCH_SIZE", "500"))
+STORAGE_SCAN_RULES = os.getenv("STORAGE_SCAN_RULES")
+# Upload part files (uploads.PART_DIR) and renditions (thumbnails.THUMBNAIL_DIR, PROXY_DIR)
+SKIP_DIRS = {".uploads", ".thumbnails", ".proxies"}
+# Files up to this size are hashed whole; larger ones by size plus head, middle and tail samples
+FULL_HASH_MAX_BYTES = int(os.getenv("STORAGE_SCAN_FULL_HASH_MAX_BYTES", str(4 * 1024 * 1024)))
+SAMPLE_BYTES = 1024 * 1024
+# Stored rows read per keyset page during the merge
+INDEX_PAGE_SIZE = 10000
+
+DEFAULT_RULES = [
+    r"^(?P<project>[^/]+)/shots/(?P<shot>[^/]+)/",
+    r"^(?P<project>[^/]+)/assets/(?P<asset>[^/]+)/",
+    r"^(?P<project>[^/]+)/",
+]
+
+FILE_TYPES = {
+    "image": {"exr", "dpx", "tif", "tiff", "png", "jpg", "jpeg", "tga", "hdr", "psd", "cin"},
+    "video": {"mov", "mp4", "mxf", "avi", "mkv", "webm", "r3d", "braw", "ari"},
+    "audio": {"wav", "aif", "aiff", "mp3", "flac"},
+    "geometry": {"abc", "usd", "usda", "usdc", "usdz", "fbx", "obj", "vdb", "bgeo", "ply"},
+    "scene": {"ma", "mb", "hip", "hipnc", "nk", "blend", "max", "c4d", "ztl", "spp"},
+    "document": {"pdf", "txt", "csv", "edl", "xml", "json", "otio"},
+}
+_FILE_TYPE_BY_FORMAT = {fmt: file_type for file_type, formats in FILE_TYPES.items() for fmt in formats}
+_UPSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# --- Walk ---
+def walk(base_path: str, errors: Counter) -> Iterator[Tuple[str, int, int]]:
+    """(relative_path, size, mtime_ns) of every regular file under ``base_path``, in code point order of the path.
+
+    Entries are visited sorted by name with a "/" appended to directories, which
+    makes the depth-first order equal to sorting the full relative paths.
+    """
+    def visit(directory: str, prefix: str, skip=()) -> Iterator[Tuple[str, int, int]]:
+        try:
+            with os.scandir(directory) as it:
+                entries = []
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        entry.name.encode("utf-8")
+                    except (OSError, UnicodeEncodeError):
+                        errors["unreadable"] += 1
+                        continue
+                    if is_dir and entry.name in skip:
+                        continue
+                    entries.append((entry.name + "/" if is_dir else entry.name, is_dir, entry))
+        except OSError:
+            errors["unreadable"] += 1
+            return
+        entries.sort(key=lambda e: e[0])
+        for _, is_dir, entry in entries:
+            if is_dir:
+                yield from visit(entry.path, prefix + entry.name + "/")
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                errors["unreadable"] += 1
+                continue
+            if entry.is_file(follow_symlinks=False):
+                yield prefix + entry.name, st.st_size, st.st_mtime_ns
+
+    return visit(base_path, "", SKIP_DIRS)
+
+
+def _indexed(db: Session, location_id: int, started: datetime.datetime) -> Iterator[tuple]:
+    """Stored rows of the location as (relative_path, id, size_bytes, mtime_ns, missing_at), in path order.
+
+    Rows written by this scan (scanned_at >= started) are left out, so upserts made
+    while the merge is under way don't show up in a later page.
+    """
+    last = None
+    while True:
+        query = (select(File.relative_path, File.id, File.size_bytes, File.mtime_ns, File.missing_at)
+                 .where(File.storage_location_id == location_id)
+                 .where((File.scanned_at < started) | File.scanned_at.is_(None)))
+        if last is not None:
+            query = query.where(File.relative_path > last)
+        rows = db.execute(query.order_by(File.relative_path).limit(INDEX_PAGE_SIZE)).all()
+        yield from rows
+        if len(rows) < INDEX_PAGE_SIZE:
+            return
+        last = rows[-1].relative_path
+
+
+def diff(walked: Iterator[tuple], indexed: Iterator[tuple], full: bool = False) -> Iterator[tuple]:
+    """Merge the walk with the stored rows.
+
+    Yields ("write", (relative_path, size, mtime_ns)) for new and changed files and
+    ("missing", row_id) for rows whose file is gone. Unchanged files yield nothing.
+    """
+    end = object()
+    on_disk, stored = next(walked, end), next(indexed, end)
+    while on_disk is not end or stored is not end:
+        if stored is end or (on_disk is not end and on_disk[0] < stored[0]):
+            yield "write", on_disk
+            on_disk = next(walked, end)
+        elif on_disk is end or stored[0] < on_disk[0]:
+            if stored[4] is None:
+                yield "missing", stored[1]
+            stored = next(indexed, end)
+        else:
+            if full or stored[4] is not None or (stored[2], stored[3]) != on_disk[1:]:
+                yield "write", on_disk
+            on_disk, stored = next(walked, end), next(indexed, end)
+
+
+# --- Fingerprints (run in the worker processes) ---
+def fingerprint(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= FULL_HASH_MAX_BYTES:
+            for block in iter(lambda: f.read(SAMPLE_BYTES), b""):
+                digest.update(block)
+            return "blake2b:" + digest.hexdigest()
+        digest.update(str(size).encode())
+        for offset in (0, size // 2 - SAMPLE_BYTES // 2, size - SAMPLE_BYTES):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_BYTES))
+    return "blake2b-sampled:" + digest.hexdigest()
+
+
+def fingerprint_batch(base_path: str, batch: List[tuple]) -> List[tuple]:
+    """Append the fingerprint (``None`` if the file can't be read) to each (relative_path, ...) item."""
+    results = []
+    for item in batch:
+        try:
+            results.append((*item, fingerprint(os.path.join(base_path, item[0]))))
+        except OSError:
+            results.append((*item, None))
+    return results
+
+
+# --- Naming rules ---
+def load_rules(path: Optional[str] = STORAGE_SCAN_RULES) -> List[Pattern]:
+    if not path:
+        return [re.compile(rule) for rule in DEFAULT_RULES]
+    with open(path, encoding="utf-8") as f:
+        return [re.compile(line.strip()) for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+class PathMapper:
+    """Maps relative paths to (project_id, shot_id, asset_id) with the naming rules. Lookups are loaded lazily per project."""
+
+    def __init__(self, db: Session, rules: List[Pattern]):
+        self.db = db
+        self.rules = rules
+        self.projects = {name: project_id for project_id, name in db.execute(select(Project.id, Project.name).order_by(Project.id.desc()))}
+        self.project_ids = set(self.projects.values())
+        self._names: Dict[Tuple[type, int], Dict[str, int]] = {}
+
+    def _project(self, value: str) -> Optional[int]:
+        if value.isdigit() and int(value) in self.project_ids:
+            return int(value)
+        return self.projects.get(value)
+
+    def _lookup(self, model, project_id: int, name: Optional[str]) -> Optional[int]:
+        if not name:
+            return None
+        names = self._names.get((model, project_id))
+        if names is None:
+            names = self._names[(model, project_id)] = {
+                n: i for i, n in self.db.execute(select(model.id, model.name).where(model.project_id == project_id).order_by(model.id.desc()))
+            }
+        return names.get(name)
+
+    def map(self, relative_path: str) -> Optional[Tuple[int, Optional[int], Optional[int]]]:
+        for rule in self.rules:
+            match = rule.search(relative_path)
+            if not match:
+                continue
+            groups = match.groupdict()
+            project_id = self._project(groups.get("project") or "")
+            if project_id is None:
+                continue
+            return project_id, self._lookup(Shot, project_id, groups.get("shot")), self._lookup(Asset, project_id, groups.get("asset"))
+        return None
+
+
+# --- Upsert ---
+def file_row(location: StorageLocation, relative_path: str, size: int, mtime_ns: int, digest: str,
+              mapped: Tuple[int, Optional[int], Optional[int]], now: datetime.datetime) -> dict:
+    filename = relative_path.rsplit("/", 1)[-1]
+    file_format = os.path.splitext(filename)[1][1:].lower()
+    project_id, shot_id, asset_id = mapped
+    return {
+        "file_id": uuid.uuid4().hex, "original_filename": filename, "relative_path": relative_path,
+        "full_storage_path": os.path.join(location.base_path, relative_path),
+        "file_format": file_format, "file_type": _FILE_TYPE_BY_FORMAT.get(file_format, "other"),
+        "storage_location_id": location.id, "project_id": project_id, "shot_id": shot_id, "asset_id": asset_id,
+        "size_bytes": size, "mtime_ns": mtime_ns, "fingerprint": digest, "scanned_at": now, "missing_at": None,
+    }
+
+
+# Columns an upsert overwrites; file_id and id are kept, so references to the row stay valid
+_UPDATED_COLUMNS = ("original_filename", "full_storage_path", "file_format", "file_type", "project_id", "shot_id", "asset_id",
+                    "size_bytes", "mtime_ns", "fingerprint", "scanned_at", "missing_at")
+
+
+def upsert_files(db: Session, rows: List[dict]) -> None:
+    if not rows:
+        return
+    table = File.__table__
+    upsert = _UPSERTS.get(db.get_bind().dialect.name)
+    if upsert is not None:
+        stmt = upsert(table)
+        db.execute(stmt.on_conflict_do_update(index_elements=["storage_location_id", "relative_path"],
+                                              set_={column: stmt.excluded[column] for column in _UPDATED_COLUMNS}), rows)
+        return
+    for row in rows:
+        match = [table.c.storage_location_id == row["storage_location_id"], table.c.relative_path == row["relative_path"]]
+        if db.execute(table.update().where(*match).values({c: row[c] for c in _UPDATED_COLUMNS})).rowcount == 0:
+            db.execute(table.insert().values(**row))
+
+
+def _mark_missing(db: Session, ids: List[int], now: datetime.datetime) -> None:
+    if ids:
+        db.execute(update(File).where(File.id.in_(ids), File.missing_at.is_(None)).values(missing_at=now))
+
+
+# --- Scan ---
+def scan_location(db: Session, location: StorageLocation, pool: ProcessPoolExecutor, workers: int, rules: List[Pattern],
+                  full: bool = False, batch_size: int = STORAGE_SCAN_BATCH_SIZE, queue_thumbnails: bool = False) -> Counter:
+    """Bring one location's File rows up to date. Commits after every batch; returns the counts."""
+    counts = Counter()
+    started = _utcnow()
+    mapper = PathMapper(db, rules)
+    in_flight = deque()
+
+    def store(results) -> None:
+        now = _utcnow()
+        rows = []
+        for relative_path, size, mtime_ns, mapped, digest in results:
+            if digest is None:
+                counts["unreadable"] += 1
+                continue
+            rows.append(file_row(location, relative_path, size, mtime_ns, digest, mapped, now))
+        upsert_files(db, rows)
+        if queue_thumbnails:
+            media = [row["relative_path"] for row in rows if thumbnails.kind(row["relative_path"])]
+            if media:
+                files = db.execute(select(File).where(File.storage_location_id == location.id, File.relative_path.in_(media))).scalars()
+                counts["thumbnails"] += thumbnails.enqueue_for(db, files)
+        db.commit()
+        counts["written"] += len(rows)
+
+    def submit(batch) -> None:
+        in_flight.append(pool.submit(fingerprint_batch, location.base_path, batch))
+        # Keep every worker busy with one queued batch, without reading the whole walk ahead
+        while len(in_flight) >= 2 * workers or (in_flight and in_flight[0].done()):
+            store(in_flight.popleft().result())
+
+    def walked():
+        for entry in walk(location.base_path, counts):
+            counts["files"] += 1
+            yield entry
+
+    batch, missing = [], []
+    # The stored rows are read in whole pages, so the session can commit between batches
+    for kind, item in diff(walked(), _indexed(db, location.id, started), full):
+        if kind == "missing":
+            missing.append(item)
+            if len(missing) >= batch_size:
+                _mark_missing(db, missing, _utcnow()); db.commit(); counts["missing"] += len(missing); missing = []
+            continue
+        counts["changed"] += 1
+        # Map before fingerprinting, so files no rule claims are never read
+        mapped = mapper.map(item[0])
+        if mapped is None:
+            counts["unmatched"] += 1
+            continue
+        batch.append((*item, mapped))
+        if len(batch) >= batch_size:
+            submit(batch); batch = []
+    if batch:
+        submit(batch)
+    while in_flight:
+        store(in_flight.popleft().result())
+    _mark_missing(db, missing, _utcnow()); db.commit(); counts["missing"] += len(missing)
+    counts["unchanged"] = counts["files"] - counts["changed"]
+    return counts
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--location", type=int, help="only this storage location (default: every active one)")
+    parser.add_argument("--workers", type=int, default=STORAGE_SCAN_WORKERS, help=f"fingerprinting processes (default: {STORAGE_SCAN_WORKERS})")
+    parser.add_argument("--full", action="store_true", help="re-fingerprint every file, not only new and changed ones")
+    parser.add_argument("--thumbnails", action="store_true", help="queue thumbnail jobs for written images and videos")
+    args = parser.parse_args()
+
+    rules = load_rules()
+    failed = False
+    with database.SessionLocal() as db, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        locations = select(StorageLocation).where(StorageLocation.is_active == 1)
+        if args.location is not None:
+            locations = select(StorageLocation).where(StorageLocation.id == args.location)
+        for location in db.execute(locations.order_by(StorageLocation.id)).scalars().all():
+            if not location.base_path or not os.path.isdir(location.base_path):
+                print(f"location {location.id} ({location.name}): base_path {location.base_path!r} is not a directory, skipped")
+                failed = True
+                continue
+            started = time.perf_counter()
+            counts = scan_location(db, location, pool, args.workers, rules, full=args.full, queue_thumbnails=args.thumbnails)
+            elapsed = time.perf_counter() - started
+            print(f"location {location.id} ({location.name}): {counts['files']} files in {elapsed:.1f}s; "
+                  f"{counts['written']} written, {counts['unchanged']} unchanged, {counts['missing']} missing, "
+                  f"{counts['unmatched']} unmatched, {counts['unreadable']} unreadable, {counts['thumbnails']} thumbnail jobs")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
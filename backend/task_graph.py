@@ -0,0 +1,376 @@
+"""Task dependency graph and critical-path scheduling for one project.
+
+A project's tasks are numbered 0..n-1 and every per-task value lives in a
+flat ``array`` indexed by that number. Successor and predecessor lists are
+small integer arrays per node. Edges come from ``task_dependencies``: an edge
+``a -> b`` means b depends on a, so a has to finish before b can start.
+
+Dates are handled as proleptic ordinals (``date.toordinal()``). A task lasts
+``end_date - start_date + 1`` days (one day when either date is missing), and
+its ``start_date`` is a "not before" constraint:
+
+    earliest_start(v)  = max(start_date(v), earliest_finish(p) for every predecessor p)
+    latest_finish(v)   = min(latest_start(s) for every successor s), or the project finish
+    slack(v)           = latest_start(v) - earliest_start(v); critical when 0
+
+Graphs are cached per project (GRAPH_CACHE_TTL_SECONDS) together with the
+project version (``project_versions.version``, see changes.py) they were
+loaded at, and only served while that is still the current version. A write
+made by this process is applied in place when it is the very next version
+(``apply``): a date change only re-walks the tasks downstream and upstream of
+the changed one. Any other write, from another worker or a path that doesn't
+update the cache (deletes, bulk writes), just moves the version on, and the
+next read reloads the graph.
+
+The cache is never what keeps the stored graph acyclic: ``creates_cycle``
+checks a new edge against the database, inside the write's transaction.
+"""
+import datetime
+import heapq
+import logging
+import os
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import literal, select
+from sqlalchemy.orm import Session, aliased
+
+from . import changes
+from .cache import TTLCache
+from .database import Task, task_dependency
+
+logger = logging.getLogger(__name__)
+
+GRAPH_CACHE_TTL_SECONDS = int(os.getenv("GRAPH_CACHE_TTL_SECONDS", "300"))
+GRAPH_CACHE_MAX_ENTRIES = int(os.getenv("GRAPH_CACHE_MAX_ENTRIES", "100"))
+
+NO_DATE = 0  # ordinals start at 1
+
+
+class CycleError(ValueError):
+    """Adding the edge (or the stored edges) would make the graph cyclic."""
+
+
+def _ordinal(value: Optional[datetime.date]) -> int:
+    return value.toordinal() if value else NO_DATE
+
+
+def _duration(start: int, end: int) -> int:
+    return max(1, end - start + 1) if start and end else 1
+
+
+class TaskGraph:
+    def __init__(self, tasks: Iterable[Tuple[int, Optional[datetime.date], Optional[datetime.date]]], edges: Iterable[Tuple[int, int]]):
+        """``tasks``: (task_id, start_date, end_date). ``edges``: (dependency_on_task_id, dependent_task_id)."""
+        self.lock = threading.RLock()
+        self.ids = array("q")
+        self.index: Dict[int, int] = {}
+        self.start = array("l")
+        self.duration = array("l")
+        for task_id, start_date, end_date in tasks:
+            self._add_node(task_id, start_date, end_date)
+        n = len(self.ids)
+        self.succ: List[array] = [array("l") for _ in range(n)]
+        self.pred: List[array] = [array("l") for _ in range(n)]
+        for before, after in edges:
+            if before in self.index and after in self.index:
+                self.succ[self.index[before]].append(self.index[after])
+                self.pred[self.index[after]].append(self.index[before])
+        self._reorder()
+        self._schedule()
+
+    # --- Construction ---
+    @classmethod
+    def load(cls, db: Session, project_id: int) -> "TaskGraph":
+        tasks = db.execute(
+            select(Task.id, Task.start_date, Task.end_date).where(Task.project_id == project_id).order_by(Task.id)
+        ).all()
+        dependent = aliased(Task)
+        edges = db.execute(
+            select(task_dependency.c.dependency_on_task_id, task_dependency.c.dependent_task_id)
+            .join(dependent, dependent.id == task_dependency.c.dependent_task_id)
+            .where(dependent.project_id == project_id)
+        ).all()
+        return cls(tasks, edges)
+
+    def _add_node(self, task_id: int, start_date, end_date) -> int:
+        v = len(self.ids)
+        self.ids.append(task_id)
+        self.index[task_id] = v
+        start, end = _ordinal(start_date), _ordinal(end_date)
+        self.start.append(start)
+        self.duration.append(_duration(start, end))
+        return v
+
+    # --- Ordering ---
+    def _reorder(self) -> None:
+        """Kahn's algorithm; fills ``order`` and ``position`` (the inverse permutation)."""
+        n = len(self.ids)
+        indegree = array("l", (len(p) for p in self.pred))
+        order = array("l", (v for v in range(n) if indegree[v] == 0))
+        head = 0
+        while head < len(order):
+            for s in self.succ[order[head]]:
+                indegree[s] -= 1
+                if indegree[s] == 0:
+                    order.append(s)
+            head += 1
+        if len(order) != n:
+            stuck = sorted(self.ids[v] for v in range(n) if indegree[v] > 0)
+            raise CycleError(f"Task dependencies contain a cycle through tasks {stuck[:20]}")
+        self.order = order
+        self.position = array("l", [0]) * n
+        for i, v in enumerate(order):
+            self.position[v] = i
+
+    def _reaches(self, source: int, target: int) -> bool:
+        """Whether ``target`` is reachable from ``source``. Only nodes topologically before ``target`` can lead to it."""
+        limit = self.position[target]
+        seen = bytearray(len(self.ids))
+        stack = [source]
+        seen[source] = 1
+        while stack:
+            v = stack.pop()
+            if v == target:
+                return True
+            for s in self.succ[v]:
+                if not seen[s] and self.position[s] <= limit:
+                    seen[s] = 1
+                    stack.append(s)
+        return False
+
+    # --- Scheduling ---
+    def _origin(self) -> int:
+        starts = [s for s in self.start if s]
+        return min(starts) if starts else datetime.date.today().toordinal()
+
+    def _earliest(self, v: int, origin: int) -> int:
+        es = self.start[v] or origin
+        for p in self.pred[v]:
+            es = max(es, self.earliest_start[p] + self.duration[p])
+        return es
+
+    def _latest_finish(self, v: int) -> int:
+        successors = self.succ[v]
+        if not successors:
+            return self.finish
+        return min(self.latest_finish[s] - self.duration[s] for s in successors)
+
+    def _schedule(self) -> None:
+        n = len(self.ids)
+        self.origin = self._origin()
+        self.earliest_start = array("l", [0]) * n
+        for v in self.order:
+            self.earliest_start[v] = self._earliest(v, self.origin)
+        self.finish = max((self.earliest_start[v] + self.duration[v] for v in range(n)), default=self.origin)
+        self._backward_all()
+
+    def _backward_all(self) -> None:
+        self.latest_finish = array("l", [0]) * len(self.ids)
+        for v in reversed(self.order):
+            self.latest_finish[v] = self._latest_finish(v)
+
+    def _forward_from(self, seeds: Iterable[int]) -> None:
+        """Re-derive earliest starts downstream of ``seeds``, stopping where nothing changes."""
+        seeds = set(seeds)
+        heap = [(self.position[v], v) for v in seeds]
+        heapq.heapify(heap)
+        queued = {v for _, v in heap}
+        while heap:
+            _, v = heapq.heappop(heap)
+            queued.discard(v)
+            es = self._earliest(v, self.origin)
+            changed = es != self.earliest_start[v]
+            self.earliest_start[v] = es
+            # A changed duration moves this task's finish even when its start stays put
+            if changed or v in seeds:
+                for s in self.succ[v]:
+                    if s not in queued:
+                        queued.add(s)
+                        heapq.heappush(heap, (self.position[s], s))
+
+    def _backward_from(self, seeds: Iterable[int]) -> None:
+        """Re-derive latest finishes upstream of ``seeds``, stopping where nothing changes."""
+        seeds = set(seeds)
+        heap = [(-self.position[v], v) for v in seeds]
+        heapq.heapify(heap)
+        queued = set(seeds)
+        while heap:
+            _, v = heapq.heappop(heap)
+            queued.discard(v)
+            lf = self._latest_finish(v)
+            changed = lf != self.latest_finish[v]
+            self.latest_finish[v] = lf
+            if changed or v in seeds:
+                for p in self.pred[v]:
+                    if p not in queued:
+                        queued.add(p)
+                        heapq.heappush(heap, (-self.position[p], p))
+
+    def _refresh(self, forward: Iterable[int], backward: Iterable[int]) -> None:
+        origin = self._origin()
+        if origin != self.origin:
+            # Tasks without a start date are anchored to the project start; it moved
+            self._schedule()
+            return
+        self._forward_from(forward)
+        finish = max((self.earliest_start[v] + self.duration[v] for v in range(len(self.ids))), default=self.origin)
+        if finish != self.finish:
+            # Every sink's latest finish is the project finish
+            self.finish = finish
+            self._backward_all()
+        else:
+            self._backward_from(backward)
+
+    # --- Incremental updates ---
+    def update_task(self, task_id: int, start_date, end_date) -> None:
+        with self.lock:
+            v = self.index[task_id]
+            start, end = _ordinal(start_date), _ordinal(end_date)
+            if (start, _duration(start, end)) == (self.start[v], self.duration[v]):
+                return
+            self.start[v], self.duration[v] = start, _duration(start, end)
+            # A new duration changes this task's latest start, and so its predecessors' latest finish
+            self._refresh(forward=[v], backward=[v])
+
+    def add_task(self, task_id: int, start_date, end_date) -> None:
+        with self.lock:
+            v = self._add_node(task_id, start_date, end_date)
+            self.succ.append(array("l")); self.pred.append(array("l"))
+            self.order.append(v); self.position.append(len(self.order) - 1)
+            self.earliest_start.append(0); self.latest_finish.append(0)
+            self._refresh(forward=[v], backward=[v])
+
+    def check_dependency(self, task_id: int, depends_on_id: int) -> None:
+        """Raise CycleError if ``task_id`` may not depend on ``depends_on_id``."""
+        with self.lock:
+            before, after = self.index[depends_on_id], self.index[task_id]
+            if before == after or (self.position[after] <= self.position[before] and self._reaches(after, before)):
+                raise CycleError(f"Task {task_id} cannot depend on task {depends_on_id}: that would create a cycle.")
+
+    def add_dependency(self, task_id: int, depends_on_id: int) -> None:
+        with self.lock:
+            self.check_dependency(task_id, depends_on_id)
+            before, after = self.index[depends_on_id], self.index[task_id]
+            if before in self.pred[after]:
+                return
+            self.succ[before].append(after)
+            self.pred[after].append(before)
+            if self.position[before] > self.position[after]:
+                # Still acyclic, but the stored order no longer respects the new edge
+                self._reorder()
+            self._refresh(forward=[after], backward=[before])
+
+    def remove_dependency(self, task_id: int, depends_on_id: int) -> None:
+        with self.lock:
+            before, after = self.index[depends_on_id], self.index[task_id]
+            if before not in self.pred[after]:
+                return
+            self.succ[before].remove(after)
+            self.pred[after].remove(before)
+            self._refresh(forward=[after], backward=[before])
+
+    # --- Results ---
+    def critical_path(self) -> List[int]:
+        """Task ids of one longest chain through the graph, first to last."""
+        with self.lock:
+            if not self.ids:
+                return []
+            end = max(range(len(self.ids)), key=lambda v: (self.earliest_start[v] + self.duration[v], -self.position[v]))
+            path = [end]
+            while True:
+                v = path[-1]
+                driver = next((p for p in self.pred[v] if self.earliest_start[p] + self.duration[p] == self.earliest_start[v]), None)
+                if driver is None:
+                    break
+                path.append(driver)
+            return [self.ids[v] for v in reversed(path)]
+
+    def schedule(self) -> dict:
+        with self.lock:
+            date = datetime.date.fromordinal
+            tasks = []
+            for v in self.order:
+                es, duration, lf = self.earliest_start[v], self.duration[v], self.latest_finish[v]
+                slack = lf - duration - es
+                tasks.append({
+                    "task_id": self.ids[v],
+                    "duration_days": duration,
+                    "earliest_start": date(es),
+                    "earliest_finish": date(es + duration - 1),
+                    "latest_start": date(lf - duration),
+                    "latest_finish": date(lf - 1),
+                    "slack_days": slack,
+                    "critical": slack == 0,
+                })
+            return {
+                "project_start": date(self.origin),
+                "project_finish": date(self.finish - 1) if self.ids else date(self.origin),
+                "topological_order": [self.ids[v] for v in self.order],
+                "critical_path": self.critical_path(),
+                "tasks": tasks,
+            }
+
+
+# --- Cycle check against the database ---
+def creates_cycle(db: Session, task_id: int, depends_on_id: int) -> bool:
+    """Whether making ``task_id`` depend on ``depends_on_id`` would close a cycle in the stored edges.
+
+    Walks everything ``depends_on_id`` already depends on, directly or not, with a recursive CTE.
+    Call it after ``changes.next_version`` for the project, so the project_versions row lock keeps
+    concurrent edge writes to the project out until this transaction commits.
+    """
+    if task_id == depends_on_id:
+        return True
+    ancestors = select(literal(depends_on_id).label("task_id")).cte("ancestors", recursive=True)
+    ancestors = ancestors.union(
+        select(task_dependency.c.dependency_on_task_id).join(ancestors, task_dependency.c.dependent_task_id == ancestors.c.task_id)
+    )
+    return db.execute(select(ancestors.c.task_id).where(ancestors.c.task_id == task_id).limit(1)).first() is not None
+
+
+# --- Per-project cache ---
+# project_id -> (project version, graph)
+graph_cache = TTLCache(maxsize=GRAPH_CACHE_MAX_ENTRIES, ttl=GRAPH_CACHE_TTL_SECONDS)
+_cache_lock = threading.Lock()
+
+
+def get_graph(db: Session, project_id: int) -> TaskGraph:
+    version = changes.current_version(db, project_id)
+    entry = graph_cache.get(project_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    graph = TaskGraph.load(db, project_id)
+    # Only cache it if no write committed while it loaded; otherwise it may already be ahead of ``version``
+    if changes.current_version(db, project_id) == version:
+        graph_cache.set(project_id, (version, graph))
+    return graph
+
+
+def apply(project_id: int, version: int, change: Callable[[TaskGraph], None]) -> None:
+    """Apply a write committed as ``version`` to the cached graph, or drop the graph if that can't be done exactly.
+
+    Only a graph at ``version - 1`` can take it in place; anything else missed a write. A change that
+    fails (e.g. a task the graph doesn't know) also drops it. Never raises: the write is already committed.
+    """
+    with _cache_lock:
+        entry = graph_cache.get(project_id)
+        if entry is None:
+            return
+        cached_version, graph = entry
+        if cached_version != version - 1:
+            graph_cache.pop(project_id)
+            return
+        try:
+            with graph.lock:
+                change(graph)
+        except Exception:
+            logger.warning("Dropping the cached task graph of project %s after a failed in-place update", project_id, exc_info=True)
+            graph_cache.pop(project_id)
+            return
+        graph_cache.set(project_id, (version, graph))
+
+
+def invalidate_graph(project_id: int) -> None:
+    graph_cache.pop(project_id)
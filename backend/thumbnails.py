@@ -0,0 +1,101 @@
+"""Thumbnail and proxy renditions of image and video files, made by the job queue.
+
+``enqueue_for(db, files)`` adds one ``thumbnails.generate`` job per image or
+video File. The job runs ffmpeg in a worker process of ``python -m
+backend.jobs`` and writes, next to the storage location's files,
+
+    <base_path>/.thumbnails/<file id>.jpg   a THUMBNAIL_WIDTH px wide still
+    <base_path>/.proxies/<file id>.mp4      a PROXY_HEIGHT px H.264 proxy (videos only)
+
+then records the paths on the File row. Renditions are written to a temporary
+name and renamed, so a job that is retried or run twice leaves whole files.
+Each ffmpeg gets FFMPEG_THREADS threads; the runner's per-queue limit and
+process count decide how many run at once.
+"""
+import os
+import subprocess
+from typing import Iterable, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from . import database
+from . import jobs
+from .database import File, StorageLocation
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFMPEG_THREADS = os.getenv("FFMPEG_THREADS", "1")
+FFMPEG_TIMEOUT_SECONDS = float(os.getenv("FFMPEG_TIMEOUT_SECONDS", "3600"))
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", "480"))
+PROXY_HEIGHT = int(os.getenv("PROXY_HEIGHT", "720"))
+THUMBNAIL_DIR = ".thumbnails"
+PROXY_DIR = ".proxies"
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".exr", ".dpx", ".tga", ".bmp", ".webp"}
+VIDEO_EXTENSIONS = {".mov", ".mp4", ".m4v", ".mxf", ".avi", ".mkv", ".webm"}
+
+
+def kind(relative_path: str) -> Optional[str]:
+    extension = os.path.splitext(relative_path)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return "image"
+    if extension in VIDEO_EXTENSIONS:
+        return "video"
+    return None
+
+
+def enqueue_for(db: Session, files: Iterable[File]) -> int:
+    """Queue renditions for the image and video files among ``files`` in the caller's transaction; returns how many."""
+    payloads = [{"file_id": f.id} for f in files if kind(f.relative_path)]
+    jobs.enqueue(db, "thumbnails.generate", payloads)
+    return len(payloads)
+
+
+def _ffmpeg(*args: str) -> None:
+    command = [FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-y", *args]
+    result = subprocess.run(command, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.decode(errors='replace')[-2000:]}")
+
+
+def _render(source: str, target: str, args: List[str]) -> None:
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = f"{target}.{os.getpid()}.tmp{os.path.splitext(target)[1]}"
+    try:
+        _ffmpeg("-i", source, "-threads", FFMPEG_THREADS, *args, partial)
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+@jobs.task("thumbnails.generate", queue="thumbnails")
+def generate(payload: dict) -> None:
+    with database.SessionLocal() as db:
+        file = db.get(File, payload["file_id"])
+        if file is None or file.missing_at is not None:
+            return
+        location = db.get(StorageLocation, file.storage_location_id)
+        file_kind = kind(file.relative_path)
+        source = os.path.join(location.base_path, file.relative_path)
+        # The database connection isn't needed while ffmpeg runs
+        db.close()
+
+        values = {}
+        thumbnail = os.path.join(location.base_path, THUMBNAIL_DIR, f"{file.id}.jpg")
+        # Videos: a frame one second in, or the first one for shorter clips
+        seek = ["-ss", "1"] if file_kind == "video" else []
+        try:
+            _render(source, thumbnail, [*seek, "-frames:v", "1", "-vf", f"scale={THUMBNAIL_WIDTH}:-2"])
+        except RuntimeError:
+            if not seek:
+                raise
+            _render(source, thumbnail, ["-frames:v", "1", "-vf", f"scale={THUMBNAIL_WIDTH}:-2"])
+        values["thumbnail_path"] = os.path.relpath(thumbnail, location.base_path)
+        if file_kind == "video":
+            proxy = os.path.join(location.base_path, PROXY_DIR, f"{file.id}.mp4")
+            _render(source, proxy, ["-vf", f"scale=-2:{PROXY_HEIGHT}", "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+                                    "-pix_fmt", "yuv420p", "-c:a", "aac", "-movflags", "+faststart"])
+            values["proxy_path"] = os.path.relpath(proxy, location.base_path)
+        db.execute(update(File).where(File.id == file.id).values(**values))
+        db.commit()
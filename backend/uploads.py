@@ -0,0 +1,308 @@
+"""Resumable chunked uploads into a storage location, and file downloads.
+
+An upload is created with its final size and destination, then filled by
+chunks addressed by offset:
+
+    POST  /projects/{id}/uploads                 -> {"id": 7, "bytes_received": 0, ...}
+    PATCH /projects/{id}/uploads/7               Upload-Offset: 0
+                                                 Upload-Checksum: sha256 <base64 digest of the chunk>
+    HEAD  /projects/{id}/uploads/7               -> Upload-Offset: <where to continue>
+
+A chunk is streamed straight into ``<base_path>/.uploads/<id>.part`` as it
+arrives. It is never held in memory whole. Its checksum is computed while
+writing. A chunk that fails the checksum, or whose client disconnects, is cut
+off again, so ``bytes_received`` only ever covers verified bytes. Each chunk
+must start at ``bytes_received``; a client that lost track asks HEAD and
+resumes from there.
+
+Only one chunk of an upload is written at a time, across all workers. The
+chunk claims the row (``status`` pending -> receiving) with a conditional
+UPDATE. A claim older than UPLOAD_STALE_SECONDS is treated as abandoned by a
+crashed worker and can be taken over.
+
+When the last byte arrives the part file is renamed into place (same
+filesystem, so no copy) and registered as a File row, exactly as
+storage_scan.py would register it. Images and videos then get a thumbnail
+job (thumbnails.py), so the last PATCH returns without waiting for ffmpeg.
+
+Downloads (GET /files/{id}/content) are served with FileResponse, which
+answers Range requests and uses the server's zero-copy ``pathsend``
+extension where it has one. Behind nginx, set FILE_ACCEL_REDIRECT_PREFIX to
+hand the transfer to nginx (X-Accel-Redirect) and let it sendfile.
+"""
+import base64
+import datetime
+import hashlib
+import os
+import re
+import time
+from typing import AsyncIterator, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from . import database
+from . import storage_scan
+from . import thumbnails
+from .database import Asset, File, FileUpload, Project, Shot, StorageLocation
+
+UPLOAD_STORAGE_LOCATION_ID = os.getenv("UPLOAD_STORAGE_LOCATION_ID")
+UPLOAD_MAX_CHUNK_BYTES = int(os.getenv("UPLOAD_MAX_CHUNK_BYTES", str(256 * 1024 * 1024)))
+UPLOAD_STALE_SECONDS = float(os.getenv("UPLOAD_STALE_SECONDS", "300"))
+# e.g. "/protected-files/": nginx maps <prefix><storage_location_id>/<relative_path> to the file
+FILE_ACCEL_REDIRECT_PREFIX = os.getenv("FILE_ACCEL_REDIRECT_PREFIX")
+PART_DIR = ".uploads"
+WRITE_BLOCK_SIZE = 1024 * 1024
+
+_UNSAFE = re.compile(r'[\x00-\x1f/\\:*?"<>|]')
+
+
+class OffsetMismatch(Exception):
+    """The chunk doesn't start where the upload stands, or another chunk is being written."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}.")
+        self.offset = offset
+
+
+class ChecksumMismatch(ValueError):
+    pass
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _path_part(name: str) -> str:
+    name = _UNSAFE.sub("_", name).strip()
+    if name in ("", ".", ".."):
+        raise ValueError(f"'{name}' cannot be used as a file or directory name.")
+    return name
+
+
+def _default_location(db: Session) -> Optional[StorageLocation]:
+    if UPLOAD_STORAGE_LOCATION_ID:
+        return db.get(StorageLocation, int(UPLOAD_STORAGE_LOCATION_ID))
+    return db.execute(select(StorageLocation).where(StorageLocation.is_active == 1, StorageLocation.base_path.isnot(None))
+                      .order_by(StorageLocation.id).limit(1)).scalar()
+
+
+def create_upload(db: Session, project: Project, filename: str, size_bytes: int, storage_location_id: Optional[int] = None,
+                  shot_id: Optional[int] = None, asset_id: Optional[int] = None) -> FileUpload:
+    """Reserve the destination and return the new upload. Raises ValueError for bad input and FileExistsError if taken."""
+    if size_bytes < 0:
+        raise ValueError("size_bytes must not be negative.")
+    filename = _path_part(os.path.basename(filename or ""))
+    location = db.get(StorageLocation, storage_location_id) if storage_location_id is not None else _default_location(db)
+    if location is None or not location.is_active or not location.base_path or not os.path.isdir(location.base_path):
+        raise ValueError("No usable storage location for uploads.")
+    # Same layout as storage_scan.DEFAULT_RULES, so a later scan maps the file to the same shot/asset
+    directory = [_path_part(project.name)]
+    if shot_id is not None:
+        shot = db.get(Shot, shot_id)
+        if shot is None or shot.project_id != project.id:
+            raise ValueError("Shot not found in this project.")
+        directory += ["shots", _path_part(shot.name)]
+    elif asset_id is not None:
+        asset = db.get(Asset, asset_id)
+        if asset is None or asset.project_id != project.id:
+            raise ValueError("Asset not found in this project.")
+        directory += ["assets", _path_part(asset.name)]
+    relative_path = "/".join(directory + [filename])
+
+    if os.path.exists(os.path.join(location.base_path, relative_path)):
+        raise FileExistsError(f"{relative_path} already exists in {location.name}.")
+    active = db.execute(select(FileUpload.id).where(
+        FileUpload.storage_location_id == location.id, FileUpload.relative_path == relative_path,
+        FileUpload.status.in_(("pending", "receiving")),
+    )).first()
+    if active:
+        raise FileExistsError(f"{relative_path} is already being uploaded (upload {active.id}).")
+
+    upload = FileUpload(project_id=project.id, storage_location_id=location.id, shot_id=shot_id, asset_id=asset_id,
+                        filename=filename, relative_path=relative_path, size_bytes=size_bytes, bytes_received=0, status="pending")
+    db.add(upload); db.flush()
+    os.makedirs(os.path.join(location.base_path, PART_DIR), exist_ok=True)
+    upload.part_path = os.path.join(location.base_path, PART_DIR, f"{upload.id}.part")
+    open(upload.part_path, "wb").close()
+    db.commit(); db.refresh(upload)
+    return upload
+
+
+def parse_checksum(header: Optional[str]) -> bytes:
+    """``Upload-Checksum: sha256 <base64>`` -> raw digest."""
+    algorithm, _, value = (header or "").strip().partition(" ")
+    if algorithm.lower() != "sha256" or not value:
+        raise ValueError("Upload-Checksum must be 'sha256 <base64 digest>'.")
+    try:
+        return base64.b64decode(value.strip(), validate=True)
+    except ValueError:
+        raise ValueError("Upload-Checksum digest is not valid base64.")
+
+
+# --- Chunks ---
+def _claim(project_id: int, upload_id: int, offset: int) -> Optional[FileUpload]:
+    with database.SessionLocal() as db:
+        upload = db.execute(select(FileUpload).where(FileUpload.id == upload_id, FileUpload.project_id == project_id)).scalar()
+        if upload is None:
+            return None
+        stale = _utcnow() - datetime.timedelta(seconds=UPLOAD_STALE_SECONDS)
+        claimed = db.execute(
+            update(FileUpload).where(
+                FileUpload.id == upload_id, FileUpload.bytes_received == offset,
+                or_(FileUpload.status == "pending", (FileUpload.status == "receiving") & (FileUpload.updated_at < stale)),
+            ).values(status="receiving", updated_at=_utcnow())
+        )
+        db.commit()
+        if claimed.rowcount != 1:
+            if upload.status in ("completed", "aborted"):
+                raise ValueError(f"Upload is {upload.status}.")
+            raise OffsetMismatch(upload.bytes_received)
+        db.refresh(upload)
+        db.expunge(upload)
+        return upload
+
+
+def _release(upload_id: int, bytes_received: int) -> None:
+    with database.SessionLocal() as db:
+        db.execute(update(FileUpload).where(FileUpload.id == upload_id, FileUpload.status == "receiving")
+                   .values(status="pending", bytes_received=bytes_received, updated_at=_utcnow()))
+        db.commit()
+
+
+def _touch(upload_id: int) -> None:
+    with database.SessionLocal() as db:
+        db.execute(update(FileUpload).where(FileUpload.id == upload_id, FileUpload.status == "receiving").values(updated_at=_utcnow()))
+        db.commit()
+
+
+def _open_part(part_path: str, offset: int):
+    f = open(part_path, "r+b" if os.path.exists(part_path) else "w+b")
+    # Drop whatever an interrupted chunk left past the verified offset
+    f.truncate(offset)
+    f.seek(offset)
+    return f
+
+
+def _complete(upload_id: int) -> None:
+    """Move the finished part file into place and register it as a File row."""
+    with database.SessionLocal() as db:
+        upload = db.get(FileUpload, upload_id)
+        location = db.get(StorageLocation, upload.storage_location_id)
+        destination = os.path.join(location.base_path, upload.relative_path)
+        # A retry after a failed registration finds the part file already moved (part_path cleared, or
+        # the process died right after the rename); never move anything over the destination then
+        if upload.part_path and os.path.exists(upload.part_path):
+            if os.path.exists(destination):
+                raise FileExistsError(f"{upload.relative_path} already exists in {location.name}.")
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(upload.part_path, destination)
+        if upload.part_path:
+            upload.part_path = None
+            db.commit()
+        st = os.stat(destination)
+        row = storage_scan.file_row(location, upload.relative_path, st.st_size, st.st_mtime_ns, storage_scan.fingerprint(destination),
+                                    (upload.project_id, upload.shot_id, upload.asset_id), _utcnow())
+        storage_scan.upsert_files(db, [row])
+        file = db.execute(select(File).where(File.storage_location_id == location.id,
+                                             File.relative_path == upload.relative_path)).scalar()
+        upload.file_id = file.id
+        thumbnails.enqueue_for(db, [file])
+        upload.status, upload.bytes_received = "completed", upload.size_bytes
+        db.commit()
+
+
+async def _expect_empty(body: AsyncIterator[bytes], checksum: bytes) -> None:
+    async for piece in body:
+        if piece:
+            raise ValueError("Every byte of the upload has been received; only an empty chunk can retry its registration.")
+    if hashlib.sha256().digest() != checksum:
+        raise ChecksumMismatch("Chunk does not match Upload-Checksum.")
+
+
+async def _write_chunk(upload: FileUpload, offset: int, checksum: bytes, body: AsyncIterator[bytes]) -> int:
+    """Write one chunk into the part file at ``offset``; returns its length."""
+    received = 0
+    f = await run_in_threadpool(_open_part, upload.part_path, offset)
+    try:
+        digest = hashlib.sha256()
+        buffer = bytearray()
+        limit = min(UPLOAD_MAX_CHUNK_BYTES, upload.size_bytes - offset)
+        touched = time.monotonic()
+        async for piece in body:
+            received += len(piece)
+            if received > limit:
+                raise ValueError(f"Chunk is larger than {limit} bytes (the rest of the upload, or UPLOAD_MAX_CHUNK_BYTES).")
+            digest.update(piece)
+            buffer += piece
+            if len(buffer) >= WRITE_BLOCK_SIZE:
+                await run_in_threadpool(f.write, bytes(buffer))
+                buffer.clear()
+                # Keep the claim fresh so a slow chunk isn't taken for an abandoned one
+                if time.monotonic() - touched > UPLOAD_STALE_SECONDS / 3:
+                    await run_in_threadpool(_touch, upload.id)
+                    touched = time.monotonic()
+        if buffer:
+            await run_in_threadpool(f.write, bytes(buffer))
+        if digest.digest() != checksum:
+            raise ChecksumMismatch("Chunk does not match Upload-Checksum.")
+        await run_in_threadpool(f.flush)
+    finally:
+        await run_in_threadpool(f.close)
+    return received
+
+
+async def receive_chunk(project_id: int, upload_id: int, offset: int, checksum: bytes, body: AsyncIterator[bytes]) -> Optional[int]:
+    """Append one chunk at ``offset``. Returns the new offset, or None if the upload doesn't exist.
+
+    Raises OffsetMismatch, ChecksumMismatch, or ValueError for a chunk that would overrun the declared size.
+    """
+    upload = await run_in_threadpool(_claim, project_id, upload_id, offset)
+    if upload is None:
+        return None
+    received = 0
+    try:
+        if offset == upload.size_bytes:
+            # Every byte is already there (an empty upload, or a retry of a failed registration). The part
+            # file may already have been moved into place, so it must not be opened, which would recreate it.
+            await _expect_empty(body, checksum)
+        else:
+            received = await _write_chunk(upload, offset, checksum, body)
+    except BaseException:
+        # Nothing of a failed chunk counts; the next one starts at the same offset
+        await run_in_threadpool(_release, upload.id, offset)
+        raise
+    new_offset = offset + received
+    if new_offset < upload.size_bytes:
+        await run_in_threadpool(_release, upload.id, new_offset)
+        return new_offset
+    try:
+        await run_in_threadpool(_complete, upload.id)
+    except BaseException:
+        # Every byte is there; an empty chunk at the final offset retries the registration
+        await run_in_threadpool(_release, upload.id, new_offset)
+        raise
+    return new_offset
+
+
+def abort_upload(db: Session, upload: FileUpload) -> None:
+    if upload.status == "completed":
+        raise ValueError("Upload is already completed.")
+    if upload.part_path and os.path.exists(upload.part_path):
+        os.remove(upload.part_path)
+    upload.status, upload.part_path = "aborted", None
+    db.commit()
+
+
+# --- Downloads ---
+def record_download(db: Session, file_id: int) -> None:
+    db.execute(update(File).where(File.id == file_id).values(download_count=File.download_count + 1, last_downloaded_at=_utcnow()))
+    db.commit()
+
+
+def is_full_download(range_header: Optional[str]) -> bool:
+    """True unless the request asks for a range that starts past the first byte (a seek or a resumed download)."""
+    if not range_header:
+        return True
+    return bool(re.match(r"^\s*bytes\s*=\s*0\s*-", range_header))
@@ -9,11 +9,25 @@ interface Project {
     name: string;
 }
 
+// GET /projects/{id}/stats の集計値 (行を全件取得せずに進捗を表示する)
+interface EntityStats {
+    total: number;
+    by_status: Record<string, number>;
+}
+
+interface ProjectStats {
+    project_id: number;
+    shots: EntityStats;
+    assets: EntityStats;
+    tasks: EntityStats & { by_department: Record<string, number>; by_assignee: Record<string, number> };
+}
+
 const DashboardPage = () => {
     const { account } = useAuth();
     const [projects, setProjects] = useState<Project[]>([]);
     const [isLoading, setIsLoading] = useState(true);
     const [error, setError] = useState('');
+    const [stats, setStats] = useState<Record<number, ProjectStats>>({});
 
     useEffect(() => {
         const fetchProjects = async () => {
@@ -24,6 +38,12 @@ const DashboardPage = () => {
             try {
                 const response = await apiClient.get<Project[]>('/projects/');
                 setProjects(response.data);
+                // 集計は表示を止めないよう、一覧の表示後に個別に取得する
+                response.data.forEach((project) => {
+                    apiClient.get<ProjectStats>(`/projects/${project.id}/stats`)
+                        .then((res) => setStats((prev) => ({ ...prev, [project.id]: res.data })))
+                        .catch((err) => console.error(err));
+                });
             } catch (err) {
                 setError('Failed to fetch projects. You may not be a member of any projects yet.');
                 console.error(err);
@@ -56,6 +76,9 @@ const DashboardPage = () => {
                             <tr style={{ borderBottom: '1px solid #ddd', textAlign: 'left' }}>
                                 <th style={{ padding: '8px' }}>ID</th>
                                 <th style={{ padding: '8px' }}>Project Name</th>
+                                <th style={{ padding: '8px' }}>Shots</th>
+                                <th style={{ padding: '8px' }}>Assets</th>
+                                <th style={{ padding: '8px' }}>Tasks Done</th>
                             </tr>
                         </thead>
                         <tbody>
@@ -68,6 +91,13 @@ const DashboardPage = () => {
                                             {project.name}
                                         </Link>
                                     </td>
+                                    <td style={{ padding: '8px' }}>{stats[project.id]?.shots.total ?? '-'}</td>
+                                    <td style={{ padding: '8px' }}>{stats[project.id]?.assets.total ?? '-'}</td>
+                                    <td style={{ padding: '8px' }}>
+                                        {stats[project.id]
+                                            ? `${stats[project.id].tasks.by_status['done'] ?? 0} / ${stats[project.id].tasks.total}`
+                                            : '-'}
+                                    </td>
                                 </tr>
                             ))}
                         </tbody>
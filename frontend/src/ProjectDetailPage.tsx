@@ -1,12 +1,13 @@
-import React, { useState, useEffect, useCallback, ReactNode } from 'react';
+import React, { useState, useEffect, useCallback, useMemo, useRef, ReactNode } from 'react';
 import { useParams } from 'react-router-dom';
-import apiClient from './api';
+import apiClient, { API_BASE_URL } from './api';
+import { createKeysetDatasource } from './gridDatasource';
 
 // AG Gridのインポート
 import { AgGridReact } from 'ag-grid-react';
 import { ModuleRegistry } from '@ag-grid-community/core';
 import { ClientSideRowModelModule } from '@ag-grid-community/client-side-row-model';
-import { ColDef, CellValueChangedEvent, ICellRendererParams } from 'ag-grid-community';
+import { ColDef, CellValueChangedEvent, ICellRendererParams, IDatasource } from 'ag-grid-community';
 
 // モジュール登録
 ModuleRegistry.registerModules([ClientSideRowModelModule]);
@@ -18,6 +19,8 @@ interface Shot { id: number; name: string; status: string; }
 interface Asset { id: number; name: string; asset_type: string; status: string; }
 interface Task { id: number; name: string; status: string; assigned_to: ProjectMember; }
 interface ProjectDetails { id: number; name: string; status: string; members: ProjectMember[]; shots: Shot[]; assets: Asset[]; }
+// GET /projects/{id}/stats のうちタブの件数に使う部分
+interface ProjectStats { shots: { total: number }; assets: { total: number }; tasks: { total: number }; }
 
 // --- タブコンポーネント (変更なし) ---
 const TabButton = ({ children, onClick, isActive }: { children: ReactNode, onClick: () => void, isActive: boolean }) => (
@@ -30,22 +33,21 @@ const TabButton = ({ children, onClick, isActive }: { children: ReactNode, onCli
 const ProjectDetailPage = () => {
     const { projectId } = useParams<{ projectId: string }>();
     const [project, setProject] = useState<ProjectDetails | null>(null);
-    const [tasks, setTasks] = useState<Task[]>([]);
+    const [totals, setTotals] = useState({ shots: 0, assets: 0, tasks: 0 });
     const [isLoading, setIsLoading] = useState(true);
     const [error, setError] = useState('');
     const [activeTab, setActiveTab] = useState<'shots' | 'assets' | 'tasks' | 'members'>('shots');
 
+    const gridRef = useRef<AgGridReact>(null);
+
     // --- データ取得ロジック ---
+    // プロジェクト情報とメンバーのみ取得し、ショット/アセット/タスクはグリッドが表示範囲だけをページ単位で取得する
     const fetchProjectData = useCallback(async () => {
         if (!projectId) return;
         setIsLoading(true);
         try {
-            const [detailsRes, tasksRes] = await Promise.all([
-                apiClient.get<ProjectDetails>(`/projects/${projectId}`),
-                apiClient.get<Task[]>(`/tasks/project/${projectId}`)
-            ]);
+            const detailsRes = await apiClient.get<ProjectDetails>(`/projects/${projectId}`, { params: { summary: true } });
             setProject(detailsRes.data);
-            setTasks(tasksRes.data);
         } catch (err: any) {
             setError(err.response?.data?.detail || 'Failed to fetch project data.');
         } finally {
@@ -57,6 +59,49 @@ const ProjectDetailPage = () => {
         fetchProjectData();
     }, [fetchProjectData]);
 
+    // メンバー変更の反映用。isLoading を切り替えるとグリッドがアンマウントされ、スクロール位置とブロックキャッシュが失われるので触らない
+    const refreshMembers = useCallback(async () => {
+        if (!projectId) return;
+        try {
+            const detailsRes = await apiClient.get<ProjectDetails>(`/projects/${projectId}`, { params: { summary: true } });
+            setProject(detailsRes.data);
+        } catch (err) {
+            console.error(err);
+        }
+    }, [projectId]);
+
+    // タブの件数は集計表から取得する (各グリッドの total は開いたタブの分しか届かないため)
+    useEffect(() => {
+        if (!projectId) return;
+        apiClient.get<ProjectStats>(`/projects/${projectId}/stats`)
+            .then((res) => setTotals({ shots: res.data.shots.total, assets: res.data.assets.total, tasks: res.data.tasks.total }))
+            .catch((err) => console.error(err));
+    }, [projectId]);
+
+    // --- リアルタイム更新 (SSE) ---
+    // 変更イベントを受けたら、表示中のタブが対象なら表示範囲のブロックだけを再取得する (ポーリング不要)
+    const activeTabRef = useRef(activeTab);
+    useEffect(() => { activeTabRef.current = activeTab; }, [activeTab]);
+    useEffect(() => {
+        const token = localStorage.getItem('accessToken');
+        if (!projectId || !token) return;
+        const source = new EventSource(`${API_BASE_URL}/projects/${projectId}/events?access_token=${encodeURIComponent(token)}`);
+        const refresh = () => gridRef.current?.api.refreshInfiniteCache();
+        source.addEventListener('changes', (event) => {
+            const { changes } = JSON.parse((event as MessageEvent).data) as { changes: { entity: string }[] };
+            if (changes.some((change) => change.entity === activeTabRef.current)) refresh();
+            if (changes.some((change) => change.entity === 'members')) refreshMembers();
+        });
+        source.addEventListener('resync', refresh);
+        return () => source.close();
+    }, [projectId, refreshMembers]);
+
+    const datasources = useMemo<Record<'shots' | 'assets' | 'tasks', IDatasource>>(() => ({
+        shots: createKeysetDatasource<Shot>(`/projects/${projectId}/shots`, (total) => setTotals((t) => ({ ...t, shots: total }))),
+        assets: createKeysetDatasource<Asset>(`/projects/${projectId}/assets`, (total) => setTotals((t) => ({ ...t, assets: total }))),
+        tasks: createKeysetDatasource<Task>(`/projects/${projectId}/tasks`, (total) => setTotals((t) => ({ ...t, tasks: total }))),
+    }), [projectId]);
+
     // --- ★★★ 削除ボタンコンポーネント ★★★ ---
     const DeleteButtonRenderer = (props: ICellRendererParams & { onDelete: (id: number) => void }) => {
         const handleClick = () => {
@@ -70,19 +115,22 @@ const ProjectDetailPage = () => {
     const handleDeleteShot = useCallback(async (shotId: number) => {
         try {
             await apiClient.delete(`/shots/${shotId}`);
-            fetchProjectData(); // データを再取得してグリッドを更新
+            gridRef.current?.api.refreshInfiniteCache(); // 表示中のブロックだけを再取得
         } catch (error) {
             alert('Failed to delete shot.');
             console.error(error);
         }
-    }, [fetchProjectData]);
+    }, []);
 
     // --- AG Gridの列定義 (修正！) ---
-    const defaultColDef: ColDef = { sortable: true, filter: true, resizable: true, floatingFilter: true };
+    // ソートとフィルターはサーバー側で処理する (name は前方一致、その他は完全一致)
+    const defaultColDef: ColDef = { sortable: true, filter: false, resizable: true, floatingFilter: true };
+    const prefixFilter: ColDef = { filter: 'agTextColumnFilter', filterParams: { filterOptions: ['startsWith'], maxNumConditions: 1 } };
+    const equalsFilter: ColDef = { filter: 'agTextColumnFilter', filterParams: { filterOptions: ['equals'], maxNumConditions: 1 } };
     const [shotColDefs] = useState<ColDef[]>([
         { field: 'id', width: 80, editable: false },
-        { field: 'name', flex: 1, editable: true },
-        { field: 'status', width: 150, editable: true },
+        { field: 'name', flex: 1, editable: true, ...prefixFilter },
+        { field: 'status', width: 150, editable: true, ...equalsFilter },
         { 
             headerName: 'Actions', 
             width: 100, 
@@ -93,16 +141,16 @@ const ProjectDetailPage = () => {
         }
     ]);
     // (他のColDefsは変更なし)
-    const [assetColDefs] = useState<ColDef[]>([ { field: 'id', width: 100 }, { field: 'name', flex: 1 }, { field: 'asset_type', width: 180 }, { field: 'status', width: 150 } ]);
-    const [taskColDefs] = useState<ColDef[]>([ { field: 'id', width: 100 }, { field: 'name', flex: 1 }, { field: 'status', width: 150 }, { field: 'assigned_to.display_name', headerName: 'Assigned To', flex: 1 } ]);
-    const [memberColDefs] = useState<ColDef[]>([ { field: 'display_name', headerName: 'Name', flex: 1 }, { field: 'department', width: 180 }, { field: 'role', width: 180 }, { field: 'account.display_name', headerName: 'Linked Account', flex: 1, valueFormatter: p => p.value || 'N/A' } ]);
+    const [assetColDefs] = useState<ColDef[]>([ { field: 'id', width: 100 }, { field: 'name', flex: 1, ...prefixFilter }, { field: 'asset_type', width: 180, ...equalsFilter }, { field: 'status', width: 150, ...equalsFilter } ]);
+    const [taskColDefs] = useState<ColDef[]>([ { field: 'id', width: 100 }, { field: 'name', flex: 1, ...prefixFilter }, { field: 'status', width: 150, ...equalsFilter }, { field: 'assigned_to.display_name', headerName: 'Assigned To', flex: 1, sortable: false } ]);
+    const [memberColDefs] = useState<ColDef[]>([ { field: 'display_name', headerName: 'Name', flex: 1, filter: true }, { field: 'department', width: 180, filter: true }, { field: 'role', width: 180, filter: true }, { field: 'account.display_name', headerName: 'Linked Account', flex: 1, filter: true, valueFormatter: p => p.value || 'N/A' } ]);
 
     // --- インライン編集のハンドラ (変更なし) ---
     const onShotCellValueChanged = useCallback(async (event: CellValueChangedEvent) => {
         const { id, ...updatedData } = event.data;
         try { await apiClient.put(`/shots/${id}`, updatedData); } 
-        catch (error) { alert('Failed to update shot.'); console.error(error); fetchProjectData(); }
-    }, [fetchProjectData]);
+        catch (error) { alert('Failed to update shot.'); console.error(error); gridRef.current?.api.refreshInfiniteCache(); }
+    }, []);
 
     const renderGrid = (rowData: any[], columnDefs: ColDef[], onCellValueChanged?: (event: CellValueChangedEvent) => void) => (
         <div className="ag-theme-alpine" style={{ height: '100%', width: '100%' }}>
@@ -110,6 +158,24 @@ const ProjectDetailPage = () => {
         </div>
     );
 
+    // Infinite Row Model: 表示範囲のブロックだけをサーバーから取得する
+    // (ブロックは順番に読む必要があるため同時リクエスト数は1に制限)
+    const renderServerGrid = (datasource: IDatasource, columnDefs: ColDef[], onCellValueChanged?: (event: CellValueChangedEvent) => void) => (
+        <div className="ag-theme-alpine" style={{ height: '100%', width: '100%' }}>
+            <AgGridReact
+                ref={gridRef}
+                rowModelType="infinite"
+                datasource={datasource}
+                cacheBlockSize={100}
+                maxConcurrentDatasourceRequests={1}
+                getRowId={(params) => String(params.data.id)}
+                columnDefs={columnDefs}
+                defaultColDef={defaultColDef}
+                onCellValueChanged={onCellValueChanged}
+            />
+        </div>
+    );
+
     if (isLoading) return <p>Loading project details...</p>;
     if (error) return <p style={{ color: 'red' }}>Error: {error}</p>;
     if (!project) return <p>Project not found.</p>;
@@ -118,15 +184,15 @@ const ProjectDetailPage = () => {
         <div style={{ display: 'flex', flexDirection: 'column', height: '100%' }}>
             <h1>Project: {project.name}</h1>
             <div style={{ borderBottom: '1px solid #ddd' }}>
-                <TabButton onClick={() => setActiveTab('shots')} isActive={activeTab === 'shots'}>Shots ({project.shots.length})</TabButton>
-                <TabButton onClick={() => setActiveTab('assets')} isActive={activeTab === 'assets'}>Assets ({project.assets.length})</TabButton>
-                <TabButton onClick={() => setActiveTab('tasks')} isActive={activeTab === 'tasks'}>Tasks ({tasks.length})</TabButton>
+                <TabButton onClick={() => setActiveTab('shots')} isActive={activeTab === 'shots'}>Shots ({totals.shots})</TabButton>
+                <TabButton onClick={() => setActiveTab('assets')} isActive={activeTab === 'assets'}>Assets ({totals.assets})</TabButton>
+                <TabButton onClick={() => setActiveTab('tasks')} isActive={activeTab === 'tasks'}>Tasks ({totals.tasks})</TabButton>
                 <TabButton onClick={() => setActiveTab('members')} isActive={activeTab === 'members'}>Members ({project.members.length})</TabButton>
             </div>
             <div style={{ flex: 1, paddingTop: '20px' }}>
-                {activeTab === 'shots' && renderGrid(project.shots, shotColDefs, onShotCellValueChanged)}
-                {activeTab === 'assets' && renderGrid(project.assets, assetColDefs)}
-                {activeTab === 'tasks' && renderGrid(tasks, taskColDefs)}
+                {activeTab === 'shots' && renderServerGrid(datasources.shots, shotColDefs, onShotCellValueChanged)}
+                {activeTab === 'assets' && renderServerGrid(datasources.assets, assetColDefs)}
+                {activeTab === 'tasks' && renderServerGrid(datasources.tasks, taskColDefs)}
                 {activeTab === 'members' && renderGrid(project.members, memberColDefs)}
             </div>
         </div>
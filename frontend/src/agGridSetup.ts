@@ -6,6 +6,11 @@ import { ClientSideRowModelModule } from '@ag-grid-community/client-side-row-mod
 // アプリケーション全体でAG Gridが使う機能モジュールを登録します。
 // これをアプリケーションの入り口で一度だけ実行することで、
 // ソートやフィルターなどの基本機能が有効になります。
+//
+// ショット/アセット/タスクの一覧は、サーバー側でページング・ソート・フィルターを行う
+// Infinite Row Model (rowModelType="infinite") で表示します (gridDatasource.ts を参照)。
+// Server-Side Row ModelはEnterprise版のみのため使いません。Infinite Row Modelは
+// ag-grid-community パッケージに同梱され、自動的に登録されます。
 ModuleRegistry.registerModules([
   ClientSideRowModelModule,
-]);
\ No newline at end of file
+]);
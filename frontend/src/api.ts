@@ -1,11 +1,15 @@
 import axios from 'axios';
 
-const API_BASE_URL = 'http://127.0.0.1:8000';
+export const API_BASE_URL = 'http://127.0.0.1:8000';
 
 const apiClient = axios.create({
     baseURL: API_BASE_URL,
 });
 
+// 書き込み直後の読み取りをプライマリ DB に向けるため、サーバーが返す期限をそのまま送り返す (backend/replicas.py)
+const PRIMARY_UNTIL_HEADER = 'X-MOTK-Primary-Until';
+const PRIMARY_UNTIL_KEY = 'primaryUntil';
+
 // リクエスト毎にローカルストレージからトークンを取得し、ヘッダーに付与する
 apiClient.interceptors.request.use(
     (config) => {
@@ -13,6 +17,10 @@ apiClient.interceptors.request.use(
         if (token) {
             config.headers.Authorization = `Bearer ${token}`;
         }
+        const primaryUntil = localStorage.getItem(PRIMARY_UNTIL_KEY);
+        if (primaryUntil) {
+            config.headers[PRIMARY_UNTIL_HEADER] = primaryUntil;
+        }
         return config;
     },
     (error) => {
@@ -20,4 +28,23 @@ apiClient.interceptors.request.use(
     }
 );
 
+// 失敗した書き込みでもコミット済みの場合があるので、エラー応答の期限も保存する
+const rememberPrimaryUntil = (headers?: Record<string, any>) => {
+    const primaryUntil = headers?.[PRIMARY_UNTIL_HEADER.toLowerCase()];
+    if (primaryUntil) {
+        localStorage.setItem(PRIMARY_UNTIL_KEY, primaryUntil);
+    }
+};
+
+apiClient.interceptors.response.use(
+    (response) => {
+        rememberPrimaryUntil(response.headers);
+        return response;
+    },
+    (error) => {
+        rememberPrimaryUntil(error.response?.headers);
+        return Promise.reject(error);
+    }
+);
+
 export default apiClient;
@@ -11,6 +11,7 @@ interface Task {
   assigned_to_id?: number;
   shot_id?: number;
   asset_id?: number;
+  project_id?: number;
   
   assigned_to?: { id: number; username: string; }; // 関連ユーザー
   shot?: { id: number; name: string; }; // 関連ショット
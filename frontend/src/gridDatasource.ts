@@ -0,0 +1,73 @@
+import { IDatasource, IGetRowsParams, SortModelItem } from 'ag-grid-community';
+import apiClient from './api';
+
+// バックエンドのページングAPI (GET /projects/{id}/shots など) のレスポンス型
+export interface Page<T> {
+    rows: T[];
+    next_cursor: string | null;
+    total: number | null;
+}
+
+// AG Gridの列フィルター → APIのクエリパラメータ
+// name は前方一致 (name_prefix)、それ以外は完全一致のみサーバー側で対応する
+const buildQuery = (sortModel: SortModelItem[], filterModel: any): Record<string, string> => {
+    const query: Record<string, string> = {};
+    if (sortModel.length > 0) {
+        query.sort = sortModel[0].colId;
+        query.order = sortModel[0].sort;
+    }
+    Object.entries(filterModel || {}).forEach(([field, model]: [string, any]) => {
+        if (!model?.filter) return;
+        if (field === 'name') query.name_prefix = String(model.filter);
+        else query[field] = String(model.filter);
+    });
+    return query;
+};
+
+/**
+ * カーソル (keyset) 方式のページングAPIを、AG GridのInfinite Row Modelに接続するデータソース。
+ * AG Gridは startRow/endRow で行ブロックを要求するので、ブロック開始行ごとにカーソルを覚えておき、
+ * 未知のブロックへジャンプした場合は最も近い既知のカーソルから順に読み進める。
+ */
+export const createKeysetDatasource = <T,>(path: string, onTotal?: (total: number) => void): IDatasource => {
+    let cursors = new Map<number, string | null>([[0, null]]);
+    let lastQueryKey = '';
+
+    return {
+        getRows: async (params: IGetRowsParams) => {
+            const query = buildQuery(params.sortModel, params.filterModel);
+            const queryKey = JSON.stringify(query);
+            if (queryKey !== lastQueryKey) {
+                // ソート/フィルターが変わったらカーソルは無効
+                cursors = new Map([[0, null]]);
+                lastQueryKey = queryKey;
+            }
+            const limit = params.endRow - params.startRow;
+            let start = Math.max(...Array.from(cursors.keys()).filter((row) => row <= params.startRow));
+            try {
+                while (true) {
+                    const cursor = cursors.get(start);
+                    const res = await apiClient.get<Page<T>>(path, {
+                        params: { ...query, limit, ...(cursor ? { cursor } : {}), ...(start === 0 && onTotal ? { with_total: true } : {}) },
+                    });
+                    const { rows, next_cursor, total } = res.data;
+                    if (total !== null && onTotal) onTotal(total);
+                    const end = start + rows.length;
+                    if (next_cursor) cursors.set(end, next_cursor);
+                    if (start >= params.startRow) {
+                        params.successCallback(rows, next_cursor ? -1 : end);
+                        return;
+                    }
+                    if (!next_cursor) {
+                        params.successCallback([], end);
+                        return;
+                    }
+                    start = end;
+                }
+            } catch (error) {
+                console.error(error);
+                params.failCallback();
+            }
+        },
+    };
+};
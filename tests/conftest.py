@@ -0,0 +1,17 @@
+import os
+import tempfile
+
+import pytest
+
+# backend.database reads DATABASE_URL at import time
+_db_dir = tempfile.mkdtemp(prefix="motk_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+
+from backend import database  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    database.Base.metadata.create_all(database.engine)
+    yield
+    database.engine.dispose()
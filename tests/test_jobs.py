@@ -0,0 +1,65 @@
+import os
+import signal
+import threading
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from backend import database, jobs
+from backend.database import Job
+
+
+@jobs.task("tests.noop")
+def noop(payload: dict) -> None:
+    pass
+
+
+def _failing_once(monkeypatch, name: str, calls: list, after=None):
+    """Make ``jobs.<name>`` raise a database error on its first call, then behave normally."""
+    real = getattr(jobs, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(name)
+        if calls.count(name) == 1:
+            raise OperationalError(name, {}, Exception("database is unavailable"))
+        result = real(*args, **kwargs)
+        if after:
+            after()
+        return result
+    monkeypatch.setattr(jobs, name, wrapper)
+
+
+@pytest.fixture
+def restore_signals():
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGTERM, signal.SIGINT)}
+    yield
+    for sig, handler in handlers.items():
+        signal.signal(sig, handler)
+
+
+def test_runner_survives_database_errors(monkeypatch, restore_signals):
+    with database.SessionLocal() as db:
+        db.query(Job).delete()
+        jobs.enqueue(db, "tests.noop", [{}])
+        db.commit()
+
+    calls = []
+    stop = lambda: os.kill(os.getpid(), signal.SIGTERM)
+    _failing_once(monkeypatch, "requeue_expired", calls)
+    _failing_once(monkeypatch, "claim", calls)
+    # Stop the runner once the outcome has been recorded
+    _failing_once(monkeypatch, "finish", calls, after=stop)
+    # Never hang the test run if the runner doesn't get there
+    watchdog = threading.Timer(30, stop)
+    watchdog.start()
+    try:
+        jobs.run({"default": 1}, 1, poll_seconds=0.05)
+    finally:
+        watchdog.cancel()
+
+    assert calls.count("claim") >= 2
+    assert calls.count("finish") == 2  # the first attempt failed and was retried
+    assert calls.count("requeue_expired") == 2
+    with database.SessionLocal() as db:
+        job = db.query(Job).one()
+        assert (job.status, job.attempts, job.locked_by) == ("succeeded", 1, None)
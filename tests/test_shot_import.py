@@ -0,0 +1,73 @@
+import datetime
+import io
+
+import pytest
+from sqlalchemy import func, select, update
+
+from backend import database, shot_import
+from backend.database import Organization, Project, Shot, ShotImport
+
+
+@pytest.fixture
+def project_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(shot_import, "IMPORT_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(shot_import, "IMPORT_CHUNK_SIZE", 500)
+    with database.SessionLocal() as db:
+        organization = Organization(name=f"org-{tmp_path.name}")
+        db.add(organization); db.flush()
+        project = Project(name="P1", organization_id=organization.id)
+        db.add(project); db.commit()
+        return project.id
+
+
+def _records(names):
+    return [{"entity": "shot", "name": name, "status": None, "asset_type": None} for name in names]
+
+
+def _shot_count(db, project_id, name=None):
+    query = select(func.count()).select_from(Shot).where(Shot.project_id == project_id)
+    if name is not None:
+        query = query.where(Shot.name == name)
+    return db.execute(query).scalar()
+
+
+def test_stale_running_import_is_taken_over_and_the_old_worker_stops(project_id):
+    names = [f"sh{i:04d}" for i in range(1200)]
+    with database.SessionLocal() as db:
+        job = shot_import.create_import(db, project_id, "shots.csv", io.BytesIO(("name\n" + "\n".join(names) + "\n").encode()))
+        job_id = job.id
+
+    # The first worker claims the import, commits one chunk, then stalls (or dies)
+    old_worker = database.SessionLocal()
+    try:
+        old_worker.execute(update(ShotImport).where(ShotImport.id == job_id).values(status="running"))
+        old_worker.commit()
+        old_job = old_worker.get(ShotImport, job_id)
+        old_worker.expunge(old_job)
+        committed = shot_import._commit_chunk(old_worker, old_job, _records(names[:500]), 0, 0)
+        assert committed == 500
+
+        with database.SessionLocal() as db:
+            job = db.get(ShotImport, job_id)
+            # Still fresh: not resumable yet
+            assert not shot_import.claim_for_resume(db, job)
+            stale = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=shot_import.IMPORT_STALE_SECONDS + 60)
+            db.execute(update(ShotImport).where(ShotImport.id == job_id).values(updated_at=stale))
+            db.commit()
+            assert shot_import.claim_for_resume(db, job)
+
+        shot_import.run_import(job_id)
+        with database.SessionLocal() as db:
+            job = db.get(ShotImport, job_id)
+            assert (job.status, job.records_committed, job.shots_created) == ("completed", 1200, 1200)
+            assert _shot_count(db, project_id) == 1200
+
+        # The old worker wakes up and tries to commit its next chunk
+        with pytest.raises(shot_import.ImportSuperseded):
+            shot_import._commit_chunk(old_worker, old_job, _records(["late-shot"]), 0, committed)
+    finally:
+        old_worker.close()
+    with database.SessionLocal() as db:
+        assert _shot_count(db, project_id, "late-shot") == 0
+        job = db.get(ShotImport, job_id)
+        assert (job.status, job.records_committed) == ("completed", 1200)
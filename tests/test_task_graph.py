@@ -0,0 +1,76 @@
+import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from backend import changes, database, task_graph
+from backend.database import Organization, Project, Task, task_dependency
+
+
+@pytest.fixture
+def project(tmp_path):
+    """A project with tasks a -> b -> c (b depends on a, c on b)."""
+    with database.SessionLocal() as db:
+        organization = Organization(name=f"org-{tmp_path.name}")
+        db.add(organization); db.flush()
+        project = Project(name="P1", organization_id=organization.id)
+        db.add(project); db.flush()
+        day = datetime.date(2026, 1, 5)
+        tasks = [Task(name=name, project_id=project.id, start_date=day, end_date=day) for name in "abc"]
+        db.add_all(tasks); db.flush()
+        a, b, c = (t.id for t in tasks)
+        db.execute(insert(task_dependency), [{"dependent_task_id": b, "dependency_on_task_id": a},
+                                             {"dependent_task_id": c, "dependency_on_task_id": b}])
+        db.commit()
+        yield project.id, a, b, c
+    task_graph.invalidate_graph(project.id)
+
+
+def _duration(graph, task_id):
+    return next(t["duration_days"] for t in graph.schedule()["tasks"] if t["task_id"] == task_id)
+
+
+def test_edge_closing_a_cycle_is_rejected(project):
+    _, a, b, c = project
+    with database.SessionLocal() as db:
+        assert task_graph.creates_cycle(db, a, c)  # a would depend on c, which depends on a through b
+        assert task_graph.creates_cycle(db, a, a)
+        assert not task_graph.creates_cycle(db, c, a)
+        assert not task_graph.creates_cycle(db, b, a)
+
+
+def test_graph_is_rebuilt_after_writes_it_missed(project):
+    project_id, a, b, c = project
+    with database.SessionLocal() as db:
+        cached = task_graph.get_graph(db, project_id)
+        assert task_graph.get_graph(db, project_id) is cached
+        version = changes.current_version(db, project_id)
+
+    # Another session (another worker) writes twice; this process sees neither write
+    with database.SessionLocal() as other:
+        changes.next_version(other, project_id)
+        other.commit()
+        other.get(Task, c).end_date = datetime.date(2026, 1, 14)
+        other.commit()
+        assert changes.current_version(other, project_id) == version + 2
+
+    patched = []
+    task_graph.apply(project_id, version + 2, lambda graph: patched.append(graph))
+    assert patched == []  # not applied in place: the cached graph is two versions behind
+
+    with database.SessionLocal() as db:
+        rebuilt = task_graph.get_graph(db, project_id)
+    assert rebuilt is not cached
+    assert _duration(rebuilt, c) == 10
+
+
+def test_next_write_is_applied_in_place(project):
+    project_id, a, b, c = project
+    with database.SessionLocal() as db:
+        cached = task_graph.get_graph(db, project_id)
+        task = db.get(Task, c)
+        task.end_date = datetime.date(2026, 1, 9)
+        db.commit()
+        task_graph.apply(project_id, task.change_seq, lambda graph: graph.update_task(c, task.start_date, task.end_date))
+        assert task_graph.get_graph(db, project_id) is cached
+    assert _duration(cached, c) == 5
@@ -0,0 +1,56 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from backend import database, storage_scan, uploads
+from backend.database import FileUpload, Organization, Project, StorageLocation
+
+
+async def _body(data: bytes):
+    yield data
+
+
+def _send(upload: FileUpload, offset: int, data: bytes):
+    return asyncio.run(uploads.receive_chunk(upload.project_id, upload.id, offset, hashlib.sha256(data).digest(), _body(data)))
+
+
+@pytest.fixture
+def upload(tmp_path):
+    with database.SessionLocal() as db:
+        organization = Organization(name=f"org-{tmp_path.name}")
+        db.add(organization); db.flush()
+        project = Project(name="P1", organization_id=organization.id)
+        location = StorageLocation(name=f"loc-{tmp_path.name}", location_type="local", base_path=str(tmp_path), is_active=1)
+        db.add_all([project, location]); db.commit()
+        upload = uploads.create_upload(db, project, "a.bin", 1100, storage_location_id=location.id)
+        db.expunge(upload)
+        return upload
+
+
+def test_retry_after_failed_registration_keeps_the_uploaded_bytes(upload, monkeypatch, tmp_path):
+    data = os.urandom(1100)
+    assert _send(upload, 0, data[:600]) == 600
+
+    real_upsert = storage_scan.upsert_files
+    def failing_upsert(db, rows):
+        raise RuntimeError("database went away")
+    monkeypatch.setattr(storage_scan, "upsert_files", failing_upsert)
+    with pytest.raises(RuntimeError):
+        _send(upload, 600, data[600:])
+    destination = tmp_path / "P1" / "a.bin"
+    assert destination.read_bytes() == data
+
+    monkeypatch.setattr(storage_scan, "upsert_files", real_upsert)
+    with pytest.raises(ValueError):
+        _send(upload, 1100, b"x")
+    # The documented retry: an empty chunk at the final offset
+    assert _send(upload, 1100, b"") == 1100
+    assert destination.read_bytes() == data
+    assert not os.path.exists(upload.part_path)
+    with database.SessionLocal() as db:
+        row = db.get(FileUpload, upload.id)
+        assert (row.status, row.part_path, row.bytes_received) == ("completed", None, 1100)
+        assert row.file_id is not None
+